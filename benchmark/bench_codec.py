@@ -0,0 +1,103 @@
+'''
+Benchmark JSON round trip throughput on a large database.json.
+
+Compares each available JSON library, and TinyDB's JSONStorage against
+fashion's CodecStorage, on a generated database or an existing one:
+
+    python benchmark/bench_codec.py [--records N] [--database path/to/database.json]
+
+Created on 2019-01-18 Copyright (c) 2019 Bradford Dillman
+'''
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from tinydb.storages import JSONStorage
+
+from fashion import codec
+from fashion.codec import CodecStorage
+
+
+def makeDatabase(records):
+    '''Make a database with a few kinds of typical model records.'''
+    data = {}
+    for k in range(4):
+        data["bench.kind{0}".format(k)] = {
+            str(i): {
+                "name": "model{0}".format(i),
+                "index": i,
+                "scale": i / 7.0,
+                "enabled": i % 2 == 0,
+                "tags": ["a", "b", "c"],
+                "child": {"description": "a child object " * 4, "value": i}
+            } for i in range(1, records // 4 + 1)}
+    return data
+
+
+def timeIt(func, repeat=3):
+    '''Best time of several runs.'''
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def report(name, size, seconds):
+    print("{0:<24} {1:8.3f}s {2:8.1f} MB/s".format(
+        name, seconds, size / seconds / 1e6))
+
+
+def benchLibraries(data, size):
+    '''Round trip dumps and loads with each library.'''
+    libs = [("json", json.dumps, json.loads)]
+    if codec.ujson is not None:
+        libs.append(("ujson", codec.ujson.dumps, codec.ujson.loads))
+    if codec.orjson is not None:
+        libs.append(("orjson", codec.orjson.dumps, codec.orjson.loads))
+    libs.append(("codec ({0})".format(codec.name), codec.dumps, codec.loads))
+    for name, dumps, loads in libs:
+        report(name, size, timeIt(lambda: loads(dumps(data))))
+
+
+def benchStorages(data, size):
+    '''Round trip write and read with each TinyDB storage.'''
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, cls in [("JSONStorage", JSONStorage),
+                          ("CodecStorage", CodecStorage)]:
+            storage = cls(os.path.join(tmp, name + ".json"))
+
+            def roundTrip():
+                storage.write(data)
+                storage.read()
+            report(name, size, timeIt(roundTrip))
+            storage.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--records', type=int, default=200000,
+                        help='number of generated records')
+    parser.add_argument('--database', help='existing database.json to use')
+    args = parser.parse_args()
+    if args.database:
+        with open(args.database, 'r') as fd:
+            data = json.loads(fd.read())
+    else:
+        data = makeDatabase(args.records)
+    size = len(json.dumps(data))
+    print("database size {0:.1f} MB".format(size / 1e6))
+    benchLibraries(data, size)
+    benchStorages(data, size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+'''
+Benchmark the cost of build events.
+
+Times bulk ModelAccess inserts, which emit model.inserted for every record,
+with no subscribers and with one, and the cost of an unguarded emit with no
+subscribers:
+
+    python benchmark/bench_events.py [--records N]
+
+Created on 2019-01-30 Copyright (c) 2019 Bradford Dillman
+'''
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from munch import Munch
+
+from fashion.databaseAccess import DatabaseAccess
+from fashion.events import MODEL_INSERTED, XFORM_STARTED, bus
+from fashion.modelAccess import ModelAccess
+from fashion.schema import SchemaRepository
+
+
+def timeIt(func, repeat=3):
+    '''Best time of several runs.'''
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records", type=int, default=100000,
+                        help="records inserted per run")
+    args = parser.parse_args()
+
+    ctx = Munch(name="bench", inputKinds=[], outputKinds=["bench.item"])
+    with tempfile.TemporaryDirectory() as tmp:
+        dba = DatabaseAccess(os.path.join(tmp, "db.json"))
+        models = [{"i": i} for i in range(args.records)]
+
+        def inserts():
+            with ModelAccess(dba, SchemaRepository(), ctx) as mdb:
+                mdb.insertMultiple("bench.item", models)
+
+        def emits():
+            for _ in range(args.records):
+                bus.emit(XFORM_STARTED, None)
+
+        seen = []
+        handler = lambda event, kind, id, model: seen.append(id)
+        for label, func, subscribed in [
+                ("insert, no subscribers", inserts, False),
+                ("insert, 1 subscriber", inserts, True),
+                ("emit, no subscribers", emits, False)]:
+            if subscribed:
+                bus.subscribe(MODEL_INSERTED, handler)
+            seconds = timeIt(func)
+            bus.unsubscribe(MODEL_INSERTED, handler)
+            print("{0:<24} {1:8.3f}s {2:12.0f} /s".format(
+                label, seconds, args.records / seconds))
+        dba.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+'''
+Benchmark CodeRegistry.getService resolution.
+
+Compares the registry's pre-sorted, memoised lookups against parsing and
+sorting every version on each call, for the lookups made per generated file:
+
+    python benchmark/bench_registry.py [--versions N] [--lookups N]
+
+Created on 2019-01-26 Copyright (c) 2019 Bradford Dillman
+'''
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from munch import Munch
+from packaging.specifiers import SpecifierSet
+from packaging.version import Version
+
+from fashion.codeRegistry import CodeRegistry
+from fashion.databaseAccess import DatabaseAccess
+
+NAMES = ["fashion.prime.modelAccess", "fashion.core.mirror", "fashion.core.template"]
+
+
+def unsortedGetService(servicesByName, serviceName, versionSpec=None):
+    '''Resolve a service by parsing and sorting every version.'''
+    services = servicesByName[serviceName]
+    ranked = sorted([(Version(s.version), s) for s in services],
+                    key=lambda vs: vs[0], reverse=True)
+    if versionSpec is None:
+        return ranked[0][1]
+    spec = SpecifierSet(versionSpec)
+    matches = [vs for vs in ranked if vs[0] in spec]
+    return matches[0][1] if matches else None
+
+
+def timeIt(func, repeat=3):
+    '''Best time of several runs.'''
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--versions", type=int, default=5,
+                        help="versions registered per service name")
+    parser.add_argument("--lookups", type=int, default=20000,
+                        help="lookups of each service name")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        registry = CodeRegistry(DatabaseAccess(os.path.join(tmp, "db.json")))
+        for name in NAMES:
+            for v in range(args.versions):
+                registry.addService(Munch(name=name, version="1.{0}.0".format(v)))
+        specs = [None, ">=1.0"]
+
+        def baseline():
+            for _ in range(args.lookups):
+                for name in NAMES:
+                    for spec in specs:
+                        unsortedGetService(registry.servicesByName, name, spec)
+
+        def indexed():
+            for _ in range(args.lookups):
+                for name in NAMES:
+                    for spec in specs:
+                        registry.getService(name, spec)
+
+        count = args.lookups * len(NAMES) * len(specs)
+        for label, func in [("sort per call", baseline), ("indexed", indexed)]:
+            seconds = timeIt(func)
+            print("{0:<16} {1:8.3f}s {2:12.0f} lookups/s".format(
+                label, seconds, count / seconds))
+
+
+if __name__ == "__main__":
+    main()
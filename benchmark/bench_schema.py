@@ -0,0 +1,96 @@
+'''
+Benchmark ModelAccessContext.insert throughput with schema validation.
+
+Compares no schema, the generic jsonschema validator and a compiled validator
+for a typical flat schema. The kind uses columnar storage, so the cost of
+TinyDB copying the table on each insert doesn't hide the validation cost:
+
+    python benchmark/bench_schema.py [--records N]
+
+Created on 2019-01-23 Copyright (c) 2019 Bradford Dillman
+'''
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from munch import Munch
+
+from fashion import codec
+from fashion.columnar import columnSpec
+from fashion.databaseAccess import DatabaseAccess
+from fashion.modelAccess import ModelAccessContext
+from fashion.schema import SchemaRepository
+
+schema = {
+    "type": "object",
+    "required": ["name", "address"],
+    "properties": {
+        "name": {"type": "string", "pattern": "^[A-Z][A-Z0-9_]*$"},
+        "address": {"type": "integer", "minimum": 0},
+        "width": {"type": "integer", "minimum": 1, "maximum": 64},
+        "access": {"type": "string", "enum": ["ro", "rw", "wo"]},
+        "description": {"type": "string", "maxLength": 200}
+    },
+    "additionalProperties": False
+}
+
+
+class BenchContext(object):
+    name = "bench"
+    inputKinds = []
+    outputKinds = ["bench.register"]
+
+
+def makeModels(records):
+    return [{"name": "REG_{0}".format(i), "address": i * 4, "width": 32,
+             "access": "rw", "description": "register number {0}".format(i)}
+            for i in range(records)]
+
+
+def insertAll(tmp, repo, models):
+    '''Time inserting all models into a new database.'''
+    dba = DatabaseAccess(os.path.join(tmp, "bench.json"))
+    dba.setColumnar("bench.register", columnSpec(schema))
+    ctx = ModelAccessContext(dba, repo, BenchContext())
+    start = time.perf_counter()
+    for model in models:
+        ctx.insert("bench.register", model)
+    elapsed = time.perf_counter() - start
+    dba.db.close()
+    os.remove(os.path.join(tmp, "bench.json"))
+    return elapsed
+
+
+def bench(tmp, name, compile, models, repeat=3):
+    '''Best time inserting all models with one kind of validation.'''
+    repo = SchemaRepository()
+    if compile is not None:
+        fn = os.path.join(tmp, "schema.json")
+        with open(fn, "w") as fd:
+            codec.dump(schema, fd)
+        repo.addFromDescription(
+            Munch(kind="bench.register", filename=fn, compile=compile))
+    elapsed = min(insertAll(tmp, repo, models) for _ in range(repeat))
+    print("{0:<12} {1:8.3f}s {2:10.0f} inserts/s".format(
+        name, elapsed, len(models) / elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--records', type=int, default=50000,
+                        help='number of models to insert')
+    args = parser.parse_args()
+    models = makeModels(args.records)
+    with tempfile.TemporaryDirectory() as tmp:
+        bench(tmp, "none", None, models)
+        bench(tmp, "jsonschema", False, models)
+        bench(tmp, "compiled", True, models)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,337 @@
+'''
+Archive - incremental segment export and import
+===================================
+
+Segments are exported to zip files, with a manifest of the SHA-256 hash of
+each file in the segment, stored in the zip as <segname>/.manifest.json.
+
+Exporting compresses files in parallel on a thread pool (zlib releases the
+GIL). When a previous export of the segment exists, files whose hash hasn't
+changed are copied from it still compressed, so only changed files are
+compressed again. Writing entries which are already compressed relies on
+zipfile internals, so it is only done on the Python versions it was checked
+against (RAW_COPY); elsewhere every file is written with ZipFile.write.
+
+Importing reads the manifest from the zip, and compares it with the manifest
+of the installed segment (or with the hashes of the installed files if there
+is no manifest). The installed manifest also records the size and mtime of
+each file as installed, and a file which no longer matches them is hashed
+again, so a file edited locally is restored. Only files which differ are
+extracted, each streamed from the zip to a temporary file which then replaces
+the installed file. Installed files which are no longer in the segment are
+removed. Zips without a manifest are extracted in full.
+
+Archives may come from anywhere, so every name in a zip or manifest is
+checked before anything is written: absolute names, names with a '..'
+component, and names which would resolve outside the segment directory are
+refused with a ValueError.
+
+Created on 2019-01-24 Copyright (c) 2019 Bradford Dillman
+'''
+
+import hashlib
+import logging
+import os
+import shutil
+import struct
+import sys
+import zipfile
+import zlib
+
+from pathlib import Path, PurePosixPath
+
+from fashion import codec
+from fashion.util import hashFile, readAhead
+
+MANIFEST = ".manifest.json"
+
+# Files bigger than this are written by zipfile itself, as zip64 entries.
+RAW_LIMIT = zipfile.ZIP64_LIMIT - 1
+
+# Whether compressed entries can be copied and written with the zipfile
+# internals used by rawData and writeRaw.
+RAW_COPY = ((3, 6) <= sys.version_info[:2] <= (3, 13) and
+            all(hasattr(zipfile, name) for name in [
+                "structFileHeader", "sizeFileHeader",
+                "_FH_FILENAME_LENGTH", "_FH_EXTRA_FIELD_LENGTH"]) and
+            hasattr(zipfile.ZipFile, "_writecheck"))
+
+
+def segmentFiles(segdir):
+    '''
+    List the files of a segment directory to archive.
+
+    :param Path segdir: the segment directory.
+    :returns: list of paths relative to segdir, in posix form.
+    '''
+    files = []
+    for root, dirs, names in os.walk(str(segdir)):
+        dirs[:] = sorted(d for d in dirs if d != '__pycache__')
+        rel = Path(root).relative_to(segdir)
+        for name in sorted(names):
+            if rel == Path(".") and name == MANIFEST:
+                continue
+            files.append((rel / name).as_posix())
+    return files
+
+
+def checkSegmentName(segname):
+    '''
+    Check a segment name is a single safe directory name.
+
+    :param string segname: the segment name.
+    :returns: the segment name.
+    :raises ValueError: if it isn't.
+    '''
+    if (segname in (None, "", ".", "..") or "/" in segname or
+            "\\" in segname or ":" in segname):
+        raise ValueError("unsafe segment name in archive: {0!r}".format(segname))
+    return segname
+
+
+def zipSegmentName(names):
+    '''
+    Get the segment name of a zip, its single top level directory.
+
+    :param list(string) names: the names in the zip.
+    :raises ValueError: if the names aren't all in one safe directory.
+    '''
+    segname = checkSegmentName(names[0].split("/")[0] if names else None)
+    for name in names:
+        if not name.startswith(segname + "/"):
+            raise ValueError("archive entry outside segment: {0!r}".format(name))
+    return segname
+
+
+def safePath(segdir, rel):
+    '''
+    Get the path of a file in a segment directory.
+
+    :param Path segdir: the segment directory.
+    :param string rel: the file's relative posix path, from a zip or manifest.
+    :returns: the path of the file.
+    :rtype: Path
+    :raises ValueError: if the path would be outside segdir.
+    '''
+    parts = PurePosixPath(rel).parts
+    if (not parts or PurePosixPath(rel).is_absolute() or ".." in parts or
+            "\\" in rel or ":" in rel):
+        raise ValueError("unsafe path in archive: {0!r}".format(rel))
+    target = Path(segdir) / rel
+    root = Path(segdir).resolve()
+    if root not in target.resolve().parents:
+        raise ValueError("unsafe path in archive: {0!r}".format(rel))
+    return target
+
+
+def readManifest(zf, segname):
+    '''Get the file hashes from a zip's manifest, or None.'''
+    try:
+        return codec.loads(zf.read(segname + "/" + MANIFEST))["files"]
+    except KeyError:
+        return None
+
+
+def rawData(zf, info):
+    '''Read the still compressed data of a zip entry.'''
+    zf.fp.seek(info.header_offset)
+    header = struct.unpack(zipfile.structFileHeader,
+                           zf.fp.read(zipfile.sizeFileHeader))
+    zf.fp.seek(header[zipfile._FH_FILENAME_LENGTH] +
+               header[zipfile._FH_EXTRA_FIELD_LENGTH], os.SEEK_CUR)
+    return zf.fp.read(info.compress_size)
+
+
+def writeRaw(zf, info, data):
+    '''Write an already compressed entry to a zip.'''
+    zf.fp.seek(zf.start_dir)
+    info.header_offset = zf.start_dir
+    info.flag_bits &= ~0x08
+    zf._writecheck(info)
+    zf._didModify = True
+    zf.fp.write(info.FileHeader(False))
+    zf.fp.write(data)
+    zf.filelist.append(info)
+    zf.NameToInfo[info.filename] = info
+    zf.start_dir = zf.fp.tell()
+
+
+def exportArchive(zipname, segdir, segname, workers=None):
+    '''
+    Export a segment directory to a zip file with a manifest.
+
+    :param Path zipname: the zip file to write, a previous export of the
+    segment there is reused.
+    :param Path segdir: the segment directory.
+    :param string segname: the segment name, the top directory in the zip.
+    :param int workers: number of compression threads.
+    :returns: number of files compressed, the rest were copied; without
+    RAW_COPY every file is compressed.
+    :rtype: int
+    '''
+    zipname = Path(zipname)
+    old = None
+    oldHashes = {}
+    if zipname.exists():
+        try:
+            old = zipfile.ZipFile(str(zipname), mode="r")
+            oldHashes = readManifest(old, segname) or {}
+        except zipfile.BadZipFile:
+            old = None
+
+    def prepare(rel):
+        path = segdir / rel
+        data = path.read_bytes()
+        h = hashlib.sha256(data).hexdigest()
+        arcname = segname + "/" + rel
+        info = zipfile.ZipInfo.from_file(str(path), arcname)
+        if not RAW_COPY:
+            return h, info, False
+        if old is not None and oldHashes.get(rel) == h and arcname in old.NameToInfo:
+            return h, info, None
+        if len(data) > RAW_LIMIT:
+            return h, info, False
+        info.compress_type = zipfile.ZIP_DEFLATED
+        info.CRC = zlib.crc32(data)
+        info.file_size = len(data)
+        compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+        compressed = compressor.compress(data) + compressor.flush()
+        info.compress_size = len(compressed)
+        return h, info, compressed
+
+    hashes = {}
+    compressed = 0
+    tmpName = zipname.with_name(zipname.name + ".tmp")
+    with zipfile.ZipFile(str(tmpName), mode="w") as zf:
+        for rel, (h, info, data) in readAhead(prepare, segmentFiles(segdir), workers):
+            hashes[rel] = h
+            if data is None:
+                oldInfo = old.NameToInfo[info.filename]
+                for field in ["compress_type", "CRC", "compress_size", "file_size"]:
+                    setattr(info, field, getattr(oldInfo, field))
+                writeRaw(zf, info, rawData(old, oldInfo))
+            elif data is False:
+                zf.write(str(segdir / rel), info.filename, zipfile.ZIP_DEFLATED)
+                compressed += 1
+            else:
+                writeRaw(zf, info, data)
+                compressed += 1
+        zf.writestr(segname + "/" + MANIFEST, codec.dumps(
+            {"version": 1, "files": hashes}, indent=2, sort_keys=True),
+            zipfile.ZIP_DEFLATED)
+    if old is not None:
+        old.close()
+    os.replace(str(tmpName), str(zipname))
+    return compressed
+
+
+def fileStat(path):
+    '''Get the [size, mtime_ns] of a file, to notice changes cheaply.'''
+    st = path.stat()
+    return [st.st_size, st.st_mtime_ns]
+
+
+def installedHashes(segdir, workers=None):
+    '''
+    Get the file hashes of an installed segment. With a manifest, files whose
+    size and mtime are as recorded when they were installed keep the hash in
+    the manifest, and the others are hashed again, so files edited since are
+    noticed. Without one, every file is hashed.
+
+    :param Path segdir: the installed segment directory.
+    :param int workers: number of threads hashing files.
+    :returns: dictionary of hash by relative posix path.
+    '''
+    manifestPath = segdir / MANIFEST
+    installed = {}
+    if manifestPath.exists():
+        manifest = codec.loads(manifestPath.read_text())
+        stats = manifest.get("stats", {})
+        present = []
+        for rel, h in manifest["files"].items():
+            path = segdir / rel
+            if not path.is_file():
+                continue
+            if stats.get(rel) == fileStat(path):
+                installed[rel] = h
+            else:
+                present.append(rel)
+    elif segdir.exists():
+        present = segmentFiles(segdir)
+    else:
+        present = []
+    for rel, h in readAhead(lambda r: hashFile(segdir / r), present, workers):
+        installed[rel] = h
+    return installed
+
+
+def syncSegment(segdir, hashes, manifest, writeFile, workers=None):
+    '''
+    Update an installed segment to match a manifest, writing only files which
+    differ and removing files which aren't in the manifest.
+
+    :param Path segdir: the installed segment directory.
+    :param dictionary hashes: the new hash by relative posix path.
+    :param bytes manifest: the new manifest file contents.
+    :param writeFile: function(rel, target) writing a new file at target.
+    :param int workers: number of threads hashing installed files.
+    :returns: number of files written.
+    :raises ValueError: if a path would be outside segdir, before anything
+    is written.
+    '''
+    installed = installedHashes(segdir, workers)
+    targets = {rel: safePath(segdir, rel) for rel in hashes}
+    stale = [safePath(segdir, rel) for rel in set(installed) - set(hashes)]
+    written = 0
+    for rel, h in sorted(hashes.items()):
+        target = targets[rel]
+        if installed.get(rel) == h and target.exists():
+            continue
+        target.parent.mkdir(parents=True, exist_ok=True)
+        writeFile(rel, target)
+        written += 1
+    for path in stale:
+        if path.exists():
+            path.unlink()
+    segdir.mkdir(parents=True, exist_ok=True)
+    # Record the installed files' sizes and mtimes, see installedHashes.
+    manifest = codec.loads(manifest)
+    manifest["stats"] = {rel: fileStat(target) for rel, target in targets.items()}
+    (segdir / MANIFEST).write_text(codec.dumps(manifest, indent=2, sort_keys=True))
+    return written
+
+
+def importArchive(zipname, warehouseDir, workers=None):
+    '''
+    Import a segment zip file into a warehouse directory, extracting only
+    files which differ from the installed segment.
+
+    :param Path zipname: the zip file.
+    :param Path warehouseDir: the warehouse directory.
+    :param int workers: number of threads hashing installed files.
+    :returns: the segment name and number of files extracted.
+    :raises ValueError: if the zip has names outside the segment directory.
+    '''
+    with zipfile.ZipFile(str(zipname), mode="r") as zf:
+        names = zf.namelist()
+        segname = zipSegmentName(names)
+        segdir = Path(warehouseDir) / segname
+        for name in names:
+            rel = name[len(segname) + 1:]
+            if rel:
+                safePath(segdir, rel.rstrip("/"))
+        hashes = readManifest(zf, segname)
+        if hashes is None:
+            logging.info("no manifest in {0}, extracting all".format(zipname))
+            zf.extractall(str(warehouseDir))
+            return segname, len(names)
+
+        def extract(rel, target):
+            tmpTarget = target.with_name(target.name + ".tmp")
+            with zf.open(segname + "/" + rel) as src:
+                with tmpTarget.open(mode="wb") as dst:
+                    shutil.copyfileobj(src, dst)
+            os.replace(str(tmpTarget), str(target))
+        extracted = syncSegment(segdir, hashes,
+                                zf.read(segname + "/" + MANIFEST), extract, workers)
+    return segname, extracted
@@ -0,0 +1,423 @@
+'''
+BuildCache - xform outputs shared between builds and machines
+===================================
+
+CI machines build the same portfolio from the same commit over and over. A
+build cache keeps what each xform execution produced, the records it inserted
+and the files it generated, keyed by a fingerprint of everything the xform
+depends on. When the fingerprint matches a cached execution, the Runway
+restores the records and files instead of executing the xform.
+
+The fingerprint of an xform object covers:
+
+- its name and version, and the source of its module
+- its config, as read from segment.json
+- the content of the records of its inputKinds, in doc_id order, and the
+  fashion.prime.portfolio singleton; the xforms of a wave don't change each
+  other's inputs, so each kind is hashed once per wave
+- every file in its template path
+- the source of the modules of the registered services, such as
+  fashion.core.generate, which the xform may call
+- the files it declared with ModelAccess.inputFile or inputFiles, and the
+  names of the other files in their directories, so a file added to a
+  globbed directory is noticed
+- the template files its generated files were rendered from, as recorded in
+  their render signatures, wherever they were loaded from: spec templatePaths
+  and loaders passed to GenerateService.generate are covered too
+
+Input files and templates are only known after an xform executes, so lookup
+takes two steps, like ccache's direct mode: the rest of the fingerprint finds
+a small manifest listing the input files and templates of the last execution,
+and hashing those files gives the key of the cached execution. An xform which
+reads files without declaring them can't be cached correctly, and neither can
+one whose templates don't come from files.
+
+Doc_ids change from build to build, so cached records refer to each other by
+provisional doc_ids, and to input records by their content hash, as with
+snapshot results and render signatures. Restoring replays the records with
+applyResult into a ModelAccess for the xform, so the context bookkeeping is
+the same as if it had executed. Generated files are only written if they
+differ, and files changed by the user since they were generated are skipped
+as usual. The render signatures of the restored files are stored too, see
+fashion.signature, so the next build can tell they are current.
+
+The cache is a directory which can be on shared storage, configured with the
+"buildCache" portfolio property or the FASHION_BUILD_CACHE environment
+variable, and bounded by the "buildCacheBytes" property (1GB by default),
+evicting the least recently used entries, see fashion.renderCache. Cached
+filenames are absolute, so machines sharing a cache should check the project
+out at the same path. 'fashion build --force' neither reads nor writes the
+cache.
+
+Created on 2019-01-29 Copyright (c) 2019 Bradford Dillman
+'''
+
+import logging
+import os
+import struct
+
+from pathlib import Path
+
+from fashion import codec
+from fashion.events import FILE_GENERATED, bus
+from fashion.mirror import Mirror
+from fashion.modelAccess import ModelAccess
+from fashion.renderCache import RenderCache
+from fashion.signature import RenderSignatures, digest
+from fashion.snapshot import applyResult
+from fashion.util import hashFile
+
+# Default size limit of a build cache, in bytes.
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+MAGIC = b"FASHBLD1"
+HEADER = struct.Struct("<8sQ")
+
+traceKind = 'fashion.prime.trace'
+inputFileKind = 'fashion.core.input.file'
+outputFileKind = 'fashion.core.output.file'
+portfolioKind = 'fashion.prime.portfolio'
+
+
+def mapIds(result, fn):
+    '''
+    Map the record references in recorded writes and reads, see applyResult.
+
+    :param dictionary result: writes and reads, as from SnapshotModelAccess.
+    :param fn: function of (kind, id) giving the new reference.
+    :returns: a copy of result with the references mapped.
+    '''
+    writes = []
+    for op, kind, pid, model, traceInputs in result["writes"]:
+        if traceInputs is not None:
+            traceInputs = [[k, fn(k, i)] for k, i in traceInputs]
+        if kind == traceKind:
+            model = dict(model, id=fn(model["kind"], model["id"]),
+                         inputs=[[k, fn(k, i)] for k, i in model["inputs"]])
+        writes.append([op, kind, pid, model, traceInputs])
+    reads = {k: [fn(k, i) for i in ids] for k, ids in result["reads"].items()}
+    return dict(result, writes=writes, reads=reads)
+
+
+class RecordingModelAccess(ModelAccess):
+    '''ModelAccess which also notes the records written, for the build cache.'''
+
+    def __init__(self, database, schemaRepo, contextObj):
+        '''
+        Initialize context but don't enable it.
+
+        :param DatabaseAccess database: the database to use.
+        '''
+        super(RecordingModelAccess, self).__init__(database, schemaRepo, contextObj)
+        self.writes = []
+
+    def insert(self, kind, model, traceInputs=None):
+        id = self.context.insert(kind, model)
+        if id is not None:
+            self.writes.append(["insert", kind, id])
+        if traceInputs is not None:
+            self.trace(kind, id, traceInputs)
+        return id
+
+    def insertMultiple(self, kind, models):
+        ids = self.context.insertMultiple(kind, models)
+        self.writes.extend(["insert", kind, id] for id in ids)
+        return ids
+
+    def setSingleton(self, kind, model, traceInputs=None):
+        id = self.context.setSingleton(kind, model)
+        if id is not None:
+            self.writes.append(["singleton", kind, id])
+        if traceInputs is not None:
+            self.trace(kind, id, traceInputs)
+        return id
+
+
+class BuildCache(object):
+    '''A size-bounded LRU cache of xform executions, by fingerprint.'''
+
+    def __init__(self, dir, maxBytes=None):
+        '''
+        Constructor.
+
+        :param Path dir: the cache directory, created when first written.
+        :param int maxBytes: the size limit, DEFAULT_MAX_BYTES if None.
+        '''
+        self.dir = Path(dir)
+        self.files = RenderCache(
+            self.dir, DEFAULT_MAX_BYTES if maxBytes is None else maxBytes)
+        self.hits = 0
+        self.misses = 0
+        self.fileHashes = {}
+        self.servicesKey = None
+        self.newWave()
+
+    def newWave(self):
+        '''Forget the hashes of input kinds, before a wave executes.'''
+        self.kindHashes = {}
+
+    def recordHash(self, view):
+        '''Get the content hash of a record.'''
+        return digest(codec.dumps(view, sort_keys=True))
+
+    def kindHash(self, dba, kind):
+        '''
+        Get the hash of the records of a kind, once per wave.
+
+        :returns: the hash, and the doc_ids of the records by content hash.
+        '''
+        entry = self.kindHashes.get(kind)
+        if entry is None:
+            hashes = [(self.recordHash(v), v._doc_id) for v in dba.views(kind)]
+            entry = (digest(codec.dumps([h for h, _ in hashes])), dict(hashes))
+            self.kindHashes[kind] = entry
+        return entry
+
+    def treeHash(self, dir):
+        '''Get the hash of every file under a directory, once per build.'''
+        h = self.fileHashes.get(dir)
+        if h is None:
+            root = Path(dir)
+            files = sorted(p for p in root.rglob("*") if p.is_file()) if root.is_dir() else []
+            h = digest(codec.dumps(
+                [[p.relative_to(root).as_posix(), hashFile(p)] for p in files]))
+            self.fileHashes[dir] = h
+        return h
+
+    def servicesHash(self, codeRegistry):
+        '''Get the hash of the source of the registered services, once per build.'''
+        if self.servicesKey is None:
+            files = set()
+            for svcs in codeRegistry.servicesByName.values():
+                for svc in svcs:
+                    fn = sourceFile(svc)
+                    if fn is not None:
+                        files.add(fn)
+            self.servicesKey = digest(codec.dumps(
+                [[fn, hashFile(fn)] for fn in sorted(files)]))
+        return self.servicesKey
+
+    def fingerprint(self, dba, record, codeRegistry=None):
+        '''
+        Get the fingerprint of an xform, except its input files and templates.
+
+        :param DatabaseAccess dba: the database.
+        :param XformRecord record: the xform's execution record.
+        :param CodeRegistry codeRegistry: the services the xform can call.
+        :returns: the fingerprint, or None if the xform can't be cached.
+        :rtype: string
+        '''
+        defn = record.definition
+        try:
+            parts = {
+                "name": record.name,
+                "version": getattr(record.xform, "version", None),
+                "module": hashFile(Path(defn.absDirname) / defn.filename),
+                "config": codec.dumps(record.config, sort_keys=True),
+                "templates": [self.treeHash(p) for p in record.templatePath],
+                "services": None if codeRegistry is None else self.servicesHash(codeRegistry),
+                "inputs": {kind: self.kindHash(dba, kind)[0]
+                           for kind in sorted(record.inputKinds | {portfolioKind})},
+            }
+        except (OSError, TypeError) as e:
+            logging.error("can't fingerprint {0}: {1}".format(record.name, e))
+            return None
+        return digest(codec.dumps(parts, sort_keys=True))
+
+    def manifestKey(self, key):
+        '''Get the key of the manifest of input files and templates for a fingerprint.'''
+        return digest(key + ":inputs")
+
+    def entryKey(self, key, filenames, templates):
+        '''
+        Combine a fingerprint with the contents of the input files, the names
+        in their directories, and the contents of the templates.
+
+        :raises OSError: if an input file or template is missing.
+        '''
+        hashes = [[fn, hashFile(fn)] for fn in filenames]
+        dirs = sorted({os.path.dirname(fn) for fn in filenames})
+        listings = [[d, sorted(os.listdir(d))] for d in dirs]
+        templateHashes = [[fn, hashFile(fn)] for fn in templates]
+        return digest(codec.dumps([key, hashes, listings, templateHashes]))
+
+    def get(self, key):
+        '''
+        Look up a cached execution.
+
+        :param string key: the xform's fingerprint.
+        :returns: the entry's header, file, and offset of the generated
+        files in it, or None.
+        '''
+        manifest = self.files.get(self.manifestKey(key))
+        if manifest is None:
+            return None
+        try:
+            inputs = codec.loads(manifest.read_text())
+            path = self.files.get(self.entryKey(
+                key, inputs["inputFiles"], inputs["templates"]))
+            if path is None:
+                return None
+            with path.open(mode="rb") as fd:
+                magic, length = HEADER.unpack(fd.read(HEADER.size))
+                if magic != MAGIC:
+                    return None
+                return codec.loads(fd.read(length)), path, HEADER.size + length
+        except (OSError, ValueError, KeyError, TypeError, struct.error):
+            return None
+
+    def restore(self, dba, schemaRepo, record, key):
+        '''
+        Restore an xform's records and files from the cache.
+
+        :param DatabaseAccess dba: the database.
+        :param SchemaRepository schemaRepo: the schemas to validate with.
+        :param XformRecord record: the xform's execution record.
+        :param string key: the xform's fingerprint.
+        :returns: True if restored, False to execute the xform.
+        '''
+        found = self.get(key)
+        result = None
+        if found is not None:
+            header, path, offset = found
+            result = self.resolve(dba, header)
+        if result is None:
+            self.misses += 1
+            return False
+        with ModelAccess(dba, schemaRepo, record.xform) as mdb:
+            applyResult(mdb, result)
+        restored = self.restoreFiles(dba, header, path, offset)
+        signatures = RenderSignatures(dba)
+        for fn, sig, inputs, templates in header.get("signatures", []):
+            if fn in restored:
+                signatures.store(Path(fn), sig, inputs, templates)
+        self.hits += 1
+        return True
+
+    def resolve(self, dba, header):
+        '''Map the content hashes in a cached execution to current doc_ids.'''
+        def docId(kind, id):
+            if not isinstance(id, str):
+                return id
+            return self.kindHash(dba, kind)[1][id]
+        try:
+            return mapIds(header, docId)
+        except KeyError:
+            return None
+
+    def restoreFiles(self, dba, header, path, offset):
+        '''
+        Write the generated files of a cached execution.
+
+        :returns: the filenames restored or already current, but not those
+        skipped because the user changed them.
+        :rtype: set(string)
+        '''
+        restored = set()
+        pf = dba.getSingleton(portfolioKind)
+        args = dba.getArgs() or {}
+        mirror = Mirror(Path(pf["projectPath"]), Path(pf["mirrorPath"]),
+                        args.get("force", False))
+        with path.open(mode="rb") as fd:
+            fd.seek(offset)
+            for fn, size, h in header["files"]:
+                target = Path(fn)
+                if mirror.isChanged(target):
+                    logging.warning("Skipping {0}, file has changed.".format(fn))
+                    fd.seek(size, os.SEEK_CUR)
+                    continue
+                if target.exists() and target.stat().st_size == size and hashFile(target) == h:
+                    fd.seek(size, os.SEEK_CUR)
+                else:
+                    target.parent.mkdir(parents=True, exist_ok=True)
+                    tmp = target.with_name(target.name + ".tmp")
+                    with tmp.open(mode="wb") as out:
+                        copyBytes(fd, out, size)
+                    os.replace(str(tmp), str(target))
+                    mirror.copyToMirror(target)
+                restored.add(fn)
+                bus.emit(FILE_GENERATED, target)
+        return restored
+
+    def put(self, dba, key, mdb):
+        '''
+        Add an xform execution to the cache.
+
+        :param DatabaseAccess dba: the database.
+        :param string key: the xform's fingerprint.
+        :param RecordingModelAccess mdb: the exited ModelAccess it executed with.
+        '''
+        inserted = {}
+        writes = []
+        for op, kind, id in mdb.writes:
+            view = dba.view(kind, id)
+            if view is None:
+                continue
+            inserted[(kind, id)] = pid = -1 - len(writes)
+            writes.append([op, kind, pid, view.toDict(), None])
+        reads = {kind: [id for id in ids if (kind, id) not in inserted]
+                 for kind, ids in mdb.context.searchStore.items()}
+
+        def ref(kind, id):
+            if (kind, id) in inserted:
+                return inserted[(kind, id)]
+            view = dba.view(kind, id)
+            if view is None:
+                raise KeyError(id)
+            return self.recordHash(view)
+        try:
+            header = mapIds({"writes": writes, "reads": reads}, ref)
+        except KeyError:
+            return
+        inputFiles = [m["filename"] for _, kind, _, m, _ in writes if kind == inputFileKind]
+        outputs = [Path(m["filename"]) for _, kind, _, m, _ in writes
+                   if kind == outputFileKind]
+        outputs = [p for p in outputs if p.is_file()]
+        header["signatures"] = RenderSignatures(dba).export(
+            [p.as_posix() for p in outputs])
+        templates = {t[1] for s in header["signatures"] for t in s[3]}
+        if None in templates:
+            return
+        templates = sorted(templates)
+        try:
+            header["files"] = [[p.as_posix(), p.stat().st_size, hashFile(p)]
+                               for p in outputs]
+            entryKey = self.entryKey(key, inputFiles, templates)
+            tmp = self.files.tempPath(entryKey)
+            data = codec.dumps(header).encode("utf-8")
+            with tmp.open(mode="wb") as fd:
+                fd.write(HEADER.pack(MAGIC, len(data)))
+                fd.write(data)
+                for p, (_, size, _) in zip(outputs, header["files"]):
+                    with p.open(mode="rb") as src:
+                        copyBytes(src, fd, size)
+            self.files.add(entryKey, tmp)
+            manifestKey = self.manifestKey(key)
+            tmp = self.files.tempPath(manifestKey)
+            tmp.write_text(codec.dumps({"inputFiles": inputFiles, "templates": templates}))
+            self.files.add(manifestKey, tmp)
+        except OSError as e:
+            logging.error("build cache write failed: {0}".format(e))
+
+    def stats(self):
+        '''Describe the hits and misses.'''
+        return "build cache: {0} hits, {1} misses".format(self.hits, self.misses)
+
+
+def sourceFile(obj):
+    '''Get the source filename of an object's class, or None.'''
+    for value in vars(type(obj)).values():
+        code = getattr(value, "__code__", None)
+        if code is not None:
+            return code.co_filename
+    return None
+
+
+def copyBytes(src, dst, size):
+    '''Copy size bytes from one binary file to another.'''
+    while size > 0:
+        block = src.read(min(size, 1 << 20))
+        if not block:
+            raise OSError("unexpected end of file")
+        dst.write(block)
+        size -= len(block)
@@ -1,5 +1,14 @@
 '''
 ServiceRegistry
+
+Services are kept per name in a list of (Version, service) sorted newest
+first, so versions are parsed once when a service is added. getService
+results are memoised per (name, versionSpec), and forgotten when a service of
+that name is added or removed.
+
+A context service is held in a contextvars.ContextVar named for the service,
+and resolves to a different object in each thread or asyncio task. The active
+ModelAccess is provided this way, rather than registered for each xform.
 '''
 
 import logging
@@ -19,6 +28,22 @@ class CodeRegistry(object):
         self.servicesByName = {}
         self.xformObjectsByName = {}
         self.cfgByName = {}
+        # (Version, service) for each service name, newest first.
+        self.versionsByName = {}
+        # Memoised getService results, {name: {versionSpec: service}}.
+        self.resolvedByName = {}
+        # ContextVar holding each context service, by name.
+        self.contextServices = {}
+
+    def addContextService(self, var):
+        '''
+        Provide a service from a context variable. When the variable is set
+        in the current context, getService for its name returns its value,
+        ahead of any registered service.
+
+        :param ContextVar var: the variable, named for the service.
+        '''
+        self.contextServices[var.name] = var
 
     def getService(self, serviceName, versionSpec=None):
         '''
@@ -26,20 +51,28 @@ class CodeRegistry(object):
         If versionCriteria has multiple matches, the result is the newest match.
         If no service is located, result is None.
         '''
-        if serviceName not in self.servicesByName:
-            return None
-
-        services = self.servicesByName[serviceName]
-        versioned = [(Version(s.version), s) for s in services]
-        ranked = sorted(versioned, key=lambda ver: ver[0], reverse=True)
+        var = self.contextServices.get(serviceName)
+        if var is not None:
+            service = var.get()
+            if service is not None and (versionSpec is None or
+                                        Version(service.version) in SpecifierSet(versionSpec)):
+                return service
+        resolved = self.resolvedByName.get(serviceName)
+        if resolved is None:
+            if serviceName not in self.versionsByName:
+                return None
+            resolved = self.resolvedByName[serviceName] = {}
+        elif versionSpec in resolved:
+            return resolved[versionSpec]
+
+        ranked = self.versionsByName[serviceName]
         if versionSpec is None:
-            return ranked[0][1]
-
-        spec = SpecifierSet(versionSpec)
-        matches = [vs for vs in ranked if vs[0] in spec]
-        if len(matches) == 0:
-            return None
-        return matches[0][1]
+            match = ranked[0][1]
+        else:
+            spec = SpecifierSet(versionSpec)
+            match = next((s for v, s in ranked if v in spec), None)
+        resolved[versionSpec] = match
+        return match
 
     def addService(self, service):
         '''
@@ -49,19 +82,19 @@ class CodeRegistry(object):
         '''
         verbose = self.dba.isVerbose()
         name = service.name
-        if name not in self.servicesByName:
-            self.servicesByName[name] = [service]
-            if verbose:
-                print("Add service: {0} v{1}".format(name, service.version))
-            return True
-        testService = self.getService(name, "=="+service.version)
-        if testService is not None:
+        version = Version(service.version)
+        ranked = self.versionsByName.get(name, [])
+        if any(v == version for v, _ in ranked):
             logging.error("Duplicate service registration: {0} v{1}".format(
                 name, service.version))
             return False
-        self.servicesByName[name].append(service)
+        self.servicesByName.setdefault(name, []).append(service)
+        ranked = ranked + [(version, service)]
+        ranked.sort(key=lambda vs: vs[0], reverse=True)
+        self.versionsByName[name] = ranked
+        self.resolvedByName.pop(name, None)
         if verbose:
-            print("Add service: {0}".format(name))
+            print("Add service: {0} v{1}".format(name, service.version))
         return True
 
     def removeService(self, serviceName, version):
@@ -72,11 +105,18 @@ class CodeRegistry(object):
         if serviceName not in self.servicesByName:
             return False
         verbose = self.dba.isVerbose()
-        spec = SpecifierSet("!="+version)
+        version = Version(version)
         svcs = self.servicesByName[serviceName]
-        shutdown = [s for s in svcs if Version(s.version) not in spec]
-        remainder = [s for s in svcs if Version(s.version) in spec]
+        shutdown = [s for s in svcs if Version(s.version) == version]
+        remainder = [s for s in svcs if Version(s.version) != version]
         self.servicesByName[serviceName] = remainder
+        ranked = [vs for vs in self.versionsByName.get(serviceName, [])
+                  if vs[0] != version]
+        if ranked:
+            self.versionsByName[serviceName] = ranked
+        else:
+            self.versionsByName.pop(serviceName, None)
+        self.resolvedByName.pop(serviceName, None)
         for s in shutdown:
             if verbose:
                 print("Shutdown service {0} v{1}".format(s.name, s.version))
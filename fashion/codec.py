@@ -0,0 +1,160 @@
+'''
+Codec - fast JSON encoding and decoding
+===================================
+
+All JSON reading and writing in fashion goes through this module, which uses
+the fastest JSON library available: orjson, then ujson, then the standard
+library json module.
+
+Not every library supports every option, e.g. orjson only indents by 2, so
+each call falls back to the next library which does. Objects a library can't
+encode (e.g. integers too big for orjson) also fall back, ending with json.
+
+orjson also reads integers too big for 64 bits as floats, and writes NaN and
+Infinity as null, where json reads and writes them. So text with a run of 19
+or more digits, or which orjson can't parse, is decoded by json, and output
+containing null is checked for non-finite floats, which are encoded by the
+next library.
+
+CodecStorage is a TinyDB storage using this codec.
+
+Created on 2019-01-18 Copyright (c) 2019 Bradford Dillman
+'''
+
+import json
+import math
+import os
+
+from collections.abc import Mapping, Sequence
+
+from tinydb.storages import JSONStorage
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+# Name of the fastest JSON library available.
+if orjson is not None:
+    name = "orjson"
+elif ujson is not None:
+    name = "ujson"
+else:
+    name = "json"
+
+
+def default(obj):
+    '''Encode objects JSON libraries don't know, like ModelViews.'''
+    if hasattr(obj, "toDict"):
+        return obj.toDict()
+    if isinstance(obj, Mapping):
+        return dict(obj)
+    if isinstance(obj, Sequence) and not isinstance(obj, str):
+        return list(obj)
+    raise TypeError("can't encode {0}".format(type(obj).__name__))
+
+
+# Maps digits to b"0" and everything else to b" ", to find long numbers.
+DIGITS = bytes(48 if 48 <= c < 58 else 32 for c in range(256))
+LONG_NUMBER = b"0" * 19
+
+
+def longNumber(s):
+    '''Check if JSON text has a number too long for a 64 bit integer.'''
+    if isinstance(s, str):
+        s = s.encode("utf-8")
+    elif not isinstance(s, (bytes, bytearray)):
+        s = bytes(s)
+    return LONG_NUMBER in s.translate(DIGITS)
+
+
+def nonFinite(obj):
+    '''Check if an object contains NaN or Infinity.'''
+    stack = [obj]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, float):
+            if not math.isfinite(value):
+                return True
+        elif isinstance(value, Mapping):
+            stack.extend(value.values())
+        elif isinstance(value, Sequence) and not isinstance(value, (str, bytes)):
+            stack.extend(value)
+    return False
+
+
+def loads(s):
+    '''Decode a JSON str or bytes.'''
+    if orjson is not None:
+        if not longNumber(s):
+            try:
+                return orjson.loads(s)
+            except orjson.JSONDecodeError:
+                pass
+        return json.loads(s if isinstance(s, (str, bytes, bytearray)) else bytes(s))
+    if ujson is not None:
+        return ujson.loads(s)
+    return json.loads(s)
+
+
+def dumps(obj, indent=None, sort_keys=False):
+    '''
+    Encode an object as a JSON str.
+
+    :param obj: the object to encode.
+    :param int indent: number of spaces to indent, or None for compact output.
+    :param boolean sort_keys: True to sort object keys.
+    :rtype: string
+    '''
+    if orjson is not None and indent in (None, 2):
+        option = orjson.OPT_NON_STR_KEYS
+        if indent == 2:
+            option |= orjson.OPT_INDENT_2
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        try:
+            data = orjson.dumps(obj, default=default, option=option)
+            if b"null" not in data or not nonFinite(obj):
+                return data.decode("utf-8")
+        except TypeError:
+            pass
+    if ujson is not None:
+        try:
+            return ujson.dumps(obj, indent=indent or 0, sort_keys=sort_keys,
+                               escape_forward_slashes=False, default=default)
+        except (TypeError, OverflowError):
+            pass
+    return json.dumps(obj, indent=indent, sort_keys=sort_keys, default=default)
+
+
+def load(fd):
+    '''Decode JSON from a file object.'''
+    return loads(fd.read())
+
+
+def dump(obj, fd, indent=None, sort_keys=False):
+    '''Encode an object as JSON to a file object.'''
+    fd.write(dumps(obj, indent=indent, sort_keys=sort_keys))
+
+
+class CodecStorage(JSONStorage):
+    '''TinyDB JSON file storage using the fastest available codec.'''
+
+    def read(self):
+        self._handle.seek(0)
+        data = self._handle.read()
+        if not data:
+            return None
+        return loads(data)
+
+    def write(self, data):
+        self._handle.seek(0)
+        self._handle.write(dumps(data))
+        self._handle.flush()
+        os.fsync(self._handle.fileno())
+        self._handle.truncate()
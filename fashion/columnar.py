@@ -0,0 +1,409 @@
+'''
+Columnar storage for large homogeneous model kinds
+===================================
+
+Some model kinds are really tables: many records with the same flat set of
+scalar properties. Stored as TinyDB documents, each record is a dict with the
+same repeated keys, which costs memory and load time.
+
+A kind may opt in to columnar storage in its segment schema description:
+
+"schema": [
+    {"kind":"local.register", "filename":"./schema/register.json",
+     "storage":"columnar"}
+]
+
+The JSON schema must be an object with flat scalar properties, e.g.
+
+{"type": "object", "properties": {"name": {"type": "string"},
+                                  "address": {"type": "integer"}}}
+
+Each property is stored as one column: integer and number properties in typed
+arrays (array module, exposed as NumPy arrays if NumPy is installed), string
+and boolean properties in lists. Missing properties, and any values which don't
+fit the schema, are kept on the side so every record round-trips exactly.
+
+ColumnTable provides the subset of the TinyDB Table interface used by fashion,
+so DatabaseAccess can return it from table(). ModelAccess reads rows as
+RowView objects, which behave like ModelView objects. Removing records moves
+the rows after them, so a row looks up its index again by doc_id after a
+removal; the row of a removed record is empty.
+
+Column tables are saved beside the database, in a '.columns' directory with a
+JSON header and a binary file of the numeric columns for each kind.
+
+Created on 2019-01-14 Copyright (c) 2019 Bradford Dillman
+'''
+
+import bisect
+import logging
+import operator
+
+from array import array
+from collections.abc import Mapping
+
+from tinydb.database import Document
+
+from fashion import codec
+from fashion.modelView import ModelView
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Column storage for each JSON schema scalar type, None means a list.
+typeCodes = {
+    "integer": "q",
+    "number": "d",
+    "string": None,
+    "boolean": None
+}
+
+# Range of integers stored exactly in "q" and "d" columns.
+INT64_MIN = -2 ** 63
+INT64_MAX = 2 ** 63 - 1
+FLOAT_INT_MAX = 2 ** 53
+
+# Operators for ColumnTable.select.
+selectOps = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge
+}
+
+
+def columnSpec(schema):
+    '''
+    Get the column types for a schema, if it has flat scalar properties.
+
+    :param JSONobject schema: the JSON schema of a model kind.
+    :returns: dictionary of JSON schema type by property name, or None if the
+    schema isn't suitable for columnar storage.
+    :rtype: dictionary {string:string}
+    '''
+    if schema.get("type") != "object" or "properties" not in schema:
+        return None
+    spec = {}
+    for name, prop in schema["properties"].items():
+        propType = prop.get("type")
+        if not isinstance(propType, str) or propType not in typeCodes:
+            return None
+        spec[name] = propType
+    if len(spec) == 0:
+        return None
+    return spec
+
+
+def fits(propType, value):
+    '''
+    Check if a value can be stored exactly in a column of propType. Integers
+    too big for the column's array are kept on the side.
+    '''
+    if isinstance(value, bool):
+        return propType == "boolean"
+    if propType == "integer":
+        return isinstance(value, int) and INT64_MIN <= value <= INT64_MAX
+    if propType == "number":
+        if isinstance(value, int):
+            return -FLOAT_INT_MAX <= value <= FLOAT_INT_MAX
+        return isinstance(value, float)
+    if propType == "string":
+        return isinstance(value, str)
+    return isinstance(value, bool)
+
+
+class Row(Mapping):
+    '''One record of a ColumnTable, read from the columns on access.'''
+
+    __slots__ = ('table', 'index', 'doc_id', 'removals')
+
+    def __init__(self, table, index, doc_id):
+        self.table = table
+        self.index = index
+        self.doc_id = doc_id
+        self.removals = table.removals
+
+    def resolve(self):
+        '''Get the row index, found again if rows were removed, or None.'''
+        t = self.table
+        if self.removals != t.removals:
+            self.index = t.indexOf(self.doc_id)
+            self.removals = t.removals
+        return self.index
+
+    def __getitem__(self, key):
+        i = self.resolve()
+        t = self.table
+        if i is None:
+            raise KeyError(key)
+        if key in t.columns and self.doc_id not in t.missing[key]:
+            return t.columns[key][i]
+        extra = t.extras.get(self.doc_id)
+        if extra is not None and key in extra:
+            return extra[key]
+        raise KeyError(key)
+
+    def asDict(self):
+        '''Get the row as a plain dictionary, empty if it was removed.'''
+        i = self.resolve()
+        return {} if i is None else self.table.row(i, self.doc_id)
+
+    def __iter__(self):
+        return iter(self.asDict())
+
+    def __len__(self):
+        return len(self.asDict())
+
+
+class RowView(ModelView):
+    '''Read-only ModelView of a ColumnTable row.'''
+
+    __slots__ = ()
+
+    def toDict(self):
+        '''Get a plain, modifiable copy.'''
+        return dict(self._data)
+
+
+class ColumnTable(object):
+    '''Columnar storage for one model kind.'''
+
+    def __init__(self, name, spec):
+        '''
+        Constructor.
+
+        :param string name: the model kind.
+        :param dictionary spec: JSON schema type by property name, from columnSpec.
+        '''
+        self.name = name
+        self.spec = spec
+        self.modified = False
+        # Count of removals, which move rows, see Row.resolve.
+        self.removals = 0
+        self.purge()
+
+    def purge(self):
+        '''Remove all records.'''
+        self.removals += 1
+        self.docIds = array("q")
+        self.columns = {}
+        for field, propType in self.spec.items():
+            code = typeCodes[propType]
+            self.columns[field] = [] if code is None else array(code)
+        self.missing = {field: set() for field in self.spec}
+        self.extras = {}
+        self.lastId = 0
+        self.modified = True
+
+    def __len__(self):
+        return len(self.docIds)
+
+    def __iter__(self):
+        return iter(self.all())
+
+    def indexOf(self, doc_id):
+        '''Get the row index of a doc_id, or None.'''
+        i = bisect.bisect_left(self.docIds, doc_id)
+        if i < len(self.docIds) and self.docIds[i] == doc_id:
+            return i
+        return None
+
+    def row(self, index, doc_id=None):
+        '''Get a row as a plain dictionary.'''
+        if doc_id is None:
+            doc_id = self.docIds[index]
+        obj = {}
+        for field, col in self.columns.items():
+            if doc_id not in self.missing[field]:
+                obj[field] = col[index]
+        extra = self.extras.get(doc_id)
+        if extra is not None:
+            obj.update(extra)
+        return obj
+
+    def append(self, document):
+        '''Append a record as a new row, returning its doc_id.'''
+        self.lastId += 1
+        doc_id = self.lastId
+        self.docIds.append(doc_id)
+        extra = {k: v for k, v in document.items() if k not in self.spec}
+        for field, propType in self.spec.items():
+            col = self.columns[field]
+            value = document.get(field)
+            if field in document and fits(propType, value):
+                col.append(value)
+                continue
+            self.missing[field].add(doc_id)
+            col.append(None if isinstance(col, list) else 0)
+            if field in document:
+                extra[field] = value
+        if extra:
+            self.extras[doc_id] = extra
+        return doc_id
+
+    def insert(self, document):
+        '''Insert a record, returning its doc_id.'''
+        self.modified = True
+        return self.append(document)
+
+    def insert_multiple(self, documents):
+        '''Insert records, returning their doc_ids.'''
+        self.modified = True
+        return [self.append(doc) for doc in documents]
+
+    def all(self):
+        '''Get all records as Documents.'''
+        return [Document(self.row(i, doc_id), doc_id)
+                for i, doc_id in enumerate(self.docIds)]
+
+    def search(self, cond):
+        '''Get all records matching a TinyDB Query as Documents.'''
+        return [doc for doc in self.all() if cond(doc)]
+
+    def get(self, cond=None, doc_id=None):
+        '''Get one record by doc_id or TinyDB Query as a Document, or None.'''
+        if doc_id is not None:
+            i = self.indexOf(doc_id)
+            if i is None:
+                return None
+            return Document(self.row(i, doc_id), doc_id)
+        for doc in self.all():
+            if cond(doc):
+                return doc
+        return None
+
+    def remove(self, cond=None, doc_ids=None):
+        '''Remove records by doc_id or TinyDB Query, compacting the columns.'''
+        if doc_ids is None:
+            doc_ids = [doc.doc_id for doc in self.search(cond)]
+        gone = set(doc_ids)
+        keep = [i for i, doc_id in enumerate(self.docIds) if doc_id not in gone]
+        if len(keep) == len(self.docIds):
+            return []
+        self.docIds = array("q", (self.docIds[i] for i in keep))
+        for field, col in self.columns.items():
+            if isinstance(col, list):
+                self.columns[field] = [col[i] for i in keep]
+            else:
+                self.columns[field] = array(col.typecode, (col[i] for i in keep))
+            self.missing[field] -= gone
+        for doc_id in gone:
+            self.extras.pop(doc_id, None)
+        self.removals += 1
+        self.modified = True
+        return list(doc_ids)
+
+    def views(self, cond=None):
+        '''Get RowViews of all records, optionally matching a TinyDB Query.'''
+        views = [RowView(Row(self, i, doc_id), doc_id, self.name)
+                 for i, doc_id in enumerate(self.docIds)]
+        if cond is None:
+            return views
+        return [v for v in views if cond(v)]
+
+    def view(self, doc_id):
+        '''Get a RowView of one record, or None.'''
+        i = self.indexOf(doc_id)
+        if i is None:
+            return None
+        return RowView(Row(self, i, doc_id), doc_id, self.name)
+
+    def column(self, field):
+        '''
+        Get a copy of a column, as a NumPy array if available for numeric
+        columns. Rows missing the field hold 0 or None.
+        '''
+        col = self.columns[field]
+        if numpy is not None and isinstance(col, array):
+            return numpy.array(col, dtype=col.typecode)
+        return list(col)
+
+    def select(self, field, op, value):
+        '''
+        Vectorised filter on one column.
+
+        :param string field: the column to test.
+        :param string op: one of ==, !=, <, <=, >, >=.
+        :param value: the value to compare against.
+        :returns: list of matching doc_ids.
+        '''
+        compare = selectOps[op]
+        col = self.columns[field]
+        missing = self.missing[field]
+        if numpy is not None and isinstance(col, array):
+            # Buffers over the arrays, released before the table can change.
+            mask = compare(numpy.frombuffer(col, dtype=col.typecode), value)
+            ids = numpy.frombuffer(self.docIds, dtype="q")[mask].tolist()
+            return [i for i in ids if i not in missing]
+        return [doc_id for doc_id, v in zip(self.docIds, col)
+                if doc_id not in missing and compare(v, value)]
+
+    def save(self, dirname):
+        '''
+        Save to a JSON header and binary numeric column file in dirname.
+        '''
+        dirname.mkdir(parents=True, exist_ok=True)
+        header = {
+            "kind": self.name,
+            "spec": self.spec,
+            "lastId": self.lastId,
+            "numeric": [],
+            "columns": {},
+            "missing": {f: sorted(m) for f, m in self.missing.items() if m},
+            "extras": {str(k): v for k, v in self.extras.items()}
+        }
+        offset = 0
+        with (dirname / (self.name + ".bin")).open(mode="wb") as fd:
+            for field, col in [("", self.docIds)] + list(self.columns.items()):
+                if isinstance(col, list):
+                    header["columns"][field] = col
+                else:
+                    data = col.tobytes()
+                    fd.write(data)
+                    header["numeric"].append(
+                        [field, col.typecode, offset, len(data)])
+                    offset += len(data)
+        with (dirname / (self.name + ".json")).open(mode="w") as fd:
+            codec.dump(header, fd)
+        self.modified = False
+
+    @staticmethod
+    def load(dirname, name, spec):
+        '''
+        Load a saved column table, or make an empty one.
+        If the saved spec differs from spec, the saved rows are converted.
+        '''
+        table = ColumnTable(name, spec)
+        headerFile = dirname / (name + ".json")
+        if not headerFile.exists():
+            return table
+        with headerFile.open(mode="r") as fd:
+            header = codec.load(fd)
+        with (dirname / (name + ".bin")).open(mode="rb") as fd:
+            data = fd.read()
+        saved = ColumnTable(name, header["spec"])
+        saved.lastId = header["lastId"]
+        for field, code, offset, length in header["numeric"]:
+            col = array(code)
+            col.frombytes(data[offset:offset + length])
+            if field == "":
+                saved.docIds = col
+            else:
+                saved.columns[field] = col
+        saved.columns.update(header["columns"])
+        for field, ids in header["missing"].items():
+            saved.missing[field] = set(ids)
+        saved.extras = {int(k): v for k, v in header["extras"].items()}
+        saved.modified = False
+        if saved.spec == spec:
+            return saved
+        logging.info("converting column table {0} to new schema".format(name))
+        for i, doc_id in enumerate(saved.docIds):
+            table.lastId = doc_id - 1
+            table.append(saved.row(i, doc_id))
+        table.lastId = saved.lastId
+        return table
@@ -1,9 +1,16 @@
 from tinydb import TinyDB
-from tinydb.storages import JSONStorage
 from tinydb.middlewares import CachingMiddleware
 
+import logging
 import os
 
+from pathlib import Path
+
+from fashion.codec import CodecStorage
+from fashion.columnar import ColumnTable
+from fashion.journal import openJournaled
+from fashion.modelView import ModelView
+
 class DatabaseAccess(object):
     '''
     Raw database access. This module might be unnecessary, it's just a simple 
@@ -12,21 +19,176 @@ class DatabaseAccess(object):
     place to change storage, middleware, etc.
     '''
 
-    def __init__(self, filename):
+    def __init__(self, filename, journal=False):
         '''
         Initialize a database with a file.
         :param filename: database filename.
+        :param boolean journal: append changes to a journal instead of
+        rewriting the whole file, see fashion.journal.
         '''
         self.filename = str(filename)
-        self.db = TinyDB(self.filename, storage=CachingMiddleware(JSONStorage))
+        self.journal = journal
+        # TinyDB makes its storage from a class, so keep the instance here.
+        if journal:
+            self.db, self.storage = openJournaled(self.filename)
+        else:
+            self.storage = CachingMiddleware(CodecStorage)
+            self.db = TinyDB(self.filename, storage=self.storage)
+        self.columnDir = Path(self.filename).with_suffix(".columns")
+        self.columnTables = {}
 
     def close(self):
         '''Close the database file.'''
+        self.saveColumnTables()
         self.db.close()
 
+    def saveColumnTables(self):
+        '''Save the column tables which changed since they were saved.'''
+        for table in self.columnTables.values():
+            if table.modified:
+                table.save(self.columnDir)
+
+    def sync(self):
+        '''
+        Make changes so far durable, if that is cheap for this storage.
+        A journal is synced and changed column tables are saved, the cached
+        JSON file is written by close().
+        '''
+        if self.journal:
+            self.storage.flush()
+        self.saveColumnTables()
+
+    def compact(self):
+        '''
+        Rewrite the database files without removed records: a new snapshot
+        replaces the journal, or the cached JSON file is written now.
+        '''
+        if self.journal:
+            self.storage.compact()
+        else:
+            self.storage.flush()
+        self.saveColumnTables()
+
+    def fileSize(self):
+        '''
+        Get the total size in bytes of the database files.
+        '''
+        paths = [Path(self.filename)]
+        if self.journal:
+            paths.append(Path(self.filename + ".journal"))
+        if self.columnDir.exists():
+            paths.extend(self.columnDir.iterdir())
+        return sum(p.stat().st_size for p in paths if p.exists())
+
     def table(self, tableName):
+        if tableName in self.columnTables:
+            return self.columnTables[tableName]
         return self.db.table(tableName)
 
+    def setColumnar(self, kind, spec):
+        '''
+        Use columnar storage for a model kind. Any records of the kind already
+        in the TinyDB database are moved, keeping their doc_ids.
+
+        :param string kind: the model kind.
+        :param dictionary spec: the column spec from columnar.columnSpec.
+        :returns: the ColumnTable for the kind.
+        :rtype: ColumnTable
+        '''
+        if kind in self.columnTables:
+            return self.columnTables[kind]
+        table = ColumnTable.load(self.columnDir, kind, spec)
+        if kind in self.db.tables():
+            docs = self.db.table(kind).all()
+            if len(docs) > 0 and len(table) == 0:
+                logging.info("moving {0} to columnar storage".format(kind))
+                for doc in docs:
+                    table.lastId = doc.doc_id - 1
+                    table.insert(doc)
+            self.db.purge_table(kind)
+        self.columnTables[kind] = table
+        return table
+
+    def isColumnar(self, kind):
+        return kind in self.columnTables
+
+    def views(self, kind, cond=None):
+        '''
+        Get read-only views of the documents of a table, without copying them.
+
+        :param string kind: the table name.
+        :param cond: optional Query the documents must match.
+        :returns: list of views.
+        :rtype: list(ModelView)
+        '''
+        if kind in self.columnTables:
+            return self.columnTables[kind].views(cond)
+        return [ModelView(doc, int(id), kind)
+                for id, doc in self.rawTable(kind).items()
+                if cond is None or cond(doc)]
+
+    def iterate(self, kind, afterId=0):
+        '''
+        Iterate over the stored documents of a table without copying them.
+        Don't modify the documents.
+
+        :param string kind: the table name.
+        :param int afterId: only documents with a greater doc_id.
+        :returns: iterator of (doc_id, document).
+        '''
+        if kind in self.columnTables:
+            for view in self.columnTables[kind].views():
+                if view._doc_id > afterId:
+                    yield view._doc_id, view
+            return
+        for id, doc in self.rawTable(kind).items():
+            if int(id) > afterId:
+                yield int(id), doc
+
+    def view(self, kind, id):
+        '''
+        Get a read-only view of one document, or None.
+
+        :param string kind: the table name.
+        :param int id: the doc_id.
+        '''
+        if kind in self.columnTables:
+            return self.columnTables[kind].view(id)
+        table = self.rawTable(kind)
+        doc = table.get(id, table.get(str(id)))
+        if doc is None:
+            return None
+        return ModelView(doc, int(id), kind)
+
+    def publishSnapshot(self, path, kinds):
+        '''
+        Write a read-only snapshot of some kinds, for worker processes to
+        memory-map, see fashion.snapshot.
+
+        :param string path: the snapshot filename.
+        :param kinds: the model kinds to include.
+        '''
+        from fashion.snapshot import writeSnapshot
+        writeSnapshot(self, path, kinds)
+
+    def purgeTables(self):
+        '''Remove all tables.'''
+        self.db.purge_tables()
+        for table in self.columnTables.values():
+            table.purge()
+
+    def rawTable(self, tableName):
+        '''
+        Get the stored documents of a table without copying them.
+        Don't modify the result, use table() for that.
+
+        :param string tableName: the table name.
+        :returns: dictionary of documents by doc_id (int or str keys).
+        :rtype: dict
+        '''
+        data = self.storage.read() or {}
+        return data.get(tableName, {})
+
     # def insert(self, *args, **kwargs):
     #     '''Insert an object into the database.'''
     #     return self.db.insert(*args, **kwargs)
@@ -49,12 +211,12 @@ class DatabaseAccess(object):
 
     def setSingleton(self, kind, model):
         id = None
-        self.db.table(kind).purge()
-        id = self.db.table(kind).insert(model)
+        self.table(kind).purge()
+        id = self.table(kind).insert(model)
         return id
 
     def getSingleton(self, kind):
-        objs = self.db.table(kind).all()
+        objs = self.table(kind).all()
         if len(objs) == 0:
             return None
         return objs[0]
@@ -77,4 +239,5 @@ class DatabaseAccess(object):
     def kinds(self):
         k = self.db.tables()
         k.remove("_default")
+        k.update(self.columnTables.keys())
         return k
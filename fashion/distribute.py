@@ -0,0 +1,397 @@
+'''
+Distribute - run a build's xforms on worker processes or hosts
+===================================
+
+A coordinator runs in the 'fashion build' process. It plans the build as
+usual, then hands the xforms of each wave of the plan (xforms whose inputs
+are all ready, see Runway.plan) to workers, and waits for the wave to finish
+before starting the next.
+
+Workers connect to the coordinator with multiprocessing.connection, over a
+local or TCP socket, authenticated by a shared key. The same protocol works
+between hosts, as long as each worker host has the project checked out at the
+same path. Local workers are started by the coordinator; remote workers are
+started with 'fashion worker <host:port>', with the key in FASHION_AUTHKEY.
+
+Protocol, each message a pickled dictionary:
+
+coordinator -> worker: hello, with the project path, the fashion.prime.args
+    and fashion.prime.portfolio singletons, the stored render signatures, and
+    the project's render cache directory
+worker -> coordinator: ready, with the worker's host name
+coordinator -> worker: task, with an xform name and the snapshot (see
+    fashion.snapshot) of the kinds its wave may read: the snapshot's path
+    for a worker on the coordinator's host, else the snapshot's contents
+worker -> coordinator: result, with the writes and reads recorded by the
+    worker's SnapshotModelAccess, the files it generated, the render
+    signatures of its output files, and the contents of those files if it's
+    on another host; or an error
+coordinator -> worker: stop
+
+Each worker loads the portfolio's modules and initializes them against a
+scratch database of its own, so the project database is only written by the
+coordinator. Workers render through the project's render cache (see
+fashion.renderCache), not one beside their scratch database, so renders are
+shared between workers and builds. The coordinator applies each result with
+applyResult into a ModelAccess for the xform, so permissions are checked and
+the context bookkeeping is the same as for a local build. When an xform fails
+on a worker, its records from the last build are reset, as when it fails in
+a local build.
+
+The snapshot is published once per wave, with Runway.waveInputKinds, and
+shared by every task of the wave.
+
+If a worker disconnects, its task goes to another worker, or runs in the
+coordinator if no workers are left.
+
+The coordinator emits the build events (see fashion.events) of the xforms
+it distributes: xform.started when an xform is first sent to a worker,
+file.generated for each file the worker generated, and xform.finished when
+its result is applied, with a WorkerError if the xform failed.
+
+Created on 2019-01-28 Copyright (c) 2019 Bradford Dillman
+'''
+
+import logging
+import multiprocessing
+import os
+import socket
+import tempfile
+import traceback
+
+from multiprocessing.connection import Client, Listener, wait
+from pathlib import Path
+
+from munch import munchify
+
+from fashion.events import FILE_GENERATED, XFORM_FINISHED, XFORM_STARTED, bus
+from fashion.mirror import Mirror
+from fashion.modelAccess import ModelAccess
+from fashion.provenance import indexProvenance
+from fashion.renderCache import RenderCache
+from fashion.signature import RenderSignatures, signatureKind, templateKind
+from fashion.snapshot import Snapshot, SnapshotModelAccess, applyResult
+from fashion.util import cd
+from fashion.xforms import activeXform
+
+
+class WorkerError(Exception):
+    '''An xform failed on a worker, with the worker's traceback.'''
+
+
+def parseAddress(text):
+    '''Parse "host:port" into an address tuple.'''
+    host, _, port = text.rpartition(":")
+    return (host or "localhost", int(port))
+
+
+def authKey():
+    '''Get the shared key from FASHION_AUTHKEY, or None.'''
+    key = os.environ.get("FASHION_AUTHKEY")
+    return key.encode("utf-8") if key else None
+
+
+class Coordinator(object):
+    '''Hands the xforms of a planned Runway to workers.'''
+
+    def __init__(self, runway, address=("localhost", 0), authkey=None):
+        '''
+        Constructor, listening for workers.
+
+        :param Runway runway: a Runway, already planned.
+        :param tuple address: (host, port) to listen on, port 0 for any.
+        :param bytes authkey: the key workers must have, random if None.
+        '''
+        self.runway = runway
+        self.dba = runway.dba
+        self.authkey = authkey or os.urandom(16)
+        self.listener = Listener(address, authkey=self.authkey)
+        self.workers = []
+        self.processes = []
+        # Host name of each worker connection.
+        self.hosts = {}
+
+    @property
+    def address(self):
+        return self.listener.address
+
+    def hello(self):
+        '''Make the hello message for a new worker.'''
+        pf = self.dba.getSingleton('fashion.prime.portfolio')
+        return {
+            "op": "hello",
+            "host": socket.gethostname(),
+            "projectPath": pf["projectPath"],
+            "args": self.dba.getSingleton('fashion.prime.args'),
+            "portfolio": pf,
+            "signatures": list(self.dba.rawTable(signatureKind).values()),
+            "templates": list(self.dba.rawTable(templateKind).values()),
+            "renderCache": RenderCache.path(self.dba).as_posix(),
+        }
+
+    def startLocal(self, count):
+        '''
+        Start local worker processes, which connect to this coordinator.
+        Call accept() to wait for them.
+
+        :param int count: the number of workers.
+        '''
+        ctx = multiprocessing.get_context("spawn")
+        for _ in range(count):
+            p = ctx.Process(target=serve, args=(self.address, self.authkey))
+            p.daemon = True
+            p.start()
+            self.processes.append(p)
+
+    def accept(self, count):
+        '''
+        Accept worker connections, and wait for each to load the portfolio.
+
+        :param int count: the number of workers.
+        '''
+        hello = self.hello()
+        for _ in range(count):
+            conn = self.listener.accept()
+            conn.send(hello)
+            reply = conn.recv()
+            if reply.get("op") == "ready":
+                self.workers.append(conn)
+                self.hosts[conn] = reply.get("host")
+            else:
+                logging.error("worker failed to start")
+                conn.close()
+
+    def task(self, conn, xfName, snapshot):
+        '''
+        Make a task message for a worker.
+
+        :param conn: the worker's connection.
+        :param string xfName: the xform to execute.
+        :param Munch snapshot: the wave's snapshot path, and its contents
+        once read for a worker on another host.
+        :returns: the task message.
+        '''
+        task = {"op": "task", "name": xfName}
+        if self.hosts.get(conn) == socket.gethostname():
+            task["snapshotPath"] = snapshot.path.as_posix()
+        else:
+            if snapshot.data is None:
+                snapshot.data = snapshot.path.read_bytes()
+            task["snapshot"] = snapshot.data
+        return task
+
+    def run(self):
+        '''Execute the planned xforms, wave by wave, on the workers.'''
+        verbose = self.dba.isVerbose()
+        self.runway.prepare()
+        with tempfile.TemporaryDirectory() as tmp:
+            for index, wave in enumerate(self.runway.waves):
+                snapshot = munchify({"path": Path(tmp) / "wave{0}.snap".format(index),
+                                     "data": None})
+                self.runWave(wave, index, snapshot, verbose)
+                if snapshot.path.exists():
+                    snapshot.path.unlink()
+        indexProvenance(self.dba)
+
+    def runWave(self, wave, index, snapshot, verbose):
+        '''Execute the xforms of one wave, publishing its snapshot first.'''
+        if self.runway.buildCache is not None:
+            self.runway.buildCache.newWave()
+        pending = sorted(n for n in wave if n in self.runway.records)
+        if pending and self.workers:
+            self.dba.publishSnapshot(snapshot.path, sorted(self.runway.waveInputKinds(index)))
+        busy = {}
+        started = set()
+        while pending or busy:
+            if not self.workers and not busy:
+                for xfName in pending:
+                    self.runway.executeOne(xfName, verbose)
+                break
+            idle = [w for w in self.workers if w not in busy]
+            while pending and idle:
+                conn = idle.pop()
+                xfName = pending.pop(0)
+                if verbose:
+                    print("Distributing {0}".format(xfName))
+                if xfName not in started:
+                    started.add(xfName)
+                    bus.emit(XFORM_STARTED, self.runway.records[xfName])
+                busy[conn] = xfName
+                try:
+                    conn.send(self.task(conn, xfName, snapshot))
+                except OSError:
+                    pass
+            for conn in wait(list(busy)):
+                xfName = busy.pop(conn)
+                try:
+                    result = conn.recv()
+                except (EOFError, OSError):
+                    logging.error("lost worker running {0}".format(xfName))
+                    self.workers.remove(conn)
+                    pending.append(xfName)
+                    continue
+                error = self.apply(xfName, result)
+                bus.emit(XFORM_FINISHED, self.runway.records[xfName], error)
+
+    def apply(self, xfName, result):
+        '''
+        Apply the result of a task to the database.
+
+        :returns: a WorkerError if the xform failed, else None.
+        '''
+        record = self.runway.records[xfName]
+        if "error" in result:
+            logging.error("aborting, xform error: {0}".format(xfName))
+            logging.error(result["error"])
+            # Reset the xform's records, as a failed local execution does.
+            with ModelAccess(self.dba, self.runway.schemaRepo, record.xform):
+                pass
+            self.dba.sync()
+            return WorkerError(result["error"])
+        with ModelAccess(self.dba, self.runway.schemaRepo, record.xform) as mdb:
+            applyResult(mdb, result)
+        if result["files"]:
+            pf = self.dba.getSingleton('fashion.prime.portfolio')
+            mirror = Mirror(Path(pf["projectPath"]), Path(pf["mirrorPath"]))
+            for fn, data in result["files"]:
+                target = Path(fn)
+                target.parent.mkdir(parents=True, exist_ok=True)
+                tmp = target.with_name(target.name + ".tmp")
+                tmp.write_bytes(data)
+                os.replace(str(tmp), str(target))
+                mirror.copyToMirror(target)
+        signatures = RenderSignatures(self.dba)
+        for fn, sig, inputs, templates in result["signatures"]:
+            signatures.store(Path(fn), sig, inputs, templates)
+        self.dba.sync()
+        for fn in result["generated"]:
+            bus.emit(FILE_GENERATED, Path(fn))
+        return None
+
+    def close(self):
+        '''Stop the workers and the listener.'''
+        for conn in self.workers:
+            try:
+                conn.send({"op": "stop"})
+                conn.close()
+            except OSError:
+                pass
+        self.workers = []
+        for p in self.processes:
+            p.join(10)
+        self.processes = []
+        self.listener.close()
+
+
+class Worker(object):
+    '''Executes xforms for a coordinator.'''
+
+    def __init__(self, hello, workDir):
+        '''
+        Load the portfolio, with a scratch database in workDir.
+
+        :param dictionary hello: the coordinator's hello message.
+        :param Path workDir: a directory for the worker's own files.
+        '''
+        # Import here, since portfolio imports runway.
+        from fashion.portfolio import Portfolio
+        self.workDir = workDir
+        self.projectPath = Path(hello["projectPath"])
+        self.sendFiles = hello["host"] != socket.gethostname()
+        self.portfolio = Portfolio(self.projectPath, workDir / "database.json")
+        db = self.dba = self.portfolio.db
+        db.setSingleton('fashion.prime.args', hello["args"])
+        db.setSingleton('fashion.prime.portfolio', hello["portfolio"])
+        db.table(signatureKind).insert_multiple(hello["signatures"])
+        db.table(templateKind).insert_multiple(hello["templates"])
+        self.verbose = db.isVerbose()
+        with cd(self.projectPath):
+            self.runway = self.portfolio.getRunway()
+            self.runway.plan()
+        generate = self.runway.codeRegistry.getService('fashion.core.generate')
+        if generate is not None:
+            generate.cache = RenderCache(Path(hello["renderCache"]), generate.cache.maxBytes)
+        # The coordinator emits the build's events to the segments' handlers.
+        bus.shutdown()
+        self.records = {}
+
+    def run(self, task):
+        '''
+        Execute a task.
+
+        :param dictionary task: the task message.
+        :returns: the result message.
+        '''
+        xfName = task["name"]
+        path = task.get("snapshotPath")
+        if path is None:
+            path = self.workDir / "task.snap"
+            path.write_bytes(task["snapshot"])
+        snap = Snapshot(Path(path))
+        generated = []
+
+        def onGenerated(event, filename):
+            generated.append(str(filename))
+        bus.subscribe(FILE_GENERATED, onGenerated)
+        try:
+            with cd(self.projectPath):
+                record = self.records.get(xfName)
+                if record is None:
+                    record = self.records[xfName] = self.runway.makeRecord(xfName)
+                with SnapshotModelAccess(snap, record.xform) as mdb:
+                    if self.verbose:
+                        print("Executing {0}".format(xfName))
+                    token = activeXform.set(record)
+                    try:
+                        record.xform.execute(self.runway.codeRegistry, self.verbose)
+                    finally:
+                        activeXform.reset(token)
+                    result = mdb.result()
+        except Exception:
+            return {"name": xfName, "error": traceback.format_exc()}
+        finally:
+            bus.unsubscribe(FILE_GENERATED, onGenerated)
+            snap.close()
+        outputs = [model["filename"] for _, kind, _, model, _ in result["writes"]
+                   if kind == 'fashion.core.output.file']
+        result["signatures"] = RenderSignatures(self.dba).export(outputs)
+        result["generated"] = generated
+        result["files"] = []
+        if self.sendFiles:
+            result["files"] = [[fn, Path(fn).read_bytes()] for fn in outputs
+                               if Path(fn).exists()]
+        return result
+
+
+def serve(address, authkey=None):
+    '''
+    Run a worker: connect to a coordinator, and execute its tasks until told
+    to stop.
+
+    :param tuple address: the coordinator's (host, port).
+    :param bytes authkey: the shared key, from FASHION_AUTHKEY if None.
+    '''
+    authkey = authkey or authKey()
+    if authkey is None:
+        logging.error("set the coordinator's key in FASHION_AUTHKEY")
+        return
+    conn = Client(address, authkey=authkey)
+    hello = munchify(conn.recv())
+    with tempfile.TemporaryDirectory() as tmp:
+        try:
+            worker = Worker(hello, Path(tmp))
+        except Exception:
+            logging.error(traceback.format_exc())
+            conn.send({"op": "failed"})
+            conn.close()
+            return
+        conn.send({"op": "ready", "host": socket.gethostname()})
+        while True:
+            try:
+                msg = conn.recv()
+            except EOFError:
+                break
+            if msg["op"] == "stop":
+                break
+            conn.send(worker.run(msg))
+    conn.close()
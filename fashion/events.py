@@ -0,0 +1,137 @@
+'''
+Events - observe a build
+===================================
+
+Tools which monitor, profile or extend a build subscribe to its events on the
+event bus, instead of patching the Runway. Each handler is called with the
+event name and the event's arguments:
+
+segment.loaded (segment) - a Segment was loaded by a Warehouse; only seen
+    by handlers subscribed in code, see below
+module.loaded (module) - an XformModule's code was loaded
+init.started (config), init.finished (config) - around a module config's init
+plan.ready (runway) - the Runway's execList and waves are planned
+xform.started (record) - an XformRecord is about to execute
+xform.finished (record, error) - it executed, or was restored from the build
+    cache; error is the exception it raised, or None
+model.inserted (kind, id, model) - a record was inserted through ModelAccess
+file.generated (filename) - a file was rendered, or restored from a cache
+
+There is one bus per process, fashion.events.bus. Code subscribes with
+bus.subscribe(event, handler), e.g. before calling Portfolio.getRunway. Xform
+modules get the bus as the 'fashion.prime.events' service. A segment can
+subscribe functions of its xform modules in segment.json:
+
+"eventHandlers": [{
+    "event": "xform.finished",
+    "moduleName": "local.monitor",
+    "function": "onXformFinished"
+}]
+
+These are subscribed when the module is loaded, so they see the events from
+its module.loaded on, and are unsubscribed when the build's services shut
+down. Segments are loaded before any module, so segment.loaded can't be
+subscribed this way.
+
+In a distributed build (see fashion.distribute) the coordinator emits the
+xform.started, xform.finished and file.generated events of the xforms run by
+workers, and model.inserted as it applies the models they inserted.
+
+With no subscribers, an event costs a dictionary lookup: handlers are held in
+a tuple per event, replaced when subscriptions change, and frequent events
+are only emitted if the tuple isn't empty. A handler which raises is logged,
+and doesn't stop the build.
+
+Created on 2019-01-30 Copyright (c) 2019 Bradford Dillman
+'''
+
+import logging
+import threading
+import traceback
+
+SEGMENT_LOADED = "segment.loaded"
+MODULE_LOADED = "module.loaded"
+INIT_STARTED = "init.started"
+INIT_FINISHED = "init.finished"
+PLAN_READY = "plan.ready"
+XFORM_STARTED = "xform.started"
+XFORM_FINISHED = "xform.finished"
+MODEL_INSERTED = "model.inserted"
+FILE_GENERATED = "file.generated"
+
+EVENTS = (SEGMENT_LOADED, MODULE_LOADED, INIT_STARTED, INIT_FINISHED, PLAN_READY,
+          XFORM_STARTED, XFORM_FINISHED, MODEL_INSERTED, FILE_GENERATED)
+
+
+class EventBus(object):
+    '''Calls the handlers subscribed to each build event.'''
+
+    def __init__(self):
+        '''Constructor, with no subscribers.'''
+        self.name = "fashion.prime.events"
+        self.version = "1.0.0"
+        # A tuple of handlers for each event, replaced on each change.
+        self.handlers = {event: () for event in EVENTS}
+        # (event, handler) by key, for handlers which replace each other.
+        self.keyed = {}
+        self.lock = threading.Lock()
+
+    def subscribe(self, event, handler, key=None):
+        '''
+        Subscribe a handler to an event.
+
+        :param string event: one of EVENTS.
+        :param handler: function of (event, *args).
+        :param key: optional key, which unsubscribes any handler subscribed
+        with the same key, and marks the handler to remove at shutdown.
+        :returns: True if subscribed.
+        :rtype: boolean
+        '''
+        if event not in self.handlers:
+            logging.error("unknown event: {0}".format(event))
+            return False
+        with self.lock:
+            if key is not None:
+                old = self.keyed.pop(key, None)
+                if old is not None:
+                    self.remove(*old)
+                self.keyed[key] = (event, handler)
+            self.handlers[event] = self.handlers[event] + (handler,)
+        return True
+
+    def unsubscribe(self, event, handler):
+        '''Unsubscribe a handler from an event.'''
+        with self.lock:
+            self.remove(event, handler)
+
+    def remove(self, event, handler):
+        '''Remove a handler, with the lock held.'''
+        handlers = list(self.handlers[event])
+        if handler in handlers:
+            handlers.remove(handler)
+            self.handlers[event] = tuple(handlers)
+
+    def emit(self, event, *args):
+        '''
+        Call the handlers of an event.
+
+        :param string event: one of EVENTS.
+        :param args: the event's arguments.
+        '''
+        for handler in self.handlers[event]:
+            try:
+                handler(event, *args)
+            except Exception:
+                logging.error("event handler error: {0}".format(event))
+                traceback.print_exc()
+
+    def shutdown(self):
+        '''Unsubscribe the handlers subscribed with keys.'''
+        with self.lock:
+            for event, handler in self.keyed.values():
+                self.remove(event, handler)
+            self.keyed = {}
+
+
+# The event bus of this process.
+bus = EventBus()
@@ -5,8 +5,8 @@ Created on 2016-04-29 Copyright (c) 2016 Bradford Dillman
 '''
 
 import argparse
-import json
 import logging
+import re
 import shutil
 import sys
 import zipfile
@@ -15,7 +15,10 @@ from pathlib import Path
 
 from munch import Munch, munchify
 
+from fashion import codec
+from fashion.distribute import Coordinator, authKey, parseAddress, serve
 from fashion.portfolio import FASHION_HOME, Portfolio, findPortfolio
+from fashion.provenance import ProvenanceGraph, fileNode, loadProvenance, modelNode
 from fashion.runway import Runway
 from fashion.schema import SchemaRepository
 from fashion.util import cd
@@ -120,7 +123,10 @@ def clean(args):
     global portfolio
     if not setup(args):
         return
-    portfolio.db.db.purge_tables()
+    portfolio.db.purgeTables()
+    provPath = ProvenanceGraph.path(portfolio.db)
+    if provPath.exists():
+        provPath.unlink()
 
 
 def build(args):
@@ -128,11 +134,99 @@ def build(args):
     global portfolio
     if not setup(args):
         return
+    if (args.listen or args.expect) and authKey() is None:
+        logging.error("--listen and --expect need the workers' key in FASHION_AUTHKEY")
+        return 1
     print("building...")
+    # Filename targets are relative to where fashion was run.
+    cwd = Path.cwd()
+    with cd(portfolio.projectPath):
+        r = portfolio.getRunway()
+        if not r.plan(args.targets, cwd):
+            r.codeRegistry.shutdownAllServices()
+            return 1
+        if args.workers or args.expect:
+            address = parseAddress(args.listen) if args.listen else ("localhost", 0)
+            coordinator = Coordinator(r, address, authKey())
+            try:
+                coordinator.startLocal(args.workers)
+                if args.expect:
+                    print("waiting for {0} workers at {1}".format(
+                        args.expect, coordinator.address))
+                coordinator.accept(args.workers + args.expect)
+                coordinator.run()
+            finally:
+                coordinator.close()
+        else:
+            r.execute()
+        r.codeRegistry.shutdownAllServices()
+
+
+def worker(args):
+    '''Execute xforms for a distributed build.'''
+    if authKey() is None:
+        logging.error("set the coordinator's key in FASHION_AUTHKEY")
+        return 1
+    serve(parseAddress(args.address))
+
+
+def gc(args):
+    '''Remove orphaned records and shrink the database.'''
+    global portfolio
+    if not setup(args):
+        return
     with cd(portfolio.projectPath):
         r = portfolio.getRunway()
         r.plan()
-        r.execute()
+        report = r.collectGarbage(args.dryRun)
+    for name in report.contexts:
+        print("orphaned context: {0}".format(name))
+    for kind, count in sorted(report.records.items()):
+        print("{0} ({1} orphaned records)".format(kind, count))
+    if report.sizeAfter is not None:
+        print("reclaimed {0} bytes".format(report.sizeBefore - report.sizeAfter))
+
+
+def provenanceNode(target):
+    '''Get the provenance graph node for a kind:id or a filename.'''
+    m = re.match(r"^([^/\\:]+):(\d+)$", target)
+    if m:
+        return modelNode(m.group(1), m.group(2))
+    return fileNode(target)
+
+
+def printProvenance(target, result):
+    if result is None:
+        print("unknown: {0}".format(target))
+        return
+    for xf in result.xforms:
+        print("xform: {0}".format(xf))
+    for model in result.models:
+        print("model: {0}".format(model))
+    for fn in result.files:
+        print("file: {0}".format(fn))
+
+
+def why(args):
+    '''Show the xforms, models and files a generated file or model came from.'''
+    global portfolio
+    if not setup(args):
+        return
+    with cd(portfolio.projectPath):
+        node = provenanceNode(args.target)
+    graph = loadProvenance(portfolio.db)
+    printProvenance(args.target, graph.why(node))
+
+
+def impact(args):
+    '''Show the xforms, models and files built from an input file.'''
+    global portfolio
+    if not setup(args):
+        return
+    with cd(portfolio.projectPath):
+        node = provenanceNode(args.target)
+    graph = loadProvenance(portfolio.db)
+    printProvenance(args.target, graph.impact(node))
 
 
 def createXform(args):
@@ -178,12 +272,13 @@ def guessSchema(args):
     global portfolio
     if not setup(args):
         return
-    portfolio.warehouse.loadSegments()
+    portfolio.warehouse.loadSegments(portfolio.db)
     schemaDefs = portfolio.warehouse.getSchemaDefintions()
-    if args.kind in schemaDefs:
+    if args.kind in schemaDefs and not args.refine:
         if not query_yes_no("Are you sure you want to overwrite the schema?", "no"):
             return
-    portfolio.warehouse.guessSchema(portfolio.db, args.kind)
+    portfolio.warehouse.guessSchema(portfolio.db, args.kind, sample=args.sample,
+                                    workers=args.workers, refine=args.refine)
 
 
 def listKinds(args):
@@ -199,28 +294,26 @@ def dump(args):
     global portfolio
     if not setup(args):
         return
-    print(json.dumps(portfolio.db.table(args.kind).get(doc_id=args.id), indent=4))
+    print(codec.dumps(portfolio.db.table(args.kind).get(doc_id=int(args.id)), indent=4))
 
 
 def dumpAll(args):
     global portfolio
     if not setup(args):
         return
-    print(json.dumps(portfolio.db.table(args.kind).all(), indent=4))
+    print(codec.dumps(portfolio.db.table(args.kind).all(), indent=4))
 
 
 def segmentList(args):
     global portfolio
     if not setup(args):
         return
-    segNames = portfolio.warehouse.listSegments()
-    if portfolio.warehouse.fallback is not None:
-        segNames.extend(portfolio.warehouse.fallback.listSegments())
+    segNames = portfolio.warehouse.listAllSegments()
     if len(segNames) == 0:
         print("No segments found.")
         return
     for sn in segNames:
-        seg = portfolio.warehouse.loadSegment(sn)
+        seg = portfolio.warehouse.loadSegment(sn, portfolio.db)
         print("{0} v{1} - {2}".format(seg.properties.name,
                                       seg.properties.version, seg.absDirname))
 
@@ -229,20 +322,20 @@ def segmentNew(args):
     global portfolio
     if not setup(args):
         return
-    seg = portfolio.warehouse.loadSegment(args.segname)
+    seg = portfolio.warehouse.loadSegment(args.segname, portfolio.db)
     if seg is not None:
         if query_yes_no("Are you sure you want to overwrite the segment?", "no"):
             portfolio.warehouse.deleteSegment(seg)
         else:
             return
-    portfolio.warehouse.newSegment(args.segname)
+    portfolio.warehouse.newSegment(args.segname, portfolio.db)
 
 
 def segmentDelete(args):
     global portfolio
     if not setup(args):
         return
-    seg = portfolio.warehouse.loadSegment(args.segname)
+    seg = portfolio.warehouse.loadSegment(args.segname, portfolio.db)
     if seg is not None:
         if query_yes_no("Are you sure you want to delete the segment?", "no"):
             portfolio.warehouse.deleteSegment(seg)
@@ -252,12 +345,12 @@ def segmentExport(args):
     global portfolio
     if not setup(args):
         return
-    seg = portfolio.warehouse.loadSegment(args.segname)
+    seg = portfolio.warehouse.loadSegment(args.segname, portfolio.db)
     if seg is None:
         print("Segment not found: {0}".format(args.segname))
         return
     print("exporting segment {0}".format(args.segname))
-    portfolio.warehouse.exportSegment(args.segname)
+    portfolio.warehouse.exportSegment(args.segname, portfolio.db)
 
 
 def segmentImport(args):
@@ -270,14 +363,13 @@ def segmentImport(args):
         return
     segname = filepath.name.split("_v")[0]
     version = filepath.name.split("_v")[1].split(".zip")[0]
-    seg = portfolio.warehouse.loadSegment(segname)
+    seg = portfolio.warehouse.loadSegment(segname, portfolio.db)
     if seg is not None:
-        if query_yes_no("Are you sure you want to overwrite the segment?", "no"):
-            portfolio.warehouse.deleteSegment(seg)
-        else:
+        if not query_yes_no("Are you sure you want to overwrite the segment?", "no"):
             return
     print("importing segment {0} v{1}".format(segname, version))
-    portfolio.warehouse.importSegment(args.filename)
+    portfolio.warehouse.importSegment(args.filename,
+                                      store=portfolio.getSegmentStore())
 
 
 def segmentDefault(args):
@@ -362,8 +454,37 @@ def main():
         'build', help='build the plan of xforms and generate output')
     buildParser.add_argument('-f', '--force',
                              help="force overwrite of generated files", action='store_true')
+    buildParser.add_argument('targets', nargs='*',
+                             help='only build xforms contributing to these generated files or model kinds')
+    buildParser.add_argument('--workers', type=int, default=0,
+                             help='number of local worker processes to build with')
+    buildParser.add_argument('--listen',
+                             help='host:port to listen on for workers')
+    buildParser.add_argument('--expect', type=int, default=0,
+                             help='number of workers to wait for at the listen address')
     buildParser.set_defaults(func=build)
 
+    workerParser = subparsers.add_parser(
+        'worker', help='execute xforms for a build coordinator, key in FASHION_AUTHKEY')
+    workerParser.add_argument('address', help='host:port of the coordinator')
+    workerParser.set_defaults(func=worker)
+
+    gcParser = subparsers.add_parser(
+        'gc', help='remove orphaned records and shrink the database')
+    gcParser.add_argument('-n', '--dryRun',
+                          help="only report what would be removed", action='store_true')
+    gcParser.set_defaults(func=gc)
+
+    whyParser = subparsers.add_parser(
+        'why', help='show what a generated file or model was built from')
+    whyParser.add_argument('target', help='a filename, or kind:id of a model')
+    whyParser.set_defaults(func=why)
+
+    impactParser = subparsers.add_parser(
+        'impact', help='show what is built from an input file or model')
+    impactParser.add_argument('target', help='a filename, or kind:id of a model')
+    impactParser.set_defaults(func=impact)
+
     createParser = subparsers.add_parser(
         'create', help='create a default xform, schema, model, etc.')
     createSubParser = createParser.add_subparsers(dest='createCommand',
@@ -401,6 +522,12 @@ def main():
     guessSchemaParser = subparsers.add_parser(
         'guess_schema', help='create a default schema for a model kind')
     guessSchemaParser.add_argument('kind', help='kind of model for schema')
+    guessSchemaParser.add_argument('--sample', type=int,
+                                   help='guess from a random sample of N models')
+    guessSchemaParser.add_argument('--workers', type=int, default=1,
+                                   help='number of processes to guess with')
+    guessSchemaParser.add_argument('--refine', action='store_true',
+                                   help='refine the existing schema with the models added since the last guess')
     guessSchemaParser.set_defaults(func=guessSchema)
 
     nabParser = subparsers.add_parser(
@@ -468,11 +595,13 @@ def main():
 
     logging.debug(result)
 
-    result.func(result)
+    status = result.func(result)
 
     global portfolio
     if portfolio is not None:
         portfolio.db.close()
+    if status:
+        sys.exit(status)
 
 
 #
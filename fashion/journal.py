@@ -0,0 +1,267 @@
+'''
+Journal - append-only TinyDB storage
+===================================
+
+TinyDB storages write the whole database on every flush, so a small change to a
+large database costs a full rewrite. JournalStorage instead keeps the database
+in memory, and appends each change to a journal file next to the database
+file:
+
+database.json - snapshot of the database, in the normal TinyDB JSON format
+database.json.journal - one JSON change per line since the snapshot
+
+When the database is opened, the snapshot is read and the journal is replayed
+on top of it. When the journal grows past a size threshold, it is compacted:
+the database is written to a new snapshot, which atomically replaces the old
+one, and the journal is discarded. The snapshot file is written in a
+background thread, while new changes go to a fresh journal.
+
+Changes are reported to the storage by JournaledTable, which must be used as
+the TinyDB table_class together with JournalStorage; openJournaled opens a
+TinyDB database with both, and returns its storage. Replaying a change twice
+has the same result as replaying it once, so a crash at any point loses at
+most the changes since the last flush.
+
+Journal entries are JSON lists:
+
+["put", table, doc_id, document] - insert or replace a document
+["del", table, [doc_id, ...]] - remove documents
+["purge", table] - remove all documents from a table
+["table", table] - create an empty table
+["drop", table] - remove a table
+
+Created on 2019-01-16 Copyright (c) 2019 Bradford Dillman
+'''
+
+import logging
+import os
+import threading
+
+from tinydb import TinyDB
+from tinydb.database import Table
+from tinydb.storages import Storage, touch
+
+from fashion import codec
+
+# Default journal size in bytes which triggers compaction.
+COMPACT_THRESHOLD = 16 * 1024 * 1024
+
+
+class JournalStorage(Storage):
+    '''TinyDB storage which appends changes to a journal.'''
+
+    def __init__(self, path, threshold=COMPACT_THRESHOLD, background=True):
+        '''
+        Constructor.
+
+        :param string path: the snapshot database filename.
+        :param int threshold: journal size in bytes which triggers compaction.
+        :param boolean background: write compacted snapshots in a thread.
+        '''
+        super(JournalStorage, self).__init__()
+        self.path = str(path)
+        touch(self.path, create_dirs=False)
+        self.journalPath = self.path + ".journal"
+        self.compactingPath = self.path + ".compacting"
+        self.threshold = threshold
+        self.background = background
+        self.cache = None
+        self.tableNames = set()
+        self.compactor = None
+        self.journalFile = None
+
+    def read(self):
+        if self.cache is None:
+            self.cache = self.load()
+            self.tableNames = set(self.cache)
+            self.journalFile = open(self.journalPath, mode="a")
+        return self.cache
+
+    def load(self):
+        '''Read the snapshot and replay the journals.'''
+        data = {}
+        if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+            with open(self.path, mode="r") as fd:
+                data = codec.load(fd)
+        # TinyDB uses int doc_ids in memory, but JSON keys are strings.
+        for name, table in data.items():
+            data[name] = {int(k): v for k, v in table.items()}
+        for path in [self.compactingPath, self.journalPath]:
+            if os.path.exists(path):
+                self.replay(data, path)
+        return data
+
+    def replay(self, data, path):
+        '''Apply the changes in a journal file to data.'''
+        with open(path, mode="r") as fd:
+            for line in fd:
+                try:
+                    entry = codec.loads(line)
+                except ValueError:
+                    # A partial last line from a crash.
+                    logging.warning("ignoring bad journal entry in {0}".format(path))
+                    break
+                op, name = entry[0], entry[1]
+                if op == "put":
+                    data.setdefault(name, {})[entry[2]] = entry[3]
+                elif op == "del":
+                    table = data.get(name, {})
+                    for doc_id in entry[2]:
+                        table.pop(doc_id, None)
+                elif op in ("purge", "table"):
+                    data[name] = {}
+                elif op == "drop":
+                    data.pop(name, None)
+
+    def write(self, data):
+        '''
+        Accept the new state of the database. Document changes have already
+        been journaled by JournaledTable, so only table changes are noted here.
+        '''
+        self.cache = data
+        names = set(data)
+        for name in self.tableNames - names:
+            self.journal(["drop", name])
+        for name in names - self.tableNames:
+            if len(data[name]) == 0:
+                self.journal(["table", name])
+        self.tableNames = names
+
+    def journal(self, entry):
+        '''Append a change to the journal.'''
+        if self.journalFile is None:
+            self.read()
+        self.journalFile.write(codec.dumps(entry))
+        self.journalFile.write("\n")
+
+    def flush(self):
+        '''Make the journal durable, and compact it if it's too big.'''
+        if self.journalFile is None:
+            return
+        self.journalFile.flush()
+        os.fsync(self.journalFile.fileno())
+        if self.journalFile.tell() > self.threshold:
+            self.compact(self.background)
+
+    def compact(self, background=False):
+        '''
+        Write the database to a new snapshot and discard the journal.
+
+        :param boolean background: write the snapshot file in a thread.
+        '''
+        self.wait()
+        if self.cache is None:
+            return
+        # Serialize now, so later changes can't affect the snapshot.
+        snapshot = codec.dumps(self.cache)
+        # Later changes go to a fresh journal.
+        self.journalFile.close()
+        os.replace(self.journalPath, self.compactingPath)
+        self.journalFile = open(self.journalPath, mode="a")
+        if background:
+            self.compactor = threading.Thread(
+                target=self.writeSnapshot, args=(snapshot,))
+            self.compactor.start()
+        else:
+            self.writeSnapshot(snapshot)
+
+    def writeSnapshot(self, snapshot):
+        '''Atomically replace the snapshot file, then drop the old journal.'''
+        tmpPath = self.path + ".tmp"
+        with open(tmpPath, mode="w") as fd:
+            fd.write(snapshot)
+            fd.flush()
+            os.fsync(fd.fileno())
+        os.replace(tmpPath, self.path)
+        os.remove(self.compactingPath)
+
+    def wait(self):
+        '''Wait for a background compaction to finish.'''
+        if self.compactor is not None:
+            self.compactor.join()
+            self.compactor = None
+
+    def journalSize(self):
+        '''Get the size in bytes of the journal.'''
+        if self.journalFile is None:
+            return 0
+        self.journalFile.flush()
+        return self.journalFile.tell()
+
+    def close(self):
+        self.flush()
+        self.wait()
+        if self.journalFile is not None:
+            self.journalFile.close()
+            self.journalFile = None
+
+
+class JournaledTable(Table):
+    '''TinyDB table which reports document changes to a JournalStorage.'''
+
+    def __init__(self, storage, name, journal, **options):
+        '''
+        Constructor.
+
+        :param storage: the TinyDB storage proxy of the table.
+        :param string name: the table name.
+        :param JournalStorage journal: the storage to report changes to.
+        '''
+        super(JournaledTable, self).__init__(storage, name, **options)
+        self.journal = journal
+
+    def _journal(self, entry):
+        self.journal.journal(entry)
+
+    def _journalDocs(self, doc_ids):
+        data = self._read()
+        for doc_id in doc_ids:
+            self._journal(["put", self.name, doc_id, data[doc_id]])
+
+    def insert(self, document):
+        doc_id = super(JournaledTable, self).insert(document)
+        self._journal(["put", self.name, doc_id, dict(document)])
+        return doc_id
+
+    def insert_multiple(self, documents):
+        documents = list(documents)
+        doc_ids = super(JournaledTable, self).insert_multiple(documents)
+        for doc_id, doc in zip(doc_ids, documents):
+            self._journal(["put", self.name, doc_id, dict(doc)])
+        return doc_ids
+
+    def remove(self, cond=None, doc_ids=None, eids=None):
+        removed = super(JournaledTable, self).remove(cond, doc_ids, eids)
+        if removed:
+            self._journal(["del", self.name, list(removed)])
+        return removed
+
+    def update(self, fields, cond=None, doc_ids=None, eids=None):
+        updated = super(JournaledTable, self).update(fields, cond, doc_ids, eids)
+        self._journalDocs(updated)
+        return updated
+
+    def write_back(self, documents, doc_ids=None, eids=None):
+        written = super(JournaledTable, self).write_back(documents, doc_ids, eids)
+        self._journalDocs(written)
+        return written
+
+    def purge(self):
+        super(JournaledTable, self).purge()
+        self._journal(["purge", self.name])
+
+
+def openJournaled(path, **kwargs):
+    '''
+    Open a TinyDB database with a JournalStorage and JournaledTables.
+
+    :param string path: the snapshot database filename.
+    :param kwargs: JournalStorage options.
+    :returns: the database, and its storage.
+    :rtype: (TinyDB, JournalStorage)
+    '''
+    storage = JournalStorage(path, **kwargs)
+    db = TinyDB(storage=lambda: storage,
+                table_class=lambda proxy, name, **options: JournaledTable(
+                    proxy, name, storage, **options))
+    return db, storage
@@ -32,6 +32,9 @@ scheduled by their dependencies. Xform objects which use a kind listed in
 their inputKinds, are scheduled to execute after all the xform objects which
 list that kind in the outputKinds.
 
+Models are read as read-only ModelView objects, which wrap the stored records
+without copying them. Use toDict() on a ModelView to get a modifiable copy.
+
 ModelAccessContext tracks the operations performed on the database. These are
 used to delete records inserted the last time a context was used.
 
@@ -44,12 +47,18 @@ is undefined.
 Nested access would put a context under a parent context, and if the parent 
 context were reset, it would recursivly reset all child contexts. Someday.
 
+Entering a ModelAccess makes it the active one for the current thread or
+asyncio task, held in the activeModelAccess context variable until it exits.
+Xform code finds it with getService('fashion.prime.modelAccess'), so xforms
+running at the same time in different threads or tasks each get their own.
+
 Created on 2018-12-28 Copyright (c) 2018 Bradford Dillman
 '''
 
 import copy
 import logging
 
+from contextvars import ContextVar
 from pathlib import Path
 
 from jsonschema import ValidationError
@@ -57,6 +66,11 @@ from munch import Munch
 from tinydb import Query, where
 
 from fashion.databaseAccess import DatabaseAccess
+from fashion.events import MODEL_INSERTED, bus
+from fashion.modelView import plain
+
+# The ModelAccess entered in the current thread or task.
+activeModelAccess = ContextVar("fashion.prime.modelAccess", default=None)
 
 
 class ModelAccessContext(object):
@@ -153,6 +167,7 @@ class ModelAccessContext(object):
         :param kind: the string name of the kind of model to insert.
         :param model: the model object to insert.
         '''
+        model = plain(model)
         try:
             self.repo.validate(kind, model)
         except ValidationError:
@@ -162,12 +177,42 @@ class ModelAccessContext(object):
         if self.isAllowedOutput(kind):
             id = self.dba.table(kind).insert(model)
             self.recordAccess(self.insertStore, kind, id)
+            if bus.handlers[MODEL_INSERTED]:
+                bus.emit(MODEL_INSERTED, kind, id, model)
         else:
             logging.error(
                 "attempt to write unlisted outputKind {0}".format(kind))
         return id
 
+    def insertMultiple(self, kind, models):
+        '''
+        Insert a list of models in one database write.
+        Models which fail validation are logged and skipped.
+        :param kind: the string name of the kind of model to insert.
+        :param models: list of model objects to insert.
+        '''
+        if not self.isAllowedOutput(kind):
+            logging.error(
+                "attempt to write unlisted outputKind {0}".format(kind))
+            return []
+        valid = []
+        for model in models:
+            model = plain(model)
+            try:
+                self.repo.validate(kind, model)
+                valid.append(model)
+            except ValidationError:
+                logging.error("Validation error: kind={0}".format(kind))
+        ids = self.dba.table(kind).insert_multiple(valid)
+        for id in ids:
+            self.recordAccess(self.insertStore, kind, id)
+        if bus.handlers[MODEL_INSERTED]:
+            for id, model in zip(ids, valid):
+                bus.emit(MODEL_INSERTED, kind, id, model)
+        return ids
+
     def setSingleton(self, kind, model):
+        model = plain(model)
         try:
             self.repo.validate(kind, model)
         except ValidationError:
@@ -178,18 +223,31 @@ class ModelAccessContext(object):
             self.dba.table(kind).purge()
             id = self.dba.table(kind).insert(model)
             self.recordAccess(self.insertStore, kind, id)
+            if bus.handlers[MODEL_INSERTED]:
+                bus.emit(MODEL_INSERTED, kind, id, model)
         else:
             logging.error(
                 "attempt to write unlisted outputKind {0}".format(kind))
         return id
 
+    def views(self, kind, q=None):
+        '''
+        Get ModelViews of stored models, without copying the models.
+        :param kind: the model kind.
+        :param q: optional query the models must match.
+        '''
+        objs = self.dba.views(kind, q)
+        for o in objs:
+            self.recordAccess(self.searchStore, kind, o._doc_id)
+        return objs
+
     def getSingleton(self, kind):
         if self.isAllowedInput(kind):
-            objs = self.dba.table(kind).all()
+            objs = self.dba.views(kind)
             if len(objs) == 0:
                 return None
             obj = objs[0]
-            self.recordAccess(self.searchStore, kind, obj.doc_id)
+            self.recordAccess(self.searchStore, kind, obj._doc_id)
             return obj
         else:
             logging.error(
@@ -203,10 +261,7 @@ class ModelAccessContext(object):
         :param q: the query to perform.
         '''
         if self.isAllowedInput(kind):
-            objs = self.dba.table(kind).search(q)
-            for o in objs:
-                self.recordAccess(self.searchStore, kind, o.doc_id)
-            return objs
+            return self.views(kind, q)
         else:
             logging.error(
                 "attempt to search unlisted inputKind {0}".format(kind))
@@ -214,10 +269,7 @@ class ModelAccessContext(object):
 
     def getByKind(self, kind):
         if self.isAllowedInput(kind):
-            objs = self.dba.table(kind).all()
-            for o in objs:
-                self.recordAccess(self.searchStore, kind, o.doc_id)
-            return objs
+            return self.views(kind)
         else:
             logging.error(
                 "attempt to getByKind unlisted inputKind {0}".format(kind))
@@ -225,8 +277,10 @@ class ModelAccessContext(object):
 
     def getById(self, kind, id):
         if self.isAllowedInput(kind):
-            o = self.dba.table(kind).get(doc_id=id)
-            self.recordAccess(self.searchStore, kind, o.doc_id)
+            o = self.dba.view(kind, id)
+            if o is None:
+                return None
+            self.recordAccess(self.searchStore, kind, o._doc_id)
             return o
         else:
             logging.error(
@@ -253,10 +307,12 @@ class ModelAccess(object):
         '''Set up context.'''
         self.dba = self.dbToUse
         self.context.reset()
+        self.activeToken = activeModelAccess.set(self)
         return self
 
     def __exit__(self, etype, value, traceback):
         '''Record context activity in database.'''
+        activeModelAccess.reset(self.activeToken)
         self.context.finalize()
         self.dba = None
 
@@ -273,6 +329,15 @@ class ModelAccess(object):
             self.trace(kind, id, traceInputs)
         return id
 
+    def insertMultiple(self, kind, models):
+        '''
+        Insert a list of models in bulk.
+        :param kind: the model kind.
+        :param models: list of models.
+        :return: list of database doc_id numbers of the new records.
+        '''
+        return self.context.insertMultiple(kind, models)
+
     def setSingleton(self, kind, model, traceInputs=None):
         '''
         Insert a single record, replacing any existing record.
@@ -357,9 +422,9 @@ class ModelAccess(object):
         }
         return self.insert(traceKind, traceModel)
 
-    def inputFile(self, filename):
+    def fileModel(self, filename):
         '''
-        Mark a file as an input.
+        Make a file record model for this context.
         '''
         if isinstance(filename, Path):
             fn = filename.absolute().as_posix()
@@ -367,24 +432,26 @@ class ModelAccess(object):
             fn = Path(filename).absolute().as_posix()
         else:
             fn = str(filename)
-        model = {
+        return {
             'contextName': self.context.properties.name,
             'filename': fn
         }
-        return self.insert('fashion.core.input.file', model)
+
+    def inputFile(self, filename):
+        '''
+        Mark a file as an input.
+        '''
+        return self.insert('fashion.core.input.file', self.fileModel(filename))
+
+    def inputFiles(self, filenames):
+        '''
+        Mark a list of files as inputs.
+        '''
+        models = [self.fileModel(fn) for fn in filenames]
+        return self.insertMultiple('fashion.core.input.file', models)
 
     def outputFile(self, filename):
         '''
         Mark a file as an output.
         '''
-        if isinstance(filename, Path):
-            fn = filename.absolute().as_posix()
-        elif isinstance(filename, str):
-            fn = Path(filename).absolute().as_posix()
-        else:
-            fn = str(filename)
-        model = {
-            'contextName': self.context.properties.name,
-            'filename': fn
-        }
-        return self.insert('fashion.core.output.file', model)
+        return self.insert('fashion.core.output.file', self.fileModel(filename))
@@ -0,0 +1,146 @@
+'''
+ModelView - read-only model access without copying
+===================================
+
+Models read through ModelAccess are wrapped in ModelView objects rather than
+copied. A ModelView is a read-only Mapping over the stored record, with
+attribute access like a Munch. Nested objects and lists are wrapped lazily,
+only when they are accessed, so reading one field of a large model costs the
+same as reading one field of a small model.
+
+Since the stored record is shared, not copied, views can't be modified. Use
+toDict() to get a plain, modifiable copy.
+
+Views are converted back to plain objects by plain() before a model is written
+to the database.
+
+A top level view also holds its record's doc_id and kind, as _doc_id and
+_kind. Attribute access always reads the model's own fields first, so a model
+with a field named "kind" or "doc_id" reads that field; view.doc_id and
+view.kind only fall back to the record's doc_id and kind when the model has
+no such field. Code which needs the record's identity uses _doc_id and _kind.
+
+Created on 2019-01-12 Copyright (c) 2019 Bradford Dillman
+'''
+
+from collections.abc import Mapping, Sequence
+
+
+def wrap(value):
+    '''Wrap a stored value in a view, if it is an object or list.'''
+    if isinstance(value, dict):
+        return ModelView(value)
+    if isinstance(value, list):
+        return ListView(value)
+    return value
+
+
+def plain(value):
+    '''
+    Convert any views within value back to plain dicts and lists.
+    Plain containers are only copied if they contain a view.
+    '''
+    if isinstance(value, (ModelView, ListView)):
+        return value.toDict()
+    if isinstance(value, dict):
+        items = {k: plain(v) for k, v in value.items()}
+        if all(items[k] is value[k] for k in items):
+            return value
+        return items
+    if isinstance(value, list):
+        items = [plain(v) for v in value]
+        if all(a is b for a, b in zip(items, value)):
+            return value
+        return items
+    return value
+
+
+def copyValue(value):
+    '''Deep copy a stored value into plain dicts and lists.'''
+    if isinstance(value, dict):
+        return {k: copyValue(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [copyValue(v) for v in value]
+    return value
+
+
+class ModelView(Mapping):
+    '''Read-only view of a stored model object.'''
+
+    __slots__ = ('_data', '_doc_id', '_kind')
+
+    def __init__(self, data, doc_id=None, kind=None):
+        '''
+        Constructor.
+
+        :param dict data: the stored object, which is not copied.
+        :param int doc_id: database doc_id of a top level record, else None.
+        :param string kind: model kind of a top level record, else None.
+        '''
+        object.__setattr__(self, '_data', data)
+        object.__setattr__(self, '_doc_id', doc_id)
+        object.__setattr__(self, '_kind', kind)
+
+    def __getitem__(self, key):
+        return wrap(self._data[key])
+
+    def __getattr__(self, name):
+        try:
+            return wrap(self._data[name])
+        except KeyError:
+            pass
+        if name in ('doc_id', 'kind'):
+            return object.__getattribute__(self, '_' + name)
+        raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        raise TypeError("ModelView is read-only")
+
+    def __delattr__(self, name):
+        raise TypeError("ModelView is read-only")
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __repr__(self):
+        return "ModelView({0!r})".format(self._data)
+
+    def toDict(self):
+        '''Get a plain, modifiable deep copy.'''
+        return copyValue(self._data)
+
+
+class ListView(Sequence):
+    '''Read-only view of a stored list.'''
+
+    __slots__ = ('_data',)
+
+    def __init__(self, data):
+        self._data = data
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return ListView(self._data[index])
+        return wrap(self._data[index])
+
+    def __len__(self):
+        return len(self._data)
+
+    def __eq__(self, other):
+        if isinstance(other, (list, ListView)):
+            return len(self) == len(other) and all(
+                a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __repr__(self):
+        return "ListView({0!r})".format(self._data)
+
+    def toDict(self):
+        '''Get a plain, modifiable deep copy.'''
+        return copyValue(self._data)
@@ -12,23 +12,38 @@ project directory - your project
 /fashion - added by 'fashion init'
 /fashion/warehouse - contains local segments
 
+Portfolios on the same host can share a segment store (see fashion.store) by
+setting the "segmentStore" property, or the FASHION_STORE environment variable,
+to its directory. Imported segments are then linked from the store, and the
+store's segments are available as a fallback warehouse.
+
+Generated files are cached in ./fashion/database.renders, up to the
+"renderCacheBytes" property (64MB by default), see fashion.renderCache.
+
+Xform executions can be cached across builds and machines by setting the
+"buildCache" property, or the FASHION_BUILD_CACHE environment variable, to a
+directory, see fashion.buildCache.
+
 Created on 2018-12-14 Copyright (c) 2018 Bradford Dillman
 '''
 
 import copy
+import os
 import shutil
 import logging
-import json
 
 from pathlib import Path
 
 from munch import Munch, munchify
 
+from fashion import codec
+from fashion.buildCache import BuildCache
 from fashion.databaseAccess import DatabaseAccess
 from fashion.mirror import Mirror
 from fashion.modelAccess import ModelAccess
 from fashion.runway import Runway
 from fashion.segment import Segment
+from fashion.store import SegmentStore
 from fashion.util import cd
 from fashion.warehouse import Warehouse
 
@@ -42,12 +57,14 @@ FASHION_WAREHOUSE_PATH = FASHION_HOME / "warehouse"
 class Portfolio(object):
     '''Represents a fashion user project.'''
 
-    def __init__(self, projDir):
+    def __init__(self, projDir, dbPath=None):
         '''
         Initialize a portfolio mapped to the given directory, whether or not 
         the directory actually exists.
 
         :param str projDir: where the project is located. 
+        :param Path dbPath: a database to use instead of the project's own,
+        e.g. a build worker's scratch database.
         '''
         self.projectPath = projDir.absolute()
         self.fashionPath = self.projectPath / 'fashion'
@@ -57,18 +74,47 @@ class Portfolio(object):
         self.mirror = Mirror(self.projectPath, self.mirrorPath)
         if self.fashionDbPath.exists():
             self.load()
-            self.db = DatabaseAccess(self.fashionDbPath)
+            self.db = DatabaseAccess(dbPath or self.fashionDbPath,
+                                     self.properties.get("journal", True))
 
     def __setDefaultProperties(self):
         self.properties = munchify({
             "name": "fashion",
             "defaultSegment": "local",
+            "journal": True,
             "warehouses": [(self.fashionPath / 'warehouse').as_posix()]
         })
 
+    def getSegmentStore(self):
+        '''
+        Get the segment store shared by portfolios, if one is configured.
+
+        :returns: the store, or None.
+        :rtype: fashion.store.SegmentStore
+        '''
+        storeDir = self.properties.get("segmentStore") or os.environ.get("FASHION_STORE")
+        if not storeDir:
+            return None
+        return SegmentStore(self.projectPath / storeDir)
+
+    def getBuildCache(self):
+        '''
+        Get the cache of xform executions, if one is configured.
+
+        :returns: the cache, or None.
+        :rtype: fashion.buildCache.BuildCache
+        '''
+        cacheDir = self.properties.get("buildCache") or os.environ.get("FASHION_BUILD_CACHE")
+        if not cacheDir:
+            return None
+        return BuildCache(self.projectPath / cacheDir, self.properties.get("buildCacheBytes"))
+
     def loadWarehouses(self):
         self.warehouse = None
         wl = copy.copy(self.properties.warehouses)
+        store = self.getSegmentStore()
+        if store is not None:
+            wl.append(store.warehouseDir.as_posix())
         wl.append(FASHION_WAREHOUSE_PATH.as_posix())
         wl.reverse()
         for wp in wl:
@@ -85,7 +131,8 @@ class Portfolio(object):
             self.__setDefaultProperties()
             self.fashionPath.mkdir(parents=True, exist_ok=True)
             (self.fashionPath / "warehouse").mkdir(parents=True, exist_ok=True)
-            self.db = DatabaseAccess(self.fashionDbPath)
+            self.db = DatabaseAccess(self.fashionDbPath,
+                                     self.properties.journal)
             self.loadWarehouses()
             self.warehouse.newSegment("local", self.db)
             self.save()
@@ -99,12 +146,12 @@ class Portfolio(object):
     def save(self):
         '''Save the portfolio.'''
         with self.portfolioPath.open(mode="w") as pf:
-            pf.write(self.properties.toJSON(sort_keys=True, indent=4))
+            codec.dump(self.properties, pf, sort_keys=True, indent=4)
 
     def load(self):
         '''Load a portfolio from a file.'''
         with self.portfolioPath.open(mode='r') as fd:
-            dict = json.loads(fd.read())
+            dict = codec.load(fd)
             self.properties = munchify(dict)
         self.loadWarehouses()
 
@@ -128,7 +175,9 @@ class Portfolio(object):
         '''
         self.warehouse.loadSegments(self.db)
         r = Runway(self.db, self.warehouse)
+        r.buildCache = self.getBuildCache()
         r.loadModules()
+        r.loadStorage()
         r.initModules()
         return r
 
@@ -0,0 +1,313 @@
+'''
+Provenance - indexed graph of what was built from what
+===================================
+
+The model database already records provenance, spread over several tables:
+each context records the models it read and inserted, the file tables record
+which contexts read and wrote which files, and fashion.prime.trace records
+which input models each traced model came from. Answering "where did this file
+come from" from those tables needs repeated full table scans.
+
+ProvenanceGraph collects all of it into one directed graph, with an edge from
+each thing to each thing made from it. Nodes are input and output files, model
+records (kind:id) and xform contexts:
+
+input file -> context which read it
+model -> context which read it
+context -> model it inserted
+trace input model -> traced model
+context -> output file it wrote
+
+The graph is stored in compressed sparse row form, with forward and reverse
+adjacency arrays, in a '.provenance' file beside the database. It is indexed
+after each build and each gc, so queries only have to load it. The file's
+header holds a digest of the records the graph was built from, and indexing
+only rebuilds the graph when they have changed since. Indexing also stamps the
+database with that digest, so a query only compares the stamp with the saved
+graph's header, instead of reading the records.
+
+Created on 2019-01-21 Copyright (c) 2019 Bradford Dillman
+'''
+
+import bisect
+import hashlib
+import struct
+
+from array import array
+from collections import deque
+from pathlib import Path
+
+from munch import Munch
+
+from fashion import codec
+
+MAGIC = b"FASHPRV2"
+HEADER = struct.Struct("<8s32sQ")
+
+# Model kinds which are bookkeeping, not models in the graph.
+fileKinds = {'fashion.core.input.file', 'fashion.core.output.file'}
+
+# Singleton stamping the database with the digest of its indexed graph.
+stampKind = 'fashion.prime.provenance'
+
+# Tables the graph is built from.
+provenanceKinds = ['fashion.core.input.file', 'fashion.core.output.file',
+                   'fashion.prime.trace', 'fashion.prime.context']
+
+
+def fileNode(filename):
+    '''Get the node name of a file.'''
+    return "f " + Path(filename).absolute().as_posix()
+
+
+def modelNode(kind, id):
+    '''Get the node name of a model record.'''
+    return "m {0}:{1}".format(kind, id)
+
+
+def contextNode(name):
+    '''Get the node name of a context.'''
+    return "x " + name
+
+
+def isModelKind(kind):
+    return kind not in fileKinds and not kind.startswith("fashion.prime")
+
+
+def fileOf(table, id):
+    '''Get the filename of a file record by doc_id, or None.'''
+    doc = table.get(id, table.get(str(id)))
+    return None if doc is None else doc["filename"]
+
+
+def collectEdges(dba):
+    '''
+    Collect the provenance edges from the model database.
+
+    :param DatabaseAccess dba: the database.
+    :returns: set of (source, destination) node names.
+    '''
+    inFiles = dba.rawTable('fashion.core.input.file')
+    outFiles = dba.rawTable('fashion.core.output.file')
+    traced = {}
+    for t in dba.rawTable('fashion.prime.trace').values():
+        if t["id"] is None:
+            continue
+        traced.setdefault(modelNode(t["kind"], t["id"]), []).extend(
+            modelNode(k, i) for k, i in t["inputs"])
+    edges = set()
+    for ctx in dba.rawTable('fashion.prime.context').values():
+        x = contextNode(ctx["name"])
+        for kind, ids in ctx.get("insert", {}).items():
+            if kind == 'fashion.core.input.file':
+                edges.update((fileNode(fileOf(inFiles, id)), x) for id in ids
+                             if fileOf(inFiles, id) is not None)
+            elif kind == 'fashion.core.output.file':
+                edges.update((x, fileNode(fileOf(outFiles, id))) for id in ids
+                             if fileOf(outFiles, id) is not None)
+            elif isModelKind(kind):
+                for id in ids:
+                    m = modelNode(kind, id)
+                    edges.add((x, m))
+                    edges.update((i, m) for i in traced.get(m, ()))
+        for kind, ids in ctx.get("search", {}).items():
+            if isModelKind(kind):
+                edges.update((modelNode(kind, id), x) for id in ids)
+    return edges
+
+
+def provenanceDigest(dba):
+    '''
+    Get a digest of the records the provenance graph is built from.
+
+    :param DatabaseAccess dba: the database.
+    :rtype: bytes
+    '''
+    h = hashlib.sha256()
+    for kind in provenanceKinds:
+        h.update(codec.dumps(dba.rawTable(kind)).encode("utf-8"))
+    return h.digest()
+
+
+def savedDigest(path):
+    '''Get the digest in a saved graph's header, or None.'''
+    try:
+        with Path(path).open(mode="rb") as fd:
+            header = fd.read(HEADER.size)
+    except FileNotFoundError:
+        return None
+    if len(header) < HEADER.size:
+        return None
+    magic, digest, _ = HEADER.unpack(header)
+    return digest if magic == MAGIC else None
+
+
+class ProvenanceGraph(object):
+    '''Provenance graph with forward and reverse adjacency.'''
+
+    def __init__(self, nodes, fwdStart, fwdEdges, revStart, revEdges):
+        '''
+        Constructor, use build() or load() instead.
+
+        :param list(string) nodes: sorted node names.
+        :param array fwdStart: index in fwdEdges of each node's successors.
+        :param array fwdEdges: successor node indexes.
+        :param array revStart: index in revEdges of each node's predecessors.
+        :param array revEdges: predecessor node indexes.
+        '''
+        self.nodes = nodes
+        self.fwd = (fwdStart, fwdEdges)
+        self.rev = (revStart, revEdges)
+
+    @staticmethod
+    def build(dba):
+        '''Build the graph from the model database.'''
+        edges = collectEdges(dba)
+        nodes = sorted({n for e in edges for n in e})
+        index = {n: i for i, n in enumerate(nodes)}
+        pairs = [(index[s], index[d]) for s, d in edges]
+        fwd = ProvenanceGraph.adjacency(len(nodes), pairs)
+        rev = ProvenanceGraph.adjacency(len(nodes), [(d, s) for s, d in pairs])
+        return ProvenanceGraph(nodes, fwd[0], fwd[1], rev[0], rev[1])
+
+    @staticmethod
+    def adjacency(count, pairs):
+        '''Make compressed sparse row arrays from (from, to) pairs.'''
+        pairs.sort()
+        start = array("q", [0]) * (count + 1)
+        for s, _ in pairs:
+            start[s + 1] += 1
+        for i in range(count):
+            start[i + 1] += start[i]
+        return start, array("q", (d for _, d in pairs))
+
+    @staticmethod
+    def path(dba):
+        '''Get the graph filename for a database.'''
+        return Path(dba.filename).with_suffix(".provenance")
+
+    def save(self, path, digest=b"\0" * 32):
+        '''Save the graph to a file, with the digest of its records.'''
+        arrays = [self.fwd[0], self.fwd[1], self.rev[0], self.rev[1]]
+        header = codec.dumps({
+            "nodes": self.nodes,
+            "counts": [len(a) for a in arrays]}).encode("utf-8")
+        with Path(path).open(mode="wb") as fd:
+            fd.write(HEADER.pack(MAGIC, digest, len(header)))
+            fd.write(header)
+            for a in arrays:
+                fd.write(a.tobytes())
+
+    @staticmethod
+    def load(path):
+        '''Load a saved graph, or return None if there isn't one.'''
+        path = Path(path)
+        if not path.exists():
+            return None
+        data = path.read_bytes()
+        magic, _, length = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            return None
+        offset = HEADER.size + length
+        header = codec.loads(data[HEADER.size:offset])
+        arrays = []
+        for count in header["counts"]:
+            a = array("q")
+            a.frombytes(data[offset:offset + count * a.itemsize])
+            offset += count * a.itemsize
+            arrays.append(a)
+        return ProvenanceGraph(header["nodes"], *arrays)
+
+    def find(self, node):
+        '''Get the index of a node name, or None.'''
+        i = bisect.bisect_left(self.nodes, node)
+        if i < len(self.nodes) and self.nodes[i] == node:
+            return i
+        return None
+
+    def reach(self, node, adjacency):
+        '''Get the indexes of all nodes reachable from a node.'''
+        start, edges = adjacency
+        first = self.find(node)
+        if first is None:
+            return None
+        seen = {first}
+        pending = deque([first])
+        while pending:
+            i = pending.popleft()
+            for j in edges[start[i]:start[i + 1]]:
+                if j not in seen:
+                    seen.add(j)
+                    pending.append(j)
+        seen.discard(first)
+        return seen
+
+    def report(self, indexes):
+        '''Sort reached nodes into files, models and xforms.'''
+        if indexes is None:
+            return None
+        result = Munch(files=[], models=[], xforms=[])
+        lists = {"f": result.files, "m": result.models, "x": result.xforms}
+        for i in sorted(indexes):
+            node = self.nodes[i]
+            lists[node[0]].append(node[2:])
+        return result
+
+    def why(self, node):
+        '''
+        Get everything a file or model was built from.
+
+        :param string node: node name from fileNode or modelNode.
+        :returns: Munch of files, models and xforms lists, or None if unknown.
+        '''
+        return self.report(self.reach(node, self.rev))
+
+    def impact(self, node):
+        '''
+        Get everything built from a file or model.
+
+        :param string node: node name from fileNode or modelNode.
+        :returns: Munch of files, models and xforms lists, or None if unknown.
+        '''
+        return self.report(self.reach(node, self.fwd))
+
+
+def indexProvenance(dba):
+    '''
+    Rebuild and save the provenance graph of a database, if its records have
+    changed since it was saved, and stamp the database with the graph's
+    digest. Called after each build and gc.
+
+    :param DatabaseAccess dba: the database.
+    :returns: the rebuilt graph, or None if the saved one is up to date.
+    :rtype: ProvenanceGraph
+    '''
+    path = ProvenanceGraph.path(dba)
+    digest = provenanceDigest(dba)
+    graph = None
+    if savedDigest(path) != digest:
+        graph = ProvenanceGraph.build(dba)
+        graph.save(path, digest)
+    stamp = dba.getSingleton(stampKind)
+    if stamp is None or stamp["digest"] != digest.hex():
+        dba.setSingleton(stampKind, {"digest": digest.hex()})
+    return graph
+
+
+def loadProvenance(dba):
+    '''
+    Load the provenance graph of a database. The database's stamp is compared
+    with the saved graph's digest, without reading the provenance records,
+    and the graph is only rebuilt if it's missing or from another build.
+
+    :param DatabaseAccess dba: the database.
+    :rtype: ProvenanceGraph
+    '''
+    path = ProvenanceGraph.path(dba)
+    stamp = dba.getSingleton(stampKind)
+    digest = savedDigest(path)
+    if stamp is not None and digest is not None and stamp["digest"] == digest.hex():
+        graph = ProvenanceGraph.load(path)
+        if graph is not None:
+            return graph
+    return indexProvenance(dba) or ProvenanceGraph.load(path)
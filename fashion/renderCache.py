@@ -0,0 +1,156 @@
+'''
+RenderCache - rendered outputs kept across builds
+===================================
+
+Signatures (see fashion.signature) skip rendering a file which is already up
+to date. A render cache also skips rendering when the file isn't up to date,
+but the same template set has been rendered with the same model before: a
+deleted or reverted file, a model changed and then changed back, or several
+outputs generated identically.
+
+Rendered files are kept beside the database, in the .renders directory,
+named by their signature, which is the hash of the resolved template set and
+the canonicalised model. On a hit, the target is only written if it differs
+from the cached file.
+
+The cache is bounded in size. Hits touch the cached file's mtime, and when
+the cache grows past its limit the least recently used files are removed.
+Files bigger than the limit are not cached at all.
+
+Created on 2019-01-27 Copyright (c) 2019 Bradford Dillman
+'''
+
+import filecmp
+import os
+import shutil
+
+from pathlib import Path
+
+# Default size limit of a render cache, in bytes.
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+class RenderCache(object):
+    '''A size-bounded LRU cache of rendered files, by signature.'''
+
+    def __init__(self, dir, maxBytes=None):
+        '''
+        Constructor.
+
+        :param Path dir: the cache directory, created when first written.
+        :param int maxBytes: the size limit, DEFAULT_MAX_BYTES if None.
+        '''
+        self.dir = Path(dir)
+        self.maxBytes = DEFAULT_MAX_BYTES if maxBytes is None else maxBytes
+        self.size = None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def path(dba):
+        '''Get the render cache directory of a database.'''
+        return Path(dba.filename).with_suffix(".renders")
+
+    def entry(self, key):
+        '''Get the path of a cached file.'''
+        return self.dir / key[:2] / key
+
+    def get(self, key):
+        '''
+        Look up a rendered file, counting a hit or miss.
+
+        :param string key: the signature of the rendered file.
+        :returns: the cached file, or None.
+        :rtype: Path
+        '''
+        path = self.entry(key)
+        try:
+            os.utime(str(path))
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return path
+
+    def restore(self, cached, targetFile):
+        '''
+        Make a target file the same as a cached file.
+
+        :param Path cached: the cached file from get().
+        :param Path targetFile: the target file.
+        :returns: True if the target was written, False if it was the same.
+        '''
+        if targetFile.exists() and filecmp.cmp(str(cached), str(targetFile), shallow=False):
+            return False
+        tmp = targetFile.with_name(targetFile.name + ".tmp")
+        shutil.copyfile(str(cached), str(tmp))
+        os.replace(str(tmp), str(targetFile))
+        return True
+
+    def put(self, key, renderedFile):
+        '''
+        Add a rendered file to the cache, evicting old files if it's full.
+        Files bigger than the whole cache are skipped, not copied.
+
+        :param string key: the signature of the rendered file.
+        :param Path renderedFile: the rendered file to copy.
+        '''
+        if self.entry(key).exists() or renderedFile.stat().st_size > self.maxBytes:
+            return
+        tmp = self.tempPath(key)
+        shutil.copyfile(str(renderedFile), str(tmp))
+        self.add(key, tmp)
+
+    def tempPath(self, key):
+        '''Get a temporary path beside an entry, to write it before add().'''
+        path = self.entry(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return path.with_name("{0}.{1}.tmp".format(key, os.getpid()))
+
+    def add(self, key, tmpFile):
+        '''
+        Move a file from tempPath() into the cache, replacing any entry with
+        the same key, and evict old files if it's full.
+
+        :param string key: the key of the entry.
+        :param Path tmpFile: the file to move.
+        '''
+        path = self.entry(key)
+        os.replace(str(tmpFile), str(path))
+        if self.size is None:
+            self.size = sum(size for _, size, _ in self.entries())
+        else:
+            self.size += path.stat().st_size
+        if self.size > self.maxBytes:
+            self.evict()
+
+    def entries(self):
+        '''List the cached files as (mtime, size, path).'''
+        result = []
+        if self.dir.exists():
+            for sub in self.dir.iterdir():
+                for path in sub.iterdir():
+                    try:
+                        st = path.stat()
+                    except OSError:
+                        continue
+                    result.append((st.st_mtime_ns, st.st_size, path))
+        return result
+
+    def evict(self):
+        '''Remove least recently used files, down to 90% of the limit.'''
+        entries = sorted(self.entries(), key=lambda e: e[0])
+        self.size = sum(size for _, size, _ in entries)
+        limit = self.maxBytes * 9 // 10
+        for _, size, path in entries:
+            if self.size <= limit:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                pass
+            self.size -= size
+
+    def stats(self):
+        '''Describe the hits and misses.'''
+        return "render cache: {0} hits, {1} misses".format(self.hits, self.misses)
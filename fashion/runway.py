@@ -10,17 +10,26 @@ A collection of xform modules and xform objects.
 
 import copy
 import logging
+import sys
 import traceback
 
-from munch import Munch, munchify
+from pathlib import Path
+
+from jinja2 import ChoiceLoader, FileSystemLoader
+from munch import Munch
 from tinydb import Query
 
+from fashion.buildCache import RecordingModelAccess
 from fashion.codeRegistry import CodeRegistry
-from fashion.modelAccess import ModelAccess
-from fashion.schema import SchemaRepository
+from fashion.columnar import columnSpec
+from fashion.events import (INIT_FINISHED, INIT_STARTED, MODULE_LOADED, PLAN_READY,
+                            SEGMENT_LOADED, XFORM_FINISHED, XFORM_STARTED, bus)
+from fashion.modelAccess import ModelAccess, activeModelAccess
+from fashion.provenance import indexProvenance
+from fashion.schema import Schema, SchemaRepository
 from fashion.util import cd
 from fashion.warehouse import Warehouse
-from fashion.xforms import XformModule
+from fashion.xforms import XformModule, XformRecord, activeXform
 
 
 class Runway(object):
@@ -34,12 +43,18 @@ class Runway(object):
         self.schemaDefs = {}
         self.dba = dba
         self.warehouse = wh
-        self.schemaRepo = SchemaRepository()
+        self.schemaRepo = SchemaRepository(
+            Path(self.dba.filename).with_suffix(".schemas"))
         self.codeRegistry = CodeRegistry(self.dba)
+        self.codeRegistry.addContextService(activeModelAccess)
+        self.codeRegistry.addService(bus)
+        self.buildCache = None
+        self.force = False
 
     def loadModules(self, tags=None):
         '''Load all xform module code.'''
         self.moduleDefs = self.warehouse.getModuleDefinitions(self.dba, tags)
+        handlers = self.warehouse.getEventHandlers()
         verbose = self.dba.isVerbose()
         self.dba.table('fashion.core.module.definition').purge()
         for modName, modDef in self.moduleDefs.items():
@@ -50,39 +65,100 @@ class Runway(object):
                 if mod.loadModuleCode():
                     self.modules[modName] = mod
                     self.dba.table('fashion.core.module.definition').insert(modDef)
+                    self.subscribeHandlers(mod, handlers.get(modName, []))
+                    bus.emit(MODULE_LOADED, mod)
                 else:
                     # TODO: file not found, etc.
                     pass
 
+    def subscribeHandlers(self, mod, handlers):
+        '''Subscribe the event handlers a segment names in a loaded module.'''
+        for h in handlers:
+            handler = getattr(mod.mod, h.function, None)
+            if h.event == SEGMENT_LOADED:
+                logging.error("can't subscribe {0} in module {1} to {2}".format(
+                    h.function, h.moduleName, h.event))
+            elif handler is None:
+                logging.error("no event handler {0} in module {1}".format(
+                    h.function, h.moduleName))
+            else:
+                bus.subscribe(h.event, handler, (h.event, h.moduleName, h.function))
+
     def loadSchemas(self):
-        '''Load all schemas from the warehouse.'''
+        '''
+        Load all schemas from the warehouse, so models are validated against
+        them when inserted. A model which fails validation is logged and
+        not inserted. Builds don't validate unless this is called.
+        '''
         self.schemaDefs = self.warehouse.getSchemaDefintions()
         for _, schDef in self.schemaDefs.items():
             # TODO: insert schema definition record into database
             with cd(schDef.absDirname):
                 self.schemaRepo.addFromDescription(schDef)
+            if schDef.get("storage") == "columnar":
+                self.setColumnar(schDef.kind, self.schemaRepo.schemaByKind[schDef.kind])
+
+    def loadStorage(self):
+        '''
+        Switch the kinds whose schema description asks for columnar storage
+        to it, reading only their schemas, without validating any kind.
+        '''
+        for _, schDef in self.warehouse.getSchemaDefintions().items():
+            if schDef.get("storage") == "columnar":
+                with cd(schDef.absDirname):
+                    schema = Schema(schDef)
+                self.setColumnar(schDef.kind, schema)
 
-    def setMdb(self, mda):
-        self.codeRegistry.removeService(mda.name, mda.version)
-        self.codeRegistry.addService(mda)
+    def setColumnar(self, kind, schema):
+        '''
+        Switch a kind with a flat scalar schema to columnar storage.
+
+        :param string kind: the model kind.
+        :param Schema schema: the kind's schema.
+        '''
+        try:
+            spec = columnSpec(schema.jsonschema)
+        except (OSError, ValueError):
+            logging.error("Can't read schema for kind: {0}".format(kind))
+            return
+        if spec is None:
+            logging.error(
+                "schema can't be stored in columns: {0}".format(kind))
+            return
+        self.dba.setColumnar(kind, spec)
 
     def initModules(self, tags=None):
         '''Initialize modules from their configs.'''
         self.moduleCfgs = self.warehouse.getModuleConfigs(self.dba, self.modules)
         verbose = self.dba.isVerbose()
         for cfg in self.moduleCfgs:
+            # Xform objects are often named for their module, so give the
+            # init context its own name, or its reset would delete the
+            # records of the xform object from the last build.
+            initCtx = copy.copy(cfg)
+            initCtx.name = cfg.moduleName + "::init"
             with cd(cfg.absDirname):
-                with ModelAccess(self.dba, self.schemaRepo, cfg) as mdb:
-                    self.setMdb(mdb)
+                with ModelAccess(self.dba, self.schemaRepo, initCtx):
                     mod = self.modules[cfg.moduleName]
                     if verbose:
                         print("Initializing module {0}".format(
                             mod.properties.moduleName))
                     self.codeRegistry.setObjectConfig(cfg)
+                    bus.emit(INIT_STARTED, cfg)
                     mod.init(cfg, self.codeRegistry, tags)
+                    bus.emit(INIT_FINISHED, cfg)
+
+    def plan(self, targets=None, cwd=None):
+        '''
+        Construction the xform execution plan.
 
-    def plan(self):
-        '''Construction the xform execution plan.'''
+        :param list(string) targets: optional generated filenames or model
+        kinds; if given, only the xforms which contribute to them are planned.
+        :param Path cwd: directory relative filename targets are relative to,
+        default the current directory.
+        :returns: False if a target is unknown.
+        :rtype: boolean
+        '''
         self.objects = self.codeRegistry.xformObjectsByName
         self.xfOutputs = {xf.name: set(xf.outputKinds)
                           for xf in self.objects.values()}
@@ -115,6 +191,7 @@ class Runway(object):
         availInp = self.leafInputs.copy()
         availXforms = self.xfNames.copy()
         self.execList = []
+        self.waves = []
         while(availXforms):
             readyXforms = set()
             for xfName in availXforms:
@@ -122,7 +199,10 @@ class Runway(object):
                     readyXforms.add(xfName)
             if readyXforms:
                 availXforms = availXforms - readyXforms
-                self.execList.extend(readyXforms)
+                # Sorted, so records are inserted in the same order every
+                # build, which keeps build cache fingerprints stable.
+                self.execList.extend(sorted(readyXforms))
+                self.waves.append(readyXforms)
                 # readyOutputs might be ready, or only partly complete
                 readyOutputs = set()
                 for xfName in readyXforms:
@@ -140,32 +220,226 @@ class Runway(object):
         else:
             self.valid = True
 
+        found = True
+        if targets:
+            found = self.focus(targets, cwd)
+
         for idx, xfName in enumerate(self.execList):
             logging.debug("{0}:{1}".format(idx, xfName))
+        bus.emit(PLAN_READY, self)
+        return found
+
+    def executeOne(self, xfName, verbose=False, tags=None):
+        '''Execute one prepared xform object.'''
+        record = self.records.get(xfName)
+        if record is None:
+            return
+        cache = None if self.force else self.buildCache
+        bus.emit(XFORM_STARTED, record)
+        error = None
+        try:
+            key = None
+            if cache is not None:
+                key = cache.fingerprint(self.dba, record, self.codeRegistry)
+            if key is not None and cache.restore(self.dba, self.schemaRepo, record, key):
+                if verbose:
+                    print("Restored {0} from build cache".format(xfName))
+            else:
+                access = ModelAccess if key is None else RecordingModelAccess
+                with access(self.dba, self.schemaRepo, record.xform) as mdb:
+                    if verbose:
+                        print("Executing {0}".format(xfName))
+                    token = activeXform.set(record)
+                    try:
+                        record.xform.execute(self.codeRegistry, verbose, tags)
+                    finally:
+                        activeXform.reset(token)
+                if key is not None:
+                    cache.put(self.dba, key, mdb)
+        except:
+            error = sys.exc_info()[1]
+            logging.error("aborting, xform error: {0}".format(xfName))
+            traceback.print_exc()
+        self.dba.sync()
+        bus.emit(XFORM_FINISHED, record, error)
+
+    def prepare(self):
+        '''
+        Make the execution record of each planned xform object, and read the
+        build's arguments, so executing needs no other database queries.
+        '''
+        self.force = (self.dba.getArgs() or {}).get("force", False)
+        self.records = {}
+        for xfName in self.execList:
+            try:
+                self.records[xfName] = self.makeRecord(xfName)
+            except (AttributeError, KeyError):
+                logging.error("xform not configured: {0}".format(xfName))
+
+    def makeRecord(self, xfName):
+        '''
+        Resolve everything needed to execute an xform object.
+
+        :param string xfName: the xform object name.
+        :returns: the execution record.
+        :rtype: fashion.xforms.XformRecord
+        '''
+        xfo = self.objects[xfName]
+        cfg = self.codeRegistry.getObjectConfig(xfName)
+        defn = self.moduleDefs[cfg.moduleName]
+        cfgPath = [(Path(cfg.absDirname) / p).as_posix() for p in cfg.templatePath]
+        defPath = [(Path(defn.absDirname) / p).as_posix() for p in defn.templatePath]
+        loader = ChoiceLoader([FileSystemLoader(cfgPath), FileSystemLoader(defPath)])
+        return XformRecord(xfName, xfo, cfg, defn, tuple(cfgPath + defPath), loader,
+                           frozenset(xfo.inputKinds), frozenset(xfo.outputKinds))
+
+    def findProducers(self, target, cwd=None):
+        '''
+        Find the xforms which directly produce a target.
+
+        :param string target: a model kind, or a filename generated by a
+        previous build (relative to cwd, or absolute).
+        :param Path cwd: directory of relative filenames, default the
+        current directory.
+        :returns: set of xform names, empty if target is unknown.
+        :rtype: set(string)
+        '''
+        if target in self.xfByOutput:
+            return set(self.xfByOutput[target])
+        path = Path(cwd or Path.cwd()) / target
+        # Output files are recorded by absolute, not resolved, filename.
+        names = [path.absolute().as_posix(), path.resolve().as_posix()]
+        Output = Query()
+        outputs = self.dba.table('fashion.core.output.file').search(
+            Output.filename.one_of(names))
+        return {o["contextName"] for o in outputs
+                if o["contextName"] in self.xfNames}
+
+    def upstream(self, xfNames):
+        '''
+        Find all xforms which the named xforms depend on, including themselves.
+
+        :param set(string) xfNames: the xforms to start from.
+        :returns: the upstream xform names.
+        :rtype: set(string)
+        '''
+        found = set()
+        pending = list(xfNames)
+        while pending:
+            xfName = pending.pop()
+            if xfName in found:
+                continue
+            found.add(xfName)
+            for inKind in self.xfInputs[xfName]:
+                pending.extend(self.xfByOutput.get(inKind, ()))
+        return found
+
+    def focus(self, targets, cwd=None):
+        '''
+        Reduce the planned execList to the xforms contributing to targets.
+        Records produced by all other xforms are left in the database.
+
+        :param list(string) targets: generated filenames or model kinds.
+        :param Path cwd: directory relative filename targets are relative to,
+        default the current directory.
+        :returns: True if all targets were found.
+        :rtype: boolean
+        '''
+        found = True
+        producers = set()
+        for target in targets:
+            xfNames = self.findProducers(target, cwd)
+            if not xfNames:
+                logging.error("no xform produces target: {0}".format(target))
+                found = False
+            producers.update(xfNames)
+        needed = self.upstream(producers)
+        self.execList = [xfName for xfName in self.execList
+                         if xfName in needed]
+        self.waves = [wave & needed for wave in self.waves if wave & needed]
+        return found
+
+    def waveInputKinds(self, index):
+        '''
+        Get the model kinds the xforms of one execution wave may read.
+        The xforms in a wave don't depend on each other, so could run in
+        parallel from a snapshot of these kinds, see fashion.snapshot.
+
+        :param int index: the wave index in self.waves.
+        :returns: the input kinds, including the fashion.prime singletons.
+        :rtype: set(string)
+        '''
+        kinds = {k for k in self.dba.kinds()
+                 if k.startswith("fashion.prime")}
+        kinds -= {'fashion.prime.context', 'fashion.prime.trace'}
+        for xfName in self.waves[index]:
+            kinds.update(self.xfInputs[xfName])
+        return kinds
+
+    def liveContextNames(self):
+        '''
+        Get the names of contexts used by the current plan: every xform
+        object, and the init context of every module config.
+        '''
+        names = set(self.xfNames)
+        names.update(cfg.moduleName + "::init" for cfg in self.moduleCfgs)
+        return names
+
+    def collectGarbage(self, dryRun=False):
+        '''
+        Remove database records no current xform owns: records inserted by
+        contexts which aren't in the plan (crashed, renamed or removed xforms),
+        those contexts and their traces, and records in context managed kinds
+        which no live context lists. Then compact the database files.
+
+        :param boolean dryRun: only report what would be removed.
+        :returns: report with removed contexts, records removed by kind, and
+        database file sizes before and after.
+        :rtype: Munch
+        '''
+        live = self.liveContextNames()
+        ctxTable = self.dba.table('fashion.prime.context')
+        contexts = ctxTable.all()
+        deadCtxs = [c for c in contexts if c["name"] not in live]
+        liveIds = {}
+        managed = set(self.allOutputs)
+        for ctx in contexts:
+            managed.update(ctx["insert"].keys())
+            if ctx["name"] in live:
+                for kind, ids in ctx["insert"].items():
+                    liveIds.setdefault(kind, set()).update(ids)
+        report = Munch(contexts=[c["name"] for c in deadCtxs], records={},
+                       sizeBefore=self.dba.fileSize(), sizeAfter=None)
+        kinds = self.dba.kinds()
+        for kind in sorted(managed & kinds):
+            if self.dba.isColumnar(kind):
+                ids = self.dba.table(kind).docIds
+            else:
+                ids = [int(id) for id in self.dba.rawTable(kind)]
+            keep = liveIds.get(kind, set())
+            orphans = [id for id in ids if id not in keep]
+            if orphans:
+                report.records[kind] = len(orphans)
+                if not dryRun:
+                    self.dba.table(kind).remove(doc_ids=orphans)
+        if dryRun:
+            return report
+        if deadCtxs:
+            ctxTable.remove(doc_ids=[c.doc_id for c in deadCtxs])
+        self.dba.compact()
+        indexProvenance(self.dba)
+        report.sizeAfter = self.dba.fileSize()
+        return report
 
     def execute(self, tags=None):
         '''Execute all the xforms planned in self.execList.'''
         verbose = self.dba.isVerbose()
-        for xfName in self.execList:
-            xfo = self.objects[xfName]
-            try:
-                with ModelAccess(self.dba, self.schemaRepo, xfo) as mdb:
-                    self.setMdb(mdb)
-                    if verbose:
-                        print("Executing {0}".format(xfo.name))
-                    cfg = self.codeRegistry.getObjectConfig(xfo.name)
-                    Definition = Query()
-                    defs = self.dba.table('fashion.prime.module.definition').search(Definition.moduleName == cfg.moduleName)
-                    assert len(defs) == 1
-                    defn = munchify(defs[0])
-                    tplSvc = self.codeRegistry.getService('fashion.core.template')
-                    tplSvc.setDefinitionPath(
-                        defn.absDirname,
-                        defn.templatePath)
-                    tplSvc.setConfigurationPath(
-                        cfg.absDirname,
-                        cfg.templatePath)
-                    xfo.execute(self.codeRegistry, verbose, tags)
-            except:
-                logging.error("aborting, xform error: {0}".format(xfName))
-                traceback.print_exc()
+        self.prepare()
+        for wave in self.waves:
+            if self.buildCache is not None:
+                self.buildCache.newWave()
+            for xfName in sorted(wave):
+                self.executeOne(xfName, verbose, tags)
+        indexProvenance(self.dba)
+        if verbose and self.buildCache is not None:
+            print(self.buildCache.stats())
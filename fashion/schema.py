@@ -3,44 +3,430 @@ Schema checking
 ===================================
 Validates JSON objects.
 
+Validating with the generic jsonschema interpreter is slow for hot kinds. A
+kind may opt in to a compiled validator in its segment schema description:
+
+"schema": [
+    {"kind":"local.register", "filename":"./schema/register.json",
+     "compile":true}
+]
+
+The schema compiler generates Python code for that exact schema, covering the
+common keywords: type, enum, properties, required, additionalProperties,
+items, pattern, string lengths, array sizes and number limits. A schema using
+any other keyword (e.g. $ref or anyOf), or another draft than 4, is validated
+with jsonschema instead, using the validator for the schema's $schema.
+Compiled validators raise the same jsonschema ValidationError on failure.
+
+Schemas are registered in a SchemaRepository without reading them. A schema
+file is read, checked against the JSON schema meta-schema and compiled only
+the first time an object of its kind is validated. The checked and compiled
+form can be cached across runs in a directory, keyed by the hash of the schema
+file contents, so an unchanged schema is never checked or compiled again.
+
 Created on 2018-12-26 Copyright (c) 2018 Bradford Dillman
 '''
 
 import copy
+import hashlib
 import json
 import logging
+import os
+import re
+
+from numbers import Number
+from pathlib import Path
+
+from jsonschema import Draft4Validator, SchemaError, ValidationError
+from jsonschema.validators import validator_for
+
+from fashion import codec
+
+# Changes when the cached form of schemas changes.
+CACHE_VERSION = b"fashion.schema.1\n"
+
+# Keywords which don't affect validation.
+annotations = {"$schema", "id", "title", "description", "default",
+               "definitions", "examples"}
 
-from jsonschema import validate, SchemaError
+# Test expressions for each JSON schema type, with {0} for the value.
+typeTests = {
+    "object": "isinstance({0}, dict)",
+    "array": "isinstance({0}, list)",
+    "string": "isinstance({0}, str)",
+    "boolean": "isinstance({0}, bool)",
+    "null": "{0} is None",
+    "integer": "(isinstance({0}, int) and not isinstance({0}, bool))",
+    "number": "(isinstance({0}, Number) and not isinstance({0}, bool))"
+}
+
+
+def validatorClass(schema):
+    '''
+    Get the jsonschema validator class for a schema's $schema, draft 4 if it
+    has none or an unknown one, like genson's generic $schema.
+    '''
+    return validator_for(schema, default=Draft4Validator)
+
+
+class Unsupported(Exception):
+    '''Raised by SchemaCompiler for schemas it can't compile.'''
+    pass
+
+
+class SchemaCompiler(object):
+    '''Generates a Python validator function for a JSON schema.'''
+
+    def __init__(self):
+        self.consts = {}
+        self.count = 0
+
+    def const(self, value, wrapper="{0}"):
+        '''
+        Get a name for a constant used by the generated code. Constants are
+        defined in the generated source, so it can be cached and reloaded.
+
+        :param value: a JSON value.
+        :param string wrapper: expression converting the value, e.g. re.compile({0}).
+        '''
+        name = "c{0}".format(len(self.consts))
+        self.consts[name] = wrapper.format(
+            "loads({0})".format(repr(json.dumps(value))))
+        return name
+
+    def var(self):
+        '''Get a new local variable name.'''
+        self.count += 1
+        return "v{0}".format(self.count)
+
+    def fail(self, msg, *values):
+        '''Get a line raising a ValidationError.'''
+        return "raise ValidationError({0} % ({1},))".format(
+            repr(msg), ", ".join(values))
+
+    def node(self, schema, v):
+        '''
+        Generate the checks of value v against a schema.
+
+        :returns: list of (depth, line) tuples.
+        '''
+        if not isinstance(schema, dict):
+            raise Unsupported("schema is not an object")
+        for key in schema:
+            if key not in annotations and key not in self.keywords:
+                raise Unsupported(key)
+        lines = []
+        if "type" in schema:
+            types = schema["type"]
+            if isinstance(types, str):
+                types = [types]
+            if not all(t in typeTests for t in types):
+                raise Unsupported("type")
+            test = " or ".join(typeTests[t].format(v) for t in types)
+            lines.append((0, "if not ({0}):".format(test)))
+            lines.append((1, self.fail("%r is not of type " + ", ".join(
+                repr(t) for t in types), v)))
+        if "enum" in schema:
+            lines.append((0, "if {0} not in {1}:".format(
+                v, self.const(schema["enum"]))))
+            lines.append((1, self.fail("%r is not one of %r", v,
+                                       self.const(schema["enum"]))))
+        # Keywords only apply to values of their type. If the type is already
+        # checked, the keywords don't need another test.
+        known = None
+        if isinstance(schema.get("type"), str):
+            known = "number" if schema["type"] == "integer" else schema["type"]
+        for t, node in [("number", self.numberNode), ("string", self.stringNode),
+                        ("object", self.objectNode), ("array", self.arrayNode)]:
+            subLines = node(schema, v)
+            if t == known:
+                lines += subLines
+            elif subLines:
+                lines.append((0, "if {0}:".format(typeTests[t].format(v))))
+                lines += [(d + 1, l) for d, l in subLines]
+        return lines
+
+    def numberNode(self, schema, v):
+        lines = []
+        for key, exKey, op, exOp, cmp in [
+                ("minimum", "exclusiveMinimum", "<", "<=", "less than"),
+                ("maximum", "exclusiveMaximum", ">", ">=", "greater than")]:
+            if key in schema:
+                if schema.get(exKey, False):
+                    op, cmp = exOp, cmp + " or equal to"
+                limit = self.const(schema[key])
+                lines.append((0, "if {0} {1} {2}:".format(v, op, limit)))
+                lines.append((1, self.fail(
+                    "%r is " + cmp + " the " + key + " of %r", v, limit)))
+        return lines
+
+    def stringNode(self, schema, v):
+        lines = []
+        if "minLength" in schema:
+            lines.append((0, "if len({0}) < {1}:".format(v, self.const(schema["minLength"]))))
+            lines.append((1, self.fail("%r is too short", v)))
+        if "maxLength" in schema:
+            lines.append((0, "if len({0}) > {1}:".format(v, self.const(schema["maxLength"]))))
+            lines.append((1, self.fail("%r is too long", v)))
+        if "pattern" in schema:
+            regex = self.const(schema["pattern"], "re.compile({0})")
+            lines.append((0, "if not {0}.search({1}):".format(regex, v)))
+            lines.append((1, self.fail("%r does not match %r", v, regex + ".pattern")))
+        return lines
+
+    def objectNode(self, schema, v):
+        lines = []
+        for prop in schema.get("required", []):
+            lines.append((0, "if {0} not in {1}:".format(repr(prop), v)))
+            lines.append((1, "raise ValidationError({0})".format(
+                repr("%r is a required property" % (prop,)))))
+        if "minProperties" in schema:
+            lines.append((0, "if len({0}) < {1}:".format(v, self.const(schema["minProperties"]))))
+            lines.append((1, self.fail("%r does not have enough properties", v)))
+        if "maxProperties" in schema:
+            lines.append((0, "if len({0}) > {1}:".format(v, self.const(schema["maxProperties"]))))
+            lines.append((1, self.fail("%r has too many properties", v)))
+        properties = schema.get("properties", {})
+        for prop, sub in properties.items():
+            pv = self.var()
+            subLines = self.node(sub, pv)
+            if subLines:
+                lines.append((0, "if {0} in {1}:".format(repr(prop), v)))
+                lines.append((1, "{0} = {1}[{2}]".format(pv, v, repr(prop))))
+                lines += [(d + 1, l) for d, l in subLines]
+        aP = schema.get("additionalProperties", True)
+        if aP is False or isinstance(aP, dict):
+            known = self.const(list(properties), "frozenset({0})")
+            k, pv = self.var(), self.var()
+            if aP is False:
+                subLines = [(0, self.fail(
+                    "Additional properties are not allowed (%r was unexpected)", k))]
+            else:
+                subLines = self.node(aP, pv)
+            if subLines:
+                lines.append((0, "for {0}, {1} in {2}.items():".format(k, pv, v)))
+                lines.append((1, "if {0} not in {1}:".format(k, known)))
+                lines += [(d + 2, l) for d, l in subLines]
+        return lines
+
+    def arrayNode(self, schema, v):
+        lines = []
+        if "minItems" in schema:
+            lines.append((0, "if len({0}) < {1}:".format(v, self.const(schema["minItems"]))))
+            lines.append((1, self.fail("%r is too short", v)))
+        if "maxItems" in schema:
+            lines.append((0, "if len({0}) > {1}:".format(v, self.const(schema["maxItems"]))))
+            lines.append((1, self.fail("%r is too long", v)))
+        if "items" in schema:
+            if not isinstance(schema["items"], dict):
+                raise Unsupported("items array")
+            iv = self.var()
+            subLines = self.node(schema["items"], iv)
+            if subLines:
+                lines.append((0, "for {0} in {1}:".format(iv, v)))
+                lines += [(d + 1, l) for d, l in subLines]
+        return lines
+
+    keywords = {"type", "enum", "minimum", "maximum", "exclusiveMinimum",
+                "exclusiveMaximum", "minLength", "maxLength", "pattern",
+                "required", "minProperties", "maxProperties", "properties",
+                "additionalProperties", "minItems", "maxItems", "items"}
+
+    def compile(self, schema):
+        '''
+        Compile a JSON schema into Python source for a validate function.
+
+        :param JSONobject schema: a valid draft 4 JSON schema.
+        :returns: source defining validate(obj), which raises ValidationError
+        if obj is invalid, or None if the schema uses keywords the compiler
+        doesn't support.
+        :rtype: string
+        '''
+        # Only draft 4 schemas are compiled.
+        if validatorClass(schema) is not Draft4Validator:
+            return None
+        try:
+            lines = self.node(schema, "obj")
+        except Unsupported as e:
+            logging.info("schema not compiled, unsupported: {0}".format(e))
+            return None
+        return "".join("{0} = {1}\n".format(k, v) for k, v in self.consts.items()) + \
+            "def validate(obj):\n" + \
+            "".join("    " * (d + 1) + l + "\n" for d, l in lines) + \
+            "    return True\n"
+
+
+def loadValidator(source):
+    '''
+    Make a validator function from source generated by SchemaCompiler.
+
+    :param string source: the generated source.
+    :returns: the validator function, with the source as its source attribute.
+    '''
+    namespace = {
+        "ValidationError": ValidationError,
+        "Number": Number,
+        "loads": json.loads,
+        "re": re
+    }
+    exec(compile(source, "<schema>", "exec"), namespace)
+    func = namespace["validate"]
+    func.source = source
+    return func
+
+
+def compileSchema(schema):
+    '''
+    Compile a JSON schema into a Python validator function.
+
+    :param JSONobject schema: a valid draft 4 JSON schema.
+    :returns: the validator function, or None if it can't be compiled.
+    '''
+    source = SchemaCompiler().compile(schema)
+    if source is None:
+        return None
+    return loadValidator(source)
+
+
+class SchemaCache(object):
+    '''
+    Checked and compiled schemas from previous runs, by schema file hash.
+    '''
+
+    def __init__(self, dirname):
+        '''
+        Constructor.
+
+        :param Path dirname: the cache directory, created when first written.
+        '''
+        self.dirname = Path(dirname)
+
+    @staticmethod
+    def key(data):
+        '''Get the cache key of a schema file's contents.'''
+        return hashlib.sha256(CACHE_VERSION + data).hexdigest()
+
+    def get(self, key):
+        '''Get a cache entry, or None.'''
+        path = self.dirname / (key + ".json")
+        if not path.exists():
+            return None
+        try:
+            with path.open(mode="r") as fd:
+                return codec.load(fd)
+        except ValueError:
+            return None
+
+    def put(self, key, entry):
+        '''Store a cache entry, atomically.'''
+        self.dirname.mkdir(parents=True, exist_ok=True)
+        path = self.dirname / (key + ".json")
+        tmpPath = self.dirname / (key + ".tmp")
+        with tmpPath.open(mode="w") as fd:
+            codec.dump(entry, fd)
+        os.replace(str(tmpPath), str(path))
 
 
 class Schema(object):
-    '''Validates JSON objects against JSON schema.'''
+    '''
+    Validates JSON objects against JSON schema. The schema file is read the
+    first time the schema is needed.
+    '''
 
-    def __init__(self, schemaConfig):
-        '''Constructor.'''
+    def __init__(self, schemaConfig, cache=None):
+        '''
+        Constructor.
+
+        :param schemaConfig: the schema description, with kind and filename
+        relative to the cwd.
+        :param SchemaCache cache: optional cache of checked and compiled schemas.
+        '''
         self.config = copy.copy(schemaConfig)
+        self.filename = Path(str(schemaConfig.filename)).absolute()
+        self.cache = cache
+        self.cacheKey = None
+        self.cached = None
+        self.validator = None
+        self._jsonschema = None
 
     @staticmethod
     def load(schemaConfig):
         '''Load the JSON schema from a file.'''
-        with open(str(schemaConfig.filename), 'r') as fd:
-            s = Schema(schemaConfig)
-            s.jsonschema = json.loads(fd.read())
+        s = Schema(schemaConfig)
+        s.read()
+        return s
+
+    @property
+    def jsonschema(self):
+        if self._jsonschema is None:
+            self.read()
+        return self._jsonschema
+
+    @jsonschema.setter
+    def jsonschema(self, value):
+        self._jsonschema = value
+
+    def read(self):
+        '''Read the schema file, or its cache entry.'''
+        data = self.filename.read_bytes()
+        if self.cache is not None:
+            self.cacheKey = SchemaCache.key(data)
+            self.cached = self.cache.get(self.cacheKey)
+            if self.cached is not None:
+                self._jsonschema = self.cached["schema"]
+                return
+        self._jsonschema = codec.loads(data)
+
+    def getValidator(self):
+        '''
+        Get the validator function for this schema, made the first time it's
+        needed: compiled if the schema config asks for it, else jsonschema.
+        A cached schema has already been checked, and maybe compiled.
+
+        :raises: jsonschema.SchemaError for a bad schema.
+        '''
+        if self.validator is not None:
+            return self.validator
+        schema = self.jsonschema
+        compileIt = self.config.get("compile", False)
+        entry = self.cached
+        if entry is None or (compileIt and not entry["compiled"]):
+            if entry is None:
+                validatorClass(schema).check_schema(schema)
+            source = SchemaCompiler().compile(schema) if compileIt else None
+            entry = {"schema": schema, "compiled": compileIt, "source": source}
+            if self.cache is not None:
+                self.cache.put(self.cacheKey, entry)
+            self.cached = entry
+        if compileIt and entry["source"] is not None:
+            self.validator = loadValidator(entry["source"])
+        else:
+            self.validator = validatorClass(schema)(schema).validate
+        return self.validator
 
     def validate(self, obj):
         '''Validate a JSON object against this schema.'''
         # raises SchemaError for bad schema
         # raises ValidationError on failure
-        validate(obj, self.jsonschema)
+        self.getValidator()(obj)
         return True
 
 
 class SchemaRepository(object):
-    '''Registry of Schema objects.'''
+    '''
+    Registry of Schema objects. Schemas are registered cheaply, and only read,
+    checked and compiled the first time they are used.
+    '''
 
-    def __init__(self):
-        '''Constructor.'''
+    def __init__(self, cacheDir=None):
+        '''
+        Constructor.
+
+        :param Path cacheDir: optional directory to cache checked and
+        compiled schemas in, across runs.
+        '''
         self.schemaByKind = {}
+        self.cache = None if cacheDir is None else SchemaCache(cacheDir)
 
     def validate(self, kind, obj):
         '''
@@ -59,18 +445,25 @@ class SchemaRepository(object):
                 logging.error(
                     "Schema error for kind: {0}".format(kind))
                 self.removeByKind(kind)
+            except (OSError, ValueError):
+                logging.error(
+                    "Can't read schema for kind: {0}".format(kind))
+                self.removeByKind(kind)
 
     def addFromDescription(self, schemaConfig, overwrite=False):
         '''
         Create and add a Schema object from a schema description object.
+        The schema file isn't read until the schema is used.
 
         :param Schema schemaConfig: the configuration to add.
         '''
         if not overwrite and self.exists(schemaConfig.kind):
             return
-        s = Schema.load(schemaConfig)
-        if schemaConfig.kind not in self.schemaByKind:
-            self.schemaByKind[schemaConfig.kind] = s
+        s = Schema(schemaConfig, self.cache)
+        if not s.filename.exists():
+            logging.error("schema file not found: {0}".format(s.filename))
+            return
+        self.schemaByKind[schemaConfig.kind] = s
 
     def removeByKind(self, kind):
         '''
@@ -78,7 +471,7 @@ class SchemaRepository(object):
 
         :param string kind: the model kind to remove.
         '''
-        self.schemaByKind[kind]
+        self.schemaByKind.pop(kind, None)
 
     def exists(self, kind):
         '''
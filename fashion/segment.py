@@ -50,10 +50,18 @@ contain xform code, e.g.
     "tags": [ ]
 }]
 
+eventHandlers: a list of functions in the segment's xform modules to
+subscribe to build events, see fashion.events, e.g.
+
+"eventHandlers": [{
+    "event": "xform.finished",
+    "moduleName": "local.monitor",
+    "function": "onXformFinished"
+}]
+
 Created on 2018-12-16 Copyright (c) 2018 Bradford Dillman
 '''
 
-import json
 import logging
 import os
 import shutil
@@ -64,6 +72,7 @@ from jinja2 import FileSystemLoader, Environment
 from jsonschema import validate
 from munch import munchify
 
+from fashion import codec
 from fashion.util import cd
 
 # JSON schema to validate a segment object/file.
@@ -206,6 +215,46 @@ segmentSchema = {
                         }
                     }
                 },
+                "eventHandlers": {
+                    "$id": "#/properties/eventHandlers",
+                    "type": "array",
+                    "title": "Functions to subscribe to build events",
+                    "items": {
+                        "$id": "#/properties/eventHandlers/items",
+                        "type": "object",
+                        "required": [
+                            "event",
+                            "moduleName",
+                            "function"
+                        ],
+                        "properties": {
+                            "event": {
+                                "$id": "#/properties/eventHandlers/items/properties/event",
+                                "type": "string",
+                                "title": "The event name",
+                                "examples": [
+                                    "xform.finished"
+                                ]
+                            },
+                            "moduleName": {
+                                "$id": "#/properties/eventHandlers/items/properties/moduleName",
+                                "type": "string",
+                                "title": "The xform module with the handler",
+                                "examples": [
+                                    "local.monitor"
+                                ]
+                            },
+                            "function": {
+                                "$id": "#/properties/eventHandlers/items/properties/function",
+                                "type": "string",
+                                "title": "The handler function name",
+                                "examples": [
+                                    "onXformFinished"
+                                ]
+                            }
+                        }
+                    }
+                },
                 "segmentRefs": {
                     "$id": "#/properties/segmentRefs",
                     "type": "array",
@@ -306,7 +355,7 @@ class Segment(object):
         '''
         with filename.open(mode='r') as fd:
             segment = Segment(filename)
-            segment.properties = munchify(json.loads(fd.read()))
+            segment.properties = munchify(codec.load(fd))
             if "templatePath" not in segment.properties:
                 segment.properties.templatePath = []
         segment.validate()
@@ -365,7 +414,7 @@ class Segment(object):
         '''
         self.validate()
         with self.absFilename.open(mode="w") as sf:
-            sf.write(self.properties.toJSON(indent=4))
+            codec.dump(self.properties, sf, indent=4)
 
     def createDirectories(self):
         '''
@@ -493,24 +542,44 @@ class Segment(object):
         shutil.copy(absFn.as_posix(), absDst.as_posix())
         return True
 
-    def createSchema(self, kind, schema):
+    def createSchema(self, kind, schema, examples=None):
         '''
-        Create a JSON schema file for a model kind.
+        Create a JSON schema file for a model kind, replacing any existing
+        schema description for the kind.
 
         :param string kind: model kind for schema.
         :param JSONobject schema: the schema for model kind.
+        :param dictionary examples: high-water doc_id, count and digest of the
+        last of the examples the schema was guessed from, see
+        Warehouse.guessSchema.
         '''
         filename = Path(self.properties.defaultSchemaPath) / \
             Path(kind + ".json")
         with cd(self.absDirname):
             with filename.open(mode="w") as fp:
-                json.dump(schema, fp, indent=4)
-        self.properties.schema.append({
-            "kind": kind,
-            "filename": str(filename)
-        })
+                codec.dump(schema, fp, indent=4)
+        descr = self.findSchema(kind)
+        if descr is None:
+            descr = munchify({"kind": kind})
+            self.properties.schema.append(descr)
+        descr["filename"] = str(filename)
+        descr.pop("lastId", None)
+        if examples is not None:
+            descr["examples"] = examples
         self.save()
 
+    def findSchema(self, kind):
+        '''
+        Find the schema description for a model kind.
+
+        :param string kind: the model kind.
+        :returns: the schema description, or None.
+        '''
+        for descr in self.properties.schema:
+            if descr["kind"] == kind:
+                return descr
+        return None
+
     def validate(self):
         '''
         Validate this Segment object against a schema.
@@ -0,0 +1,274 @@
+'''
+Signature - record-level change detection for generated files
+===================================
+
+Every build re-runs the xforms, but most generated files come out the same as
+last time. A generated file only needs to be rendered again if its template or
+one of the records in its model has changed.
+
+RenderSignatures hashes the content of each record used in a model (once per
+build, however many outputs use it), and combines the record hashes, the rest
+of the model and the template source into a signature for the output. The
+signature of each generated file is kept in the database across builds, in
+the 'fashion.core.generate.signature' table. If a file's new signature matches
+the stored one and the file is still there, it doesn't need rendering.
+
+Records are recognized as the top level ModelView objects in the model, as
+returned by ModelAccess. Doc_ids change from build to build, so records are
+identified by their kind and content hash, not doc_id.
+
+A template's signature covers every template file it uses: the templates it
+{% include %}s, {% extends %} or {% import %}s, found with
+jinja2.meta.find_referenced_templates and resolved through the same loader,
+recursively. Editing a shared macro file changes the signature of exactly the
+outputs which use it. If a template names another template with an
+expression, the set can't be known without rendering, so its outputs are
+always rendered.
+
+The template files used by each output are kept in the
+'fashion.core.generate.template' table, one record per output and template
+with the template name, resolved filename and hash, so outputs can be found
+by the templates they use.
+
+Each signature record also keeps the hash of the file's contents as
+generated, so rendering it again can tell whether the file changed without
+reading it back.
+
+The signature and template tables are written directly, not through
+ModelAccess, so they aren't reset with the context which generated the files.
+
+Created on 2019-01-22 Copyright (c) 2019 Bradford Dillman
+'''
+
+import hashlib
+
+from collections.abc import Mapping, Sequence
+from pathlib import Path
+
+from jinja2 import meta
+
+from fashion import codec
+from fashion.modelView import ModelView
+
+signatureKind = 'fashion.core.generate.signature'
+templateKind = 'fashion.core.generate.template'
+
+
+def digest(data):
+    '''Get the hex SHA-256 digest of a str or bytes.'''
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+class RenderSignatures(object):
+    '''Signatures of generated files, kept across builds.'''
+
+    def __init__(self, dba):
+        '''
+        Constructor.
+
+        :param DatabaseAccess dba: the database to keep signatures in.
+        '''
+        self.dba = dba
+        self.recordHashes = {}
+        self.stored = None
+        self.templateSets = {}
+        self.templateRefs = {}
+        self.templateIds = None
+
+    def recordHash(self, view):
+        '''Get the content hash of a record, computed once per build.'''
+        key = (view._kind, view._doc_id)
+        h = self.recordHashes.get(key)
+        if h is None:
+            h = digest(codec.dumps(view, sort_keys=True))
+            self.recordHashes[key] = h
+        return h
+
+    def reduce(self, value, inputs):
+        '''
+        Replace records in a model with their hashes, collecting the
+        (kind, hash) of each record in inputs.
+        '''
+        if isinstance(value, ModelView) and value._doc_id is not None:
+            h = self.recordHash(value)
+            inputs.append([value._kind, h])
+            return ["$record", value._kind, h]
+        if isinstance(value, Mapping):
+            return {str(k): self.reduce(v, inputs) for k, v in value.items()}
+        if isinstance(value, Sequence) and not isinstance(value, (str, bytes)):
+            return [self.reduce(v, inputs) for v in value]
+        return value
+
+    def templateRef(self, env, name):
+        '''
+        Resolve one template, computed once per build and loader.
+
+        :returns: [name, filename, hash] and the names of the templates it
+        references, with None for a name which isn't a constant.
+        '''
+        key = (id(env.loader), name)
+        entry = self.templateRefs.get(key)
+        if entry is None:
+            source, filename, _ = env.loader.get_source(env, name)
+            refs = list(meta.find_referenced_templates(env.parse(source)))
+            filename = Path(filename).as_posix() if filename else None
+            entry = (env.loader, [name, filename, digest(source)], refs)
+            self.templateRefs[key] = entry
+        return entry[1], entry[2]
+
+    def templateSet(self, env, name):
+        '''
+        Resolve a template and all the templates it includes, extends or
+        imports, directly or indirectly.
+
+        :param jinja2.Environment env: the environment with the loader to use.
+        :param string name: the template name.
+        :returns: a key for the signature of the set, and a sorted list of
+        [name, filename, hash] for each template, or (None, None) if the set
+        can't be found without rendering.
+        :raises TemplateNotFound: if a referenced template is missing.
+        '''
+        key = (id(env.loader), name)
+        entry = self.templateSets.get(key)
+        if entry is None:
+            found = {}
+            pending = [name]
+            dynamic = False
+            while pending and not dynamic:
+                n = pending.pop()
+                if n not in found:
+                    found[n], refs = self.templateRef(env, n)
+                    dynamic = None in refs
+                    pending.extend(refs)
+            if dynamic:
+                entry = (env.loader, None, None)
+            else:
+                templates = sorted(found.values())
+                entry = (env.loader, digest(codec.dumps(templates)), templates)
+            self.templateSets[key] = entry
+        return entry[1], entry[2]
+
+    def signature(self, model, templateKey):
+        '''
+        Compute the signature of an output.
+
+        :param model: the model to render, possibly containing ModelViews.
+        :param string templateKey: the template source, or the key of its
+        template set from templateSet(); None if it's unknown.
+        :returns: the signature and list of input (kind, hash), or (None, [])
+        if the model can't be hashed.
+        '''
+        if templateKey is None:
+            return None, []
+        inputs = []
+        try:
+            reduced = self.reduce(model, inputs)
+            sig = digest(codec.dumps([digest(templateKey), reduced],
+                                     sort_keys=True))
+        except TypeError:
+            return None, []
+        return sig, inputs
+
+    def load(self):
+        '''Load the stored signatures, by filename.'''
+        if self.stored is None:
+            self.stored = {doc["filename"]: (int(id), doc) for id, doc
+                           in self.dba.rawTable(signatureKind).items()}
+        return self.stored
+
+    def isCurrent(self, targetFile, sig):
+        '''
+        Check if a generated file is up to date with a signature.
+
+        :param Path targetFile: the generated file.
+        :param string sig: the new signature.
+        :rtype: boolean
+        '''
+        if sig is None or not targetFile.exists():
+            return False
+        entry = self.load().get(targetFile.absolute().as_posix())
+        return entry is not None and entry[1]["signature"] == sig
+
+    def store(self, targetFile, sig, inputs, templates=None, contentHash=None):
+        '''
+        Store the signature of a generated file, and the templates used.
+
+        :param Path targetFile: the generated file.
+        :param string sig: the signature, None to forget the file.
+        :param inputs: list of input (kind, hash) from signature().
+        :param templates: list of [name, filename, hash] from templateSet().
+        :param string contentHash: the hex SHA-256 of the file as generated,
+        if known.
+        '''
+        fn = targetFile.absolute().as_posix()
+        table = self.dba.table(signatureKind)
+        entry = self.load().pop(fn, None)
+        if entry is not None:
+            table.remove(doc_ids=[entry[0]])
+        if sig is not None:
+            doc = {"filename": fn, "signature": sig, "inputs": inputs}
+            if contentHash is not None:
+                doc["hash"] = contentHash
+            self.stored[fn] = (table.insert(doc), doc)
+        self.storeTemplates(fn, templates or [])
+
+    def contentHash(self, targetFile):
+        '''
+        Get the hash of a generated file's contents as last stored, or None.
+
+        :param Path targetFile: the generated file.
+        :rtype: string
+        '''
+        entry = self.load().get(targetFile.absolute().as_posix())
+        return None if entry is None else entry[1].get("hash")
+
+    def export(self, filenames):
+        '''
+        Get the stored signatures and templates of some generated files, to
+        store() in another database.
+
+        :param filenames: absolute posix filenames of generated files.
+        :returns: list of [filename, signature, inputs, templates], for the
+        files which have a signature.
+        '''
+        stored = self.load()
+        templates = {}
+        for doc in self.dba.rawTable(templateKind).values():
+            templates.setdefault(doc["output"], []).append(
+                [doc["template"], doc["filename"], doc["hash"]])
+        return [[fn, stored[fn][1]["signature"], stored[fn][1]["inputs"],
+                 sorted(templates.get(fn, []))]
+                for fn in filenames if fn in stored]
+
+    def loadTemplates(self):
+        '''Load the ids of the stored template records, by output filename.'''
+        if self.templateIds is None:
+            self.templateIds = {}
+            for id, doc in self.dba.rawTable(templateKind).items():
+                self.templateIds.setdefault(doc["output"], []).append(int(id))
+        return self.templateIds
+
+    def storeTemplates(self, fn, templates):
+        '''Replace the template records of an output.'''
+        table = self.dba.table(templateKind)
+        ids = self.loadTemplates().pop(fn, None)
+        if ids:
+            table.remove(doc_ids=ids)
+        if templates:
+            self.templateIds[fn] = table.insert_multiple(
+                [{"output": fn, "template": name, "filename": filename, "hash": h}
+                 for name, filename, h in templates])
+
+    def dependents(self, templateFile):
+        '''
+        Find the outputs which used a template file in their last render.
+
+        :param Path templateFile: the template file.
+        :returns: sorted list of output filenames.
+        '''
+        fn = Path(templateFile).absolute().as_posix()
+        return sorted({doc["output"] for doc
+                       in self.dba.rawTable(templateKind).values()
+                       if doc["filename"] == fn})
@@ -0,0 +1,232 @@
+'''
+Snapshot - shared read-only model database for worker processes
+===================================
+
+Xforms running in worker processes need to read the model database. Rather
+than re-parse database.json in every worker, or pickle records across a pool,
+the parent publishes a read-only snapshot of just the kinds the workers need,
+in a binary file which workers memory-map and read without copying.
+
+Snapshot file layout, all integers little endian 64 bit:
+
+header: magic "FASHSNAP", directory offset, directory length
+records: each record encoded as JSON, back to back
+indexes: for each kind, (doc_id, offset, length) triples sorted by doc_id
+directory: JSON object of kind -> [index offset, record count]
+
+A worker opens the snapshot with Snapshot, and uses a SnapshotModelAccess in
+place of a ModelAccess. Reads are served from the snapshot; permissions are
+checked as usual; writes are recorded rather than performed. The recorded
+writes and reads are sent back to the parent, which replays them with
+applyResult into a real ModelAccess for the same context, so the database and
+context bookkeeping end up the same as if the xform ran in the parent.
+
+Inserts in the worker return provisional negative doc_ids, which applyResult
+maps to the real doc_ids in trace records.
+
+Created on 2019-01-20 Copyright (c) 2019 Bradford Dillman
+'''
+
+import bisect
+import logging
+import mmap
+import struct
+
+from array import array
+
+from fashion import codec
+from fashion.modelAccess import ModelAccess, activeModelAccess
+from fashion.modelView import ModelView, plain
+from fashion.schema import SchemaRepository
+
+MAGIC = b"FASHSNAP"
+HEADER = struct.Struct("<8sQQ")
+
+
+def writeSnapshot(dba, path, kinds):
+    '''
+    Write a snapshot of some kinds of a database.
+
+    :param DatabaseAccess dba: the database to publish.
+    :param string path: the snapshot filename.
+    :param kinds: the model kinds to include.
+    '''
+    directory = {}
+    with open(str(path), mode="wb") as fd:
+        fd.write(HEADER.pack(MAGIC, 0, 0))
+        indexes = {}
+        for kind in sorted(set(kinds) & dba.kinds()):
+            index = array("q")
+            for view in sorted(dba.views(kind), key=lambda v: v._doc_id):
+                data = codec.dumps(view).encode("utf-8")
+                index.extend((view._doc_id, fd.tell(), len(data)))
+                fd.write(data)
+            indexes[kind] = index
+        for kind, index in indexes.items():
+            # Align indexes so they can be cast without copying.
+            fd.write(b"\0" * (-fd.tell() % 8))
+            directory[kind] = [fd.tell(), len(index) // 3]
+            fd.write(index.tobytes())
+        dirData = codec.dumps(directory).encode("utf-8")
+        dirOffset = fd.tell()
+        fd.write(dirData)
+        fd.seek(0)
+        fd.write(HEADER.pack(MAGIC, dirOffset, len(dirData)))
+
+
+class Snapshot(object):
+    '''Read-only, memory-mapped snapshot of some kinds of a database.'''
+
+    def __init__(self, path):
+        '''
+        Open a snapshot file.
+
+        :param string path: the snapshot filename.
+        '''
+        self.path = str(path)
+        with open(self.path, mode="rb") as fd:
+            self.mmap = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        self.buffer = memoryview(self.mmap)
+        magic, dirOffset, dirLength = HEADER.unpack_from(self.buffer)
+        if magic != MAGIC:
+            raise ValueError("not a fashion snapshot: {0}".format(self.path))
+        directory = codec.loads(bytes(self.buffer[dirOffset:dirOffset + dirLength]))
+        self.indexes = {}
+        for kind, (offset, count) in directory.items():
+            self.indexes[kind] = self.buffer[offset:offset + count * 24].cast("q")
+
+    def close(self):
+        '''Close the snapshot file.'''
+        for index in self.indexes.values():
+            index.release()
+        self.indexes = {}
+        self.buffer.release()
+        self.mmap.close()
+
+    def kinds(self):
+        return set(self.indexes)
+
+    def decode(self, offset, length):
+        '''Decode one record.'''
+        data = self.buffer[offset:offset + length]
+        if codec.orjson is None:
+            data = bytes(data)
+        return codec.loads(data)
+
+    def views(self, kind, cond=None):
+        '''
+        Get views of the records of a kind.
+
+        :param string kind: the model kind.
+        :param cond: optional Query the records must match.
+        :rtype: list(ModelView)
+        '''
+        index = self.indexes.get(kind)
+        if index is None:
+            return []
+        views = []
+        for i in range(0, len(index), 3):
+            doc = self.decode(index[i + 1], index[i + 2])
+            if cond is None or cond(doc):
+                views.append(ModelView(doc, index[i], kind))
+        return views
+
+    def view(self, kind, id):
+        '''
+        Get a view of one record, or None.
+
+        :param string kind: the model kind.
+        :param int id: the doc_id.
+        '''
+        index = self.indexes.get(kind)
+        if index is None:
+            return None
+        ids = index[0::3]
+        i = bisect.bisect_left(ids, id)
+        if i == len(ids) or ids[i] != id:
+            return None
+        return ModelView(self.decode(index[3 * i + 1], index[3 * i + 2]), id, kind)
+
+
+class SnapshotModelAccess(ModelAccess):
+    '''
+    ModelAccess for worker processes, reading from a Snapshot and recording
+    writes for the parent to apply.
+    '''
+
+    def __init__(self, snapshot, contextObj):
+        '''
+        Initialize context.
+
+        :param Snapshot snapshot: the snapshot to read.
+        :param object contextObj: the context with name, inputKinds and outputKinds.
+        '''
+        super(SnapshotModelAccess, self).__init__(snapshot, SchemaRepository(), contextObj)
+        self.writes = []
+        self.lastId = 0
+
+    def __enter__(self):
+        self.dba = self.dbToUse
+        self.activeToken = activeModelAccess.set(self)
+        return self
+
+    def __exit__(self, etype, value, traceback):
+        activeModelAccess.reset(self.activeToken)
+        self.dba = None
+
+    def result(self):
+        '''
+        Get the recorded writes and reads, to send to the parent process.
+        '''
+        return {
+            "name": self.context.properties.name,
+            "writes": self.writes,
+            "reads": {k: list(ids) for k, ids in self.context.searchStore.items()}
+        }
+
+    def record(self, op, kind, model, traceInputs):
+        if not self.context.isAllowedOutput(kind):
+            logging.error(
+                "attempt to write unlisted outputKind {0}".format(kind))
+            return None
+        self.lastId -= 1
+        self.writes.append([op, kind, self.lastId, plain(model), traceInputs])
+        return self.lastId
+
+    def insert(self, kind, model, traceInputs=None):
+        return self.record("insert", kind, model, traceInputs)
+
+    def insertMultiple(self, kind, models):
+        return [self.record("insert", kind, m, None) for m in models]
+
+    def setSingleton(self, kind, model, traceInputs=None):
+        return self.record("singleton", kind, model, traceInputs)
+
+
+def applyResult(mdb, result):
+    '''
+    Replay the writes and reads recorded by a SnapshotModelAccess.
+
+    :param ModelAccess mdb: an entered ModelAccess for the same context.
+    :param dictionary result: from SnapshotModelAccess.result().
+    :returns: dictionary of real doc_ids by provisional doc_id.
+    '''
+    ids = {}
+
+    def realId(id):
+        return ids.get(id, id) if isinstance(id, int) and id < 0 else id
+
+    for op, kind, pid, model, traceInputs in result["writes"]:
+        if traceInputs is not None:
+            traceInputs = [[k, realId(i)] for k, i in traceInputs]
+        if kind == 'fashion.prime.trace':
+            model["id"] = realId(model["id"])
+            model["inputs"] = [[k, realId(i)] for k, i in model["inputs"]]
+        if op == "singleton":
+            ids[pid] = mdb.setSingleton(kind, model, traceInputs)
+        else:
+            ids[pid] = mdb.insert(kind, model, traceInputs)
+    for kind, readIds in result["reads"].items():
+        for id in readIds:
+            mdb.context.recordAccess(mdb.context.searchStore, kind, id)
+    return ids
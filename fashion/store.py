@@ -0,0 +1,207 @@
+'''
+Store - a content-addressed segment store shared between portfolios
+===================================
+
+Every portfolio which imports a segment gets its own copy of the segment's
+files. On a CI host with many checkouts that's the same bytes extracted over
+and over. A segment store keeps each distinct file once, named by its SHA-256
+hash, and installs segments into warehouses by linking to the stored files.
+
+<store>/objects/<h[:2]>/<h> - file contents by hash, read-only
+<store>/warehouse/<segname> - the latest added version of each segment,
+    linked from objects, usable as a fallback warehouse
+
+Adding a segment zip hashes every file it contains, whatever its manifest
+says, and only stores files whose hash isn't already in the store. Segment
+names, file names and hashes are checked before anything is written, so an
+archive can't write or link files outside the store and warehouse.
+Installing a segment hardlinks each file into the warehouse, falling back to a
+reflink copy (on file systems which support it) and then to a plain copy when
+the warehouse is on another device. Installed files which already have the
+right hash are left alone.
+
+Stored files are made read-only, since a hardlinked install shares them with
+every other portfolio: segments installed from a store shouldn't be edited in
+place.
+
+Objects are written to a uniquely named temporary file and renamed into
+place, so concurrent builds on the same host can share a store. The store's
+directories are only created when something is added.
+
+Created on 2019-01-25 Copyright (c) 2019 Bradford Dillman
+'''
+
+import hashlib
+import os
+import re
+import shutil
+import stat
+import tempfile
+import zipfile
+
+from pathlib import Path
+
+from fashion import codec
+from fashion.archive import (MANIFEST, checkSegmentName, safePath, syncSegment,
+                             zipSegmentName)
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Linux ioctl to clone a file's extents (reflink).
+FICLONE = 0x40049409
+
+HASH_RE = re.compile("[0-9a-f]{64}")
+
+
+def reflink(src, dst):
+    '''Make dst a copy-on-write clone of src, or raise OSError.'''
+    if fcntl is None:
+        raise OSError("reflink not supported")
+    with open(str(src), mode="rb") as s:
+        with open(str(dst), mode="wb") as d:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+
+
+def linkFile(src, dst):
+    '''
+    Put a file at dst with the contents of src, as a hardlink if possible,
+    otherwise a reflink, otherwise a copy.
+
+    :param Path src: the existing file.
+    :param Path dst: the file to create or replace.
+    :returns: how the file was linked, "link", "reflink" or "copy".
+    '''
+    tmp = dst.with_name(dst.name + ".tmp")
+    if tmp.exists():
+        tmp.unlink()
+    try:
+        os.link(str(src), str(tmp))
+        how = "link"
+    except OSError:
+        try:
+            reflink(src, tmp)
+            how = "reflink"
+        except OSError:
+            shutil.copyfile(str(src), str(tmp))
+            how = "copy"
+    os.replace(str(tmp), str(dst))
+    return how
+
+
+class SegmentStore(object):
+    '''A content-addressed store of segment files.'''
+
+    def __init__(self, dir):
+        '''
+        Constructor.
+
+        :param Path dir: the store directory, created when a segment is added.
+        '''
+        self.dir = Path(dir)
+        self.objects = self.dir / "objects"
+        self.warehouseDir = self.dir / "warehouse"
+
+    def objectPath(self, h):
+        '''Get the path of a stored object by hash, or raise ValueError.'''
+        if not HASH_RE.fullmatch(h):
+            raise ValueError("bad object hash in segment store: {0!r}".format(h))
+        return self.objects / h[:2] / h
+
+    def has(self, h):
+        '''Check if an object is stored.'''
+        return self.objectPath(h).exists()
+
+    def putStream(self, src):
+        '''
+        Store the contents of a binary stream.
+
+        :param src: readable binary file object.
+        :returns: the hash of the contents, and True if it wasn't stored yet.
+        :rtype: (string, boolean)
+        '''
+        self.objects.mkdir(parents=True, exist_ok=True)
+        h = hashlib.sha256()
+        with tempfile.NamedTemporaryFile(dir=str(self.objects), prefix="tmp.",
+                                         delete=False) as dst:
+            tmp = Path(dst.name)
+            for block in iter(lambda: src.read(1 << 20), b""):
+                h.update(block)
+                dst.write(block)
+        h = h.hexdigest()
+        target = self.objectPath(h)
+        if target.exists():
+            tmp.unlink()
+            return h, False
+        target.parent.mkdir(exist_ok=True)
+        os.chmod(str(tmp), stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        os.replace(str(tmp), str(target))
+        return h, True
+
+    def add(self, zipfilename):
+        '''
+        Add a segment zip file to the store, storing only new files, and
+        make it the store's version of the segment.
+
+        :param string zipfilename: filename of a segment export.
+        :returns: the segment name and number of new objects.
+        :raises ValueError: if the zip has names outside the segment directory.
+        '''
+        added = 0
+        hashes = {}
+        with zipfile.ZipFile(str(zipfilename), mode="r") as zf:
+            names = zf.namelist()
+            segname = zipSegmentName(names)
+            members = []
+            for name in names:
+                rel = name[len(segname) + 1:]
+                if name.endswith("/") or rel == MANIFEST:
+                    continue
+                safePath(self.warehouseDir / segname, rel)
+                members.append((name, rel))
+            for name, rel in members:
+                with zf.open(name) as src:
+                    hashes[rel], new = self.putStream(src)
+                added += new
+        self.publish(segname, hashes)
+        return segname, added
+
+    def manifest(self, hashes):
+        '''Get the manifest file contents for some file hashes.'''
+        return codec.dumps({"version": 1, "files": hashes},
+                           indent=2, sort_keys=True).encode("utf-8")
+
+    def publish(self, segname, hashes):
+        '''Link a segment into the store's own warehouse.'''
+        checkSegmentName(segname)
+        paths = {rel: self.objectPath(h) for rel, h in hashes.items()}
+        syncSegment(self.warehouseDir / segname, hashes, self.manifest(hashes),
+                    lambda rel, target: linkFile(paths[rel], target))
+
+    def segmentHashes(self, segname):
+        '''Get the file hashes of a stored segment, or None.'''
+        manifestPath = self.warehouseDir / segname / MANIFEST
+        if not manifestPath.exists():
+            return None
+        return codec.loads(manifestPath.read_text())["files"]
+
+    def install(self, segname, warehouseDir, workers=None):
+        '''
+        Install a stored segment into a warehouse by linking its files.
+
+        :param string segname: the segment name.
+        :param Path warehouseDir: the warehouse directory.
+        :param int workers: number of threads hashing installed files.
+        :returns: number of files linked, or None if the segment isn't stored.
+        :raises ValueError: if the stored manifest has unsafe names or hashes.
+        '''
+        hashes = self.segmentHashes(checkSegmentName(segname))
+        if hashes is None:
+            return None
+        paths = {rel: self.objectPath(h) for rel, h in hashes.items()}
+        return syncSegment(Path(warehouseDir) / segname, hashes,
+                           self.manifest(hashes),
+                           lambda rel, target: linkFile(paths[rel], target),
+                           workers)
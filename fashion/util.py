@@ -4,8 +4,15 @@ Various utilities for fashion.
 Created on 2018-12-19 Copyright (c) 2018 Bradford Dillman
 '''
 
+import collections
+import hashlib
+import io
+import itertools
 import logging
-import os.path
+import os
+import random
+
+from concurrent.futures import ThreadPoolExecutor
 
 class cd:
     '''Context manager for changing the current working directory'''
@@ -20,3 +27,144 @@ class cd:
     def __exit__(self, etype, value, traceback):
         logging.debug("cd {1} -> {0}".format(self.savedPath, self.newPath))
         os.chdir(self.savedPath)
+
+
+def poolSize(executor=ThreadPoolExecutor):
+    '''Get the number of workers a pool class uses by default.'''
+    cpus = os.cpu_count() or 1
+    if executor is ThreadPoolExecutor:
+        return min(32, cpus + 4)
+    return cpus
+
+
+def readAhead(func, items, workers=None, window=None, executor=ThreadPoolExecutor):
+    '''
+    Map func over items on a thread pool, yielding (item, result) in order.
+
+    At most window items are in flight at once, so reading runs ahead of the
+    consumer without holding every result in memory.
+
+    :param func: callable taking one item, e.g. a file reader.
+    :param items: iterable of items.
+    :param int workers: pool size, default from poolSize.
+    :param int window: maximum items in flight, default 4 per worker.
+    :param executor: pool class, e.g. ProcessPoolExecutor for CPU bound
+    work, which needs func and items to be picklable.
+    '''
+    workers = workers or poolSize(executor)
+    if window is None:
+        window = 4 * workers
+    with executor(max_workers=workers) as pool:
+        pending = collections.deque()
+        for item in items:
+            pending.append((item, pool.submit(func, item)))
+            if len(pending) >= window:
+                item, future = pending.popleft()
+                yield item, future.result()
+        while pending:
+            item, future = pending.popleft()
+            yield item, future.result()
+
+
+def chunks(items, size):
+    '''
+    Split an iterable into lists of at most size items, lazily.
+    '''
+    it = iter(items)
+    while True:
+        chunk = list(itertools.islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def reservoir(items, size, rng=None):
+    '''
+    Choose a uniform random sample of an iterable of unknown length, in one
+    pass, holding at most size items.
+
+    :param items: iterable of items.
+    :param int size: the sample size.
+    :param random.Random rng: optional random number generator.
+    :returns: list of at most size items.
+    '''
+    if rng is None:
+        rng = random.Random()
+    sample = []
+    for i, item in enumerate(items):
+        if i < size:
+            sample.append(item)
+        else:
+            j = rng.randint(0, i)
+            if j < size:
+                sample[j] = item
+    return sample
+
+
+def hashFile(path):
+    '''Get the hex SHA-256 hash of a file.'''
+    h = hashlib.sha256()
+    with open(str(path), mode="rb") as fd:
+        for block in iter(lambda: fd.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class HashWriter(io.RawIOBase):
+    '''A raw binary writer which hashes everything written to a file.'''
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.hash = hashlib.sha256()
+        self.size = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        count = self.fd.write(data)
+        self.hash.update(memoryview(data)[:count])
+        self.size += count
+        return count
+
+
+def writeStream(chunks, targetFile, bufferSize=1 << 16, currentDigest=None):
+    '''
+    Write text chunks to a file without holding them all in memory. The text
+    goes through a buffered writer to a temporary file, which is hashed as
+    it's written and then renamed over the target, unless the target already
+    has the same contents.
+
+    :param chunks: iterable of strings, e.g. from jinja2 Template.generate().
+    :param Path targetFile: the file to write.
+    :param int bufferSize: the write buffer size.
+    :param string currentDigest: the known hash of the target's contents,
+    e.g. as last generated, to compare with instead of hashing the target.
+    :returns: the hex SHA-256 hash of the contents, and True if the target
+    was written, False if it was already the same.
+    '''
+    tmp = targetFile.with_name(targetFile.name + ".tmp")
+    try:
+        with open(str(tmp), mode="wb", buffering=0) as fd:
+            raw = HashWriter(fd)
+            with io.TextIOWrapper(io.BufferedWriter(raw, bufferSize)) as tf:
+                for chunk in chunks:
+                    tf.write(chunk)
+    except BaseException:
+        if tmp.exists():
+            tmp.unlink()
+        raise
+    digest = raw.hash.hexdigest()
+    try:
+        if currentDigest is not None:
+            same = currentDigest == digest and targetFile.exists()
+        else:
+            same = (targetFile.stat().st_size == raw.size and
+                    hashFile(targetFile) == digest)
+    except OSError:
+        same = False
+    if same:
+        tmp.unlink()
+        return digest, False
+    os.replace(str(tmp), str(targetFile))
+    return digest, True
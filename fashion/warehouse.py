@@ -17,6 +17,11 @@ Each directory is named for the segment within.
 A warehouse doesn't store anything about segments, so segment directories may
 be deleted or copied freely, instead of using the command line functions.
 
+Segment names are resolved through a SegmentIndex, which lists the whole
+warehouse chain once, and is rebuilt when a warehouse directory's mtime
+changes. A segment in a warehouse hides any segment of the same name in its
+fallbacks.
+
 /fashion/warehouse/* - segment directories
 /fashion/warehouse/local - the default local segment
 
@@ -28,20 +33,149 @@ Created on 2018-12-28 Copyright (c) 2018 Bradford Dillman
 
 import copy
 import logging
-import os
 import shutil
-import zipfile
 
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 from genson import SchemaBuilder
 from munch import munchify
 from tinydb import Query
 
+from fashion import codec
+from fashion.archive import exportArchive, importArchive
+from fashion.events import SEGMENT_LOADED, bus
+from fashion.modelView import plain
 from fashion.segment import Segment
-from fashion.util import cd
+from fashion.signature import digest
+from fashion.util import cd, chunks, readAhead, reservoir
 from fashion.xforms import matchTags
 
+# Number of examples guessed by each process in a parallel guessSchema.
+GUESS_CHUNK = 10000
+
+
+def recordDigest(doc):
+    '''Get the hex digest of a stored document's contents.'''
+    return digest(codec.dumps(doc, sort_keys=True))
+
+
+def guessedUpTo(dba, kind, examples):
+    '''
+    Check that the examples a schema was guessed from are still stored as
+    they were: the record at the high-water doc_id is unchanged, and there
+    are as many records up to it.
+
+    :param dictionary examples: lastId, count and last digest, as recorded by
+    Warehouse.guessSchema.
+    :returns: True if the schema can be refined from the newer records only.
+    :rtype: boolean
+    '''
+    if not examples or "lastId" not in examples:
+        return False
+    lastId = examples["lastId"]
+    last = dba.view(kind, lastId)
+    if last is None or recordDigest(last) != examples["last"]:
+        return False
+    return sum(1 for id, _ in dba.iterate(kind) if id <= lastId) == examples["count"]
+
+
+def buildSchema(objs):
+    '''Guess a schema from a list of examples, in a worker process.'''
+    builder = SchemaBuilder()
+    for o in objs:
+        builder.add_object(o)
+    return builder.to_schema()
+
+
+class SegmentIndex(object):
+    '''
+    A merged index of segment names to directories, across a warehouse and
+    its fallback chain.
+
+    The index is built by listing each warehouse directory once, and is kept
+    until the modification time of one of the warehouse directories changes
+    (a segment directory added or removed), or it is invalidated.
+    '''
+
+    def __init__(self, warehouse):
+        '''
+        Constructor.
+
+        :param Warehouse warehouse: the first warehouse in the chain.
+        '''
+        self.warehouses = []
+        while warehouse is not None:
+            self.warehouses.append(warehouse)
+            warehouse = warehouse.fallback
+        self.stamp = None
+        self.paths = {}
+        self.levels = {}
+
+    def currentStamp(self):
+        '''Get the modification times of the warehouse directories.'''
+        stamp = []
+        for wh in self.warehouses:
+            try:
+                stamp.append(wh.dir.stat().st_mtime_ns)
+            except OSError:
+                stamp.append(None)
+        return stamp
+
+    def invalidate(self):
+        '''Rebuild the index on next use.'''
+        self.stamp = None
+
+    def refresh(self):
+        '''Rebuild the index if a warehouse directory has changed.'''
+        stamp = self.currentStamp()
+        if stamp == self.stamp:
+            return
+        paths = {}
+        levels = {}
+        for wh in self.warehouses:
+            names = []
+            if wh.dir.is_dir():
+                for d in sorted(wh.dir.iterdir()):
+                    if d.is_dir():
+                        names.append(d.name)
+                        if (d / "segment.json").exists():
+                            paths.setdefault(d.name, d)
+            levels[wh.dir] = names
+        self.paths = paths
+        self.levels = levels
+        self.stamp = stamp
+
+    def find(self, segname):
+        '''
+        Find the directory of a segment by name.
+
+        :param string segname: the segment name.
+        :returns: the segment directory in the first warehouse which has it,
+        or None.
+        :rtype: Path
+        '''
+        self.refresh()
+        return self.paths.get(segname)
+
+    def names(self):
+        '''
+        List the names of all segments, each once, in warehouse priority order.
+
+        :rtype: list(string)
+        '''
+        self.refresh()
+        names = []
+        for wh in self.warehouses:
+            names.extend(n for n in self.levels[wh.dir]
+                         if self.paths.get(n) == wh.dir / n)
+        return names
+
+    def listDir(self, dir):
+        '''List the segment directory names in one warehouse directory.'''
+        self.refresh()
+        return list(self.levels.get(dir, []))
+
 
 class Warehouse(object):
     '''Manage collection of segments.'''
@@ -63,6 +197,9 @@ class Warehouse(object):
         # A cache of already loaded segments.
         self.segmentCache = {}
 
+        # Index of segment names across this and fallback Warehouses.
+        self.index = SegmentIndex(self)
+
     def listSegments(self):
         '''
         List names of segments in this warehouse.
@@ -70,42 +207,53 @@ class Warehouse(object):
         :returns: a list of segment names in this warehouse.
         :rtype: list(string)
         '''
-        # Return the named subdirectories.
-        with cd(self.dir):
-            return [d.name for d in self.dir.iterdir() if d.is_dir()]
+        return self.index.listDir(self.dir)
 
-    def loadSegment(self, segname, db, cache=None):
+    def listAllSegments(self):
         '''
-        Load a segment by name from this or fallback Warehouse.
+        List names of segments in this and fallback warehouses, without the
+        segments hidden by a segment of the same name in a prior warehouse.
 
-        :param string segname: name of the segment to load.
-        :returns: the loaded segment or None.
-        :rtype: Segment
+        :returns: a list of segment names.
+        :rtype: list(string)
         '''
-        if cache is None:
-            cache = self.segmentCache
+        return self.index.names()
 
-        # Try the cache first.
-        if segname in cache:
-            return cache[segname]
-        
-        # Next check a named subdirectory.
-        segfn = self.dir / segname / "segment.json"
+    def cachedSegment(self, segname, db):
+        '''
+        Get a segment from the cache, or load it if it isn't cached or has
+        moved to another warehouse.
+
+        :returns: the segment or None, and True if it was loaded.
+        '''
+        segdir = self.index.find(segname)
+        if segname in self.segmentCache:
+            seg = self.segmentCache[segname]
+            if (seg.absDirname if seg is not None else None) == segdir:
+                return seg, False
         seg = None
-        if segfn.exists():
+        if segdir is not None:
             if db.isVerbose():
                 print("Loading segment {0}".format(segname))
-            seg = Segment.load(segfn)
-        elif self.fallback is not None:
-            # Try the fallback Warehouse if not found.
-            seg = self.fallback.loadSegment(segname, db)
+            seg = Segment.load(segdir / "segment.json")
+            bus.emit(SEGMENT_LOADED, seg)
+        self.segmentCache[segname] = seg
+        return seg, True
+
+    def loadSegment(self, segname, db):
+        '''
+        Load a segment by name from this or fallback Warehouse.
 
-        # Update the cache.
-        cache[segname] = seg
-        Q = Query()
+        :param string segname: name of the segment to load.
+        :returns: the loaded segment or None.
+        :rtype: Segment
+        '''
+        seg, loaded = self.cachedSegment(segname, db)
 
         # Make a note in the database.
-        db.table('fashion.prime.segment').upsert(seg.properties, Q.name == segname)
+        if loaded and seg is not None:
+            Q = Query()
+            db.table('fashion.prime.segment').upsert(seg.properties, Q.name == segname)
 
         return seg
 
@@ -116,16 +264,11 @@ class Warehouse(object):
         :returns: list of all Segment objects.
         :rtype: list(Segment)
         '''
-        db.table('fashion.prime.segment').purge()
-        return self.loadSegs(db, self.segmentCache)
-
-    def loadSegs(self, db, cache):
-        # Load all the segments in this Warehouse.
-        self.segments = [self.loadSegment(segname, db)
-                         for segname in self.listSegments()]
-        if self.fallback is not None:
-            # Append the fallback Warehouse segments.
-            self.segments.extend(self.fallback.loadSegs(db, cache))
+        self.segments = [self.cachedSegment(segname, db)[0]
+                         for segname in self.index.names()]
+        table = db.table('fashion.prime.segment')
+        table.purge()
+        table.insert_multiple([seg.properties for seg in self.segments])
         return self.segments
 
     def newSegment(self, segname, db):
@@ -142,33 +285,48 @@ class Warehouse(object):
         segdir = self.dir / segname
         segdir.mkdir(parents=True, exist_ok=True)
         Segment.create(segdir, segname)
+        self.index.invalidate()
         self.loadSegment(segname, db)
 
-    def exportSegment(self, segname, db):
+    def exportSegment(self, segname, db, workers=None):
         '''
-        Export a segment to a zip file.
+        Export a segment to a zip file, with a manifest of file hashes.
+        Files unchanged since a previous export aren't compressed again.
 
         :param string segname: name of segment to export.
+        :param int workers: number of compression threads.
+        :returns: the zip file name.
+        :rtype: string
         '''
         seg = self.loadSegment(segname, db)
         exportName = segname + "_v" + seg.properties.version + ".zip"
-        dirName = seg.absDirname.parent.resolve()
-        with zipfile.ZipFile(exportName, mode='w') as zip:
-            with cd(dirName):
-                for root, _, files in os.walk(segname):
-                    if os.path.basename(root) != '__pycache__':
-                        for file in files:
-                            zip.write(os.path.join(root, file))
+        exportArchive(Path(exportName), seg.absDirname.resolve(), segname, workers)
+        return exportName
 
-    def importSegment(self, zipfilename):
+    def importSegment(self, zipfilename, workers=None, store=None):
         '''
-        Import a segment from a zip file.
+        Import a segment from a zip file. Only files which differ from the
+        installed segment are extracted.
 
         :param string zipfilename: filename of export.
+        :param SegmentStore store: if given, add the segment to this store
+        and install it by linking to the stored files.
+        :returns: the name of the imported segment, or None if the archive
+        is unsafe.
+        :rtype: string
         '''
-        with zipfile.ZipFile(zipfilename, mode='r') as zip:
-            with cd(self.dir):
-                zip.extractall()
+        try:
+            if store is None:
+                segname, _ = importArchive(Path(zipfilename), self.dir, workers)
+            else:
+                segname, _ = store.add(zipfilename)
+                store.install(segname, self.dir, workers)
+        except ValueError as e:
+            logging.error("can't import {0}: {1}".format(zipfilename, e))
+            return None
+        self.segmentCache.pop(segname, None)
+        self.index.invalidate()
+        return segname
 
     def deleteSegment(self, segment):
         '''
@@ -177,6 +335,7 @@ class Warehouse(object):
         :param Segment segment: the segment object to delete from this warehouse.
         '''
         shutil.rmtree(str(segment.absDirname))
+        self.index.invalidate()
 
     def getModuleDefinitions(self, dba, tags=None):
         '''
@@ -245,6 +404,19 @@ class Warehouse(object):
                     logging.error("No module for config: {0}".format(c.moduleName))
         return cfgs
 
+    def getEventHandlers(self):
+        '''
+        Load all "eventHandlers" from all segments, see fashion.events.
+
+        :returns: the handler descriptions, by module name.
+        :rtype: dictionary {string moduleName:list(handler description)}
+        '''
+        handlers = {}
+        for seg in self.segments:
+            for h in seg.properties.get("eventHandlers", []):
+                handlers.setdefault(h.moduleName, []).append(h)
+        return handlers
+
     def getUndefinedModuleConfigs(self, moduleDict):
         '''
         Load all "xformConfig" from all segments for modules NOT in moduleDict.
@@ -274,31 +446,78 @@ class Warehouse(object):
                     logging.error(
                         "duplicate schema definition: {0}".format(sch.kind))
                 else:
-                    sch.absDirname = seg.absDirname
+                    sch.absDirname = seg.absDirname.as_posix()
                     schemaDescrs[sch.kind] = sch
         return schemaDescrs
 
-    def guessSchema(self, dba, kind, existingSchema=None):
+    def guessSchema(self, dba, kind, existingSchema=None, sample=None,
+                    workers=1, refine=False):
         '''
         Guess a JSONSchema for a model kind from examples.
 
+        Examples are streamed from the database, not copied. Large kinds can
+        be guessed from a random sample, or in chunks on a process pool whose
+        schemas are merged.
+
         :param DatabaseAccess dba: the fasion database to search.
         :param string kind: the model kind to guess.
         :param JSONobject existingSchema: starting schema, if any.
+        :param int sample: guess from a random sample of this many examples.
+        :param int workers: number of processes, more than 1 builds chunks
+        of examples in parallel.
+        :param boolean refine: start from the kind's schema in the local
+        segment, and add only the examples stored after the high-water doc_id
+        it was guessed up to. If the table was compacted or renumbered since,
+        or examples up to there were removed, the schema is guessed afresh.
         :returns: True if the schema was guessed and created.
         :rtype: boolean
         '''
-        objs = dba.table(kind).all()
+        localSeg = self.loadSegment("local", dba)
+        afterId = 0
+        examples = {"lastId": 0, "count": 0, "last": None}
+        if refine:
+            descr = localSeg.findSchema(kind)
+            if descr is not None and guessedUpTo(dba, kind, descr.get("examples")):
+                examples = dict(descr["examples"])
+                afterId = examples["lastId"]
+                with cd(localSeg.absDirname):
+                    with open(descr["filename"], mode="r") as fd:
+                        existingSchema = codec.load(fd)
+
+        lastDoc = [None]
+
+        def newExamples():
+            for id, doc in dba.iterate(kind, afterId):
+                examples["count"] += 1
+                if id > examples["lastId"]:
+                    examples["lastId"] = id
+                    lastDoc[0] = doc
+                yield plain(doc)
+        objs = newExamples()
+        if sample is not None:
+            objs = reservoir(objs, sample)
         builder = SchemaBuilder()
         if existingSchema is not None:
             builder.add_schema(existingSchema)
-        elif len(objs) == 0:
-            logging.error(
-                "Can't guess with no schema and no examples of kind {0}".format(kind))
-            return False
-        for o in objs:
-            builder.add_object(o)
+        count = 0
+        if workers is not None and workers > 1:
+            for chunk, schema in readAhead(buildSchema, chunks(objs, GUESS_CHUNK),
+                                           workers, executor=ProcessPoolExecutor):
+                builder.add_schema(schema)
+                count += len(chunk)
+        else:
+            for o in objs:
+                builder.add_object(o)
+                count += 1
+        if count == 0:
+            if existingSchema is None:
+                logging.error(
+                    "Can't guess with no schema and no examples of kind {0}".format(kind))
+                return False
+            if afterId:
+                return True
+        if lastDoc[0] is not None:
+            examples["last"] = recordDigest(lastDoc[0])
         schema = builder.to_schema()
-        localSeg = self.loadSegment("local", dba)
-        localSeg.createSchema(kind, schema)
+        localSeg.createSchema(kind, schema, examples)
         return True
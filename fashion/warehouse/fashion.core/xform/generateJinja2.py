@@ -12,9 +12,11 @@ from pathlib import Path
 
 from jinja2 import FileSystemLoader, Environment
 from jinja2.exceptions import TemplateNotFound
-from munch import munchify
 
+from fashion.events import FILE_GENERATED, bus
 from fashion.mirror import Mirror
+from fashion.signature import RenderSignatures
+from fashion.util import writeStream
 
 # Module level code is executed when this file is loaded.
 # cwd is where segment file was loaded.
@@ -45,23 +47,31 @@ class Generate(object):
         '''cwd is project root directory.'''
         # set up  mirrored directories
         mdb = codeRegistry.getService('fashion.prime.modelAccess')
-        mirCfg = munchify(mdb.getSingleton("fashion.core.mirror"))
+        mirCfg = mdb.getSingleton("fashion.core.mirror")
         mirror = Mirror(Path(mirCfg.projectPath), Path(mirCfg.mirrorPath), force=mirCfg.force)
+        signatures = RenderSignatures(codeRegistry.dba)
         genSpecs = mdb.getByKind(self.inputKinds[0])
-        for genSpec in genSpecs:
-            gs = munchify(genSpec)
-
+        for gs in genSpecs:
             if mirror.isChanged(Path(gs.targetFile)):
                 logging.warning("Skipping {0}, file has changed.".format(gs.targetFile))
             else:
                 try:
-                    env = Environment(loader=FileSystemLoader(gs.templatePath))
-                    template = env.get_template(gs.template)
-                    result = template.render(gs.model)
+                    loader = FileSystemLoader(gs.templatePath)
+                    env = Environment(loader=loader)
                     targetPath = Path(gs.targetFile)
-                    with targetPath.open(mode="w") as tf:
-                        tf.write(result)
-                    mirror.copyToMirror(targetPath)
+                    templateKey, templates = signatures.templateSet(env, gs.template)
+                    sig, inputs = signatures.signature(gs, templateKey)
+                    if not mirror.force and signatures.isCurrent(targetPath, sig):
+                        mdb.outputFile(targetPath)
+                        continue
+                    template = env.get_template(gs.template)
+                    current = None if mirror.force else signatures.contentHash(targetPath)
+                    contentHash, written = writeStream(template.generate(gs.model), targetPath,
+                                                       currentDigest=current)
+                    if written or not Path(mirror.getMirrorPath(targetPath)).exists():
+                        mirror.copyToMirror(targetPath)
                     mdb.outputFile(targetPath)
+                    signatures.store(targetPath, sig, inputs, templates, contentHash)
+                    bus.emit(FILE_GENERATED, targetPath)
                 except TemplateNotFound:
                     logging.error("TemplateNotFound: {0}".format(gs.template))
@@ -7,28 +7,42 @@ Load models from JSON files.
 '''
 
 import glob
-import json
 import logging
 import os
 
 from munch import munchify
 
+from fashion import codec
+from fashion.util import readAhead
+
 # Module level code is executed when this file is loaded.
 # cwd is where segment file was loaded.
 
 def init(moduleConfig, codeRegistry, verbose=False, tags=None):
     '''
-    Create 1 LoadJSON object for each file.
+    Create 1 LoadJSON object for each file, or 1 LoadJSONBatch object for all
+    the files if the "batch" parameter is true.
     cwd is where segment file was loaded.
     '''
     if isinstance(moduleConfig.parameters.filename, list):
-        filenames = moduleConfig.filename
+        filenames = moduleConfig.parameters.filename
     else:
         filenames = glob.glob(moduleConfig.parameters.filename)
     cfg = munchify(moduleConfig.parameters)
     del cfg.filename
-    for fn in filenames:
-        codeRegistry.addXformObject(LoadJSON(moduleConfig.moduleName, cfg, fn))
+    if cfg.get("batch", False):
+        codeRegistry.addXformObject(LoadJSONBatch(moduleConfig.moduleName, cfg,
+            moduleConfig.parameters.filename, filenames))
+    else:
+        for fn in filenames:
+            codeRegistry.addXformObject(LoadJSON(moduleConfig.moduleName, cfg, fn))
+
+
+def readJSON(filename):
+    '''Read and parse a JSON file.'''
+    with open(filename, 'r') as fd:
+        return codec.load(fd)
+
 
 class LoadJSON(object):
     '''
@@ -57,9 +71,48 @@ class LoadJSON(object):
         mdb = codeRegistry.getService('fashion.prime.modelAccess')
         with open(str(self.filename), 'r') as fd:
             mdb.inputFile(str(self.filename))
-            obj = munchify(json.loads(fd.read()))
+            obj = codec.load(fd)
             if self.config.isList == False:
                 mdb.insert(self.config.kind, obj)
             else:
                 for o in obj:
                     mdb.insert(self.config.kind, o)
+
+
+class LoadJSONBatch(object):
+    '''
+    Load all the JSON files matching a glob as a single xform object.
+    Files are read and parsed on a thread pool, and inserted in bulk.
+    '''
+
+    def __init__(self, moduleName, cfg, pattern, filenames):
+        '''
+        Constructor.
+        cwd is where segment file was loaded.
+        '''
+        self.version = "1.0.0"
+        self.templatePath = []
+        self.config = cfg
+        self.filenames = [os.path.abspath(fn) for fn in filenames]
+        if isinstance(pattern, list):
+            pattern = ",".join(pattern)
+        self.name = moduleName + "::" + os.path.abspath(pattern)
+        self.tags = [ "input" ]
+        self.inputKinds = []
+        self.outputKinds = [ self.config.kind, 'fashion.core.input.file' ]
+
+    def execute(self, codeRegistry, verbose=False, tags=None):
+        '''
+        Load the JSON files and insert them into the model database.
+        cwd is project root.
+        '''
+        mdb = codeRegistry.getService('fashion.prime.modelAccess')
+        models = []
+        workers = self.config.get("workers", None)
+        for _, obj in readAhead(readJSON, self.filenames, workers=workers):
+            if self.config.isList == False:
+                models.append(obj)
+            else:
+                models.extend(obj)
+        mdb.inputFiles(self.filenames)
+        mdb.insertMultiple(self.config.kind, models)
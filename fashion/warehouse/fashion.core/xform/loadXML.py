@@ -8,7 +8,6 @@ Load models from JSON files.
 
 import codecs
 import glob
-import json
 import logging
 import os
 
@@ -16,23 +15,37 @@ import xmltodict
 
 from munch import munchify
 
+from fashion.util import readAhead
+
 # Module level code is executed when this file is loaded.
 # cwd is where segment file was loaded.
 
 
 def init(moduleConfig, codeRegistry, verbose=False, tags=None):
     '''
-    Create 1 LoadXML object for each file.
+    Create 1 LoadXML object for each file, or 1 LoadXMLBatch object for all
+    the files if the "batch" parameter is true.
     cwd is where segment file was loaded.
     '''
     param = munchify(moduleConfig.parameters)
+    pattern = param.filename
     if isinstance(param.filename, list):
         filenames = param.filename
     else:
         filenames = glob.glob(param.filename)
     del param.filename
-    for fn in filenames:
-        codeRegistry.addXformObject(LoadXML(moduleConfig.moduleName, param, fn))
+    if param.get("batch", False):
+        codeRegistry.addXformObject(LoadXMLBatch(moduleConfig.moduleName, param,
+            pattern, filenames))
+    else:
+        for fn in filenames:
+            codeRegistry.addXformObject(LoadXML(moduleConfig.moduleName, param, fn))
+
+
+def readXML(filename):
+    '''Read and parse an XML file.'''
+    with codecs.open(filename, 'r', 'utf_8', ) as fd:
+        return xmltodict.parse(fd.read())
 
 
 class LoadXML(object):
@@ -61,6 +74,41 @@ class LoadXML(object):
         '''
         mdb = codeRegistry.getService('fashion.prime.modelAccess')
         with codecs.open(str(self.filename), 'r', 'utf_8', ) as fd:
-            obj = munchify(xmltodict.parse(fd.read()))
+            obj = xmltodict.parse(fd.read())
             mdb.insert(self.config.kind, obj)
             mdb.inputFile(str(self.filename))
+
+
+class LoadXMLBatch(object):
+    '''
+    Load all the XML files matching a glob as a single xform object.
+    Files are read and parsed on a thread pool, and inserted in bulk.
+    '''
+
+    def __init__(self, moduleName, cfg, pattern, filenames):
+        '''
+        Constructor.
+        cwd is where segment file was loaded.
+        '''
+        self.version = "1.0.0"
+        self.templatePath = []
+        self.config = cfg
+        self.filenames = [os.path.abspath(fn) for fn in filenames]
+        if isinstance(pattern, list):
+            pattern = ",".join(pattern)
+        self.name = moduleName + "::" + os.path.abspath(pattern)
+        self.tags = ["input"]
+        self.inputKinds = []
+        self.outputKinds = [ self.config.kind, 'fashion.core.input.file' ]
+
+    def execute(self, codeRegistry, verbose=False, tags=None):
+        '''
+        Load the XML files and insert them into the model database.
+        cwd is project root.
+        '''
+        mdb = codeRegistry.getService('fashion.prime.modelAccess')
+        workers = self.config.get("workers", None)
+        models = [obj for _, obj in
+                  readAhead(readXML, self.filenames, workers=workers)]
+        mdb.insertMultiple(self.config.kind, models)
+        mdb.inputFiles(self.filenames)
@@ -5,22 +5,25 @@ from pathlib import Path, PurePath
 
 from jinja2 import ChoiceLoader, FileSystemLoader, Environment
 from jinja2.exceptions import TemplateNotFound
-from munch import munchify
 
-from fashion.util import cd
+from fashion.events import FILE_GENERATED, bus
+from fashion.renderCache import RenderCache
+from fashion.signature import RenderSignatures
+from fashion.util import cd, writeStream
+from fashion.xforms import activeXform
 
 def init(config, codeRegistry, verbose=False, tags=None):
     '''cwd is where segment file was loaded.'''
     mdb = codeRegistry.getService('fashion.prime.modelAccess')
-    args = munchify(mdb.getSingleton("fashion.prime.args"))
+    args = mdb.getSingleton("fashion.prime.args")
     if "force" in args:
         f = args.force
     else:
         f = False
-    pf = munchify(mdb.getSingleton("fashion.prime.portfolio"))
+    pf = mdb.getSingleton("fashion.prime.portfolio")
     codeRegistry.addService(MirrorService(Path(pf.projectPath), Path(pf.mirrorPath), force=f))
     codeRegistry.addService(TemplateService())
-    codeRegistry.addService(GenerateService(codeRegistry))
+    codeRegistry.addService(GenerateService(codeRegistry, pf.get("renderCacheBytes")))
     # identifier service
 
 class MirrorService(object):
@@ -71,32 +74,55 @@ class TemplateService(object):
         self.defAbsDir = None
         self.cfgPath = []
         self.cfgAbsDir = None
+        self.loader = None
 
     def getDefaultLoader(self):
-        with cd(self.defAbsDir):
-            defPath = [Path(p).absolute().as_posix() for p in self.defPath]
-        with cd(self.cfgAbsDir):
-            cfgPath = [Path(p).absolute().as_posix() for p in self.cfgPath]
-        loader = ChoiceLoader([
-            FileSystemLoader(cfgPath),
-            FileSystemLoader(defPath)])
-        return loader
+        '''
+        Get the template loader of the executing xform, prebuilt by the
+        Runway, or else one for the paths set on this service.
+        '''
+        record = activeXform.get()
+        if record is not None:
+            return record.loader
+        if self.loader is None:
+            with cd(self.defAbsDir):
+                defPath = [Path(p).absolute().as_posix() for p in self.defPath]
+            with cd(self.cfgAbsDir):
+                cfgPath = [Path(p).absolute().as_posix() for p in self.cfgPath]
+            self.loader = ChoiceLoader([
+                FileSystemLoader(cfgPath),
+                FileSystemLoader(defPath)])
+        return self.loader
 
     def setDefinitionPath(self, absDir, pathList):
         self.defPath = pathList
         self.defAbsDir = absDir
+        self.loader = None
 
     def setConfigurationPath(self, absDir, pathList):
         self.cfgPath = pathList
         self.cfgAbsDir = absDir
+        self.loader = None
 
 class GenerateService(object):
-    '''Generate output by merging a model into a template to produce a file.'''
-    def __init__(self, codeRegistry):
+    '''
+    Generate output by merging a model into a template to produce a file.
+    Files whose template and model records haven't changed since the last
+    build aren't rendered again, see fashion.signature. Files rendered
+    before with the same templates and model are copied from the render
+    cache, see fashion.renderCache.
+    '''
+    def __init__(self, codeRegistry, cacheBytes=None):
         '''Constructor.'''
         self.name = "fashion.core.generate"
         self.version = "1.0.0"
         self.codeRegistry = codeRegistry
+        self.signatures = RenderSignatures(codeRegistry.dba)
+        self.cache = RenderCache(RenderCache.path(codeRegistry.dba), cacheBytes)
+
+    def shutdown(self):
+        if self.codeRegistry.dba.isVerbose():
+            print(self.cache.stats())
 
     def generate(self, model, template, targetFile, templateLoader=None):
         mdb = self.codeRegistry.getService('fashion.prime.modelAccess')
@@ -105,17 +131,38 @@ class GenerateService(object):
         if loader is None:
             templateSvc = self.codeRegistry.getService('fashion.core.template')
             loader = templateSvc.getDefaultLoader()
-        if mirror.isChanged(Path(targetFile)):
+        targetPath = Path(targetFile)
+        if mirror.isChanged(targetPath):
             logging.warning("Skipping {0}, file has changed.".format(targetFile))
         else:
             try:
                 env = Environment(loader=loader)
-                template = env.get_template(template)
-                result = template.render(model)
-                targetPath = Path(targetFile)
-                with targetPath.open(mode="w") as tf:
-                    tf.write(result)
-                mirror.copyToMirror(targetPath)
+                templateKey, templates = self.signatures.templateSet(env, template)
+                sig, inputs = self.signatures.signature(model, templateKey)
+                if not mirror.force and self.signatures.isCurrent(targetPath, sig):
+                    logging.debug("Unchanged {0}".format(targetFile))
+                    mdb.outputFile(targetPath)
+                    return
+                cached = None
+                if sig is not None and not mirror.force:
+                    cached = self.cache.get(sig)
+                contentHash = None
+                written = True
+                if cached is not None:
+                    self.cache.restore(cached, targetPath)
+                else:
+                    tpl = env.get_template(template)
+                    # The stored hash is of the file as last generated, which
+                    # is still its contents unless forced past a user's edit.
+                    current = None if mirror.force else self.signatures.contentHash(targetPath)
+                    contentHash, written = writeStream(tpl.generate(model), targetPath,
+                                                       currentDigest=current)
+                    if sig is not None:
+                        self.cache.put(sig, targetPath)
+                if written or not Path(mirror.getMirrorPath(targetPath)).exists():
+                    mirror.copyToMirror(targetPath)
                 mdb.outputFile(targetPath)
+                self.signatures.store(targetPath, sig, inputs, templates, contentHash)
+                bus.emit(FILE_GENERATED, targetPath)
             except TemplateNotFound:
                 logging.error("TemplateNotFound: {0}".format(template))
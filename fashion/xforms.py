@@ -7,6 +7,10 @@ Copyright (c) 2018 Bradford Dillman
 
 Describe and manipulate xforms, which are python3 modules with specific
 requirements.
+
+An XformRecord holds everything about an xform object needed to execute it,
+resolved once by the Runway after planning. While an xform executes, its
+record is the value of the activeXform context variable.
 '''
 
 import importlib.util
@@ -15,9 +19,22 @@ import logging
 import os
 import traceback
 
+from collections import namedtuple
+from contextvars import ContextVar
+
 from packaging.specifiers import SpecifierSet
 from packaging.version import Version
 
+# An xform object ready to execute: its config and module definition, the
+# absolute template search path (config directories first), a template loader
+# for that path, and frozensets of the kinds it may read and write.
+XformRecord = namedtuple("XformRecord", [
+    "name", "xform", "config", "definition", "templatePath", "loader",
+    "inputKinds", "outputKinds"])
+
+# The XformRecord of the xform executing in the current thread or task.
+activeXform = ContextVar("fashion.prime.xform", default=None)
+
 
 def matchTags(requestedTags, moduleTags):
     '''Check if module tags include requested tags.'''
@@ -0,0 +1,86 @@
+import json
+
+import pytest
+from munch import munchify
+
+from fashion.portfolio import Portfolio
+
+
+class Project(object):
+    '''Makes a portfolio with local xform modules, and opens it for builds.'''
+
+    # Module config loading model/item*.json as local.item records.
+    loadItems = {"moduleName": "fashion.core.loadJSON",
+                 "parameters": {"filename": "../../../model/*.json",
+                                "kind": "local.item", "isList": False}}
+
+    def __init__(self, root):
+        '''
+        Constructor.
+
+        :param Path root: the project directory.
+        '''
+        self.root = root
+
+    def writeItem(self, i, value):
+        '''Write model/item<i>.json.'''
+        (self.root / "model" / "item{0}.json".format(i)).write_text(
+            json.dumps({"name": "item{0}".format(i), "value": value}))
+
+    def create(self, xforms, template, xformConfig, eventHandlers=None,
+               properties=None, items=3):
+        '''
+        Make the portfolio, with model items and an out directory.
+
+        :param dictionary xforms: source of each module in the local segment,
+        by module filename without .py.
+        :param string template: source of the local template list.txt.
+        :param list xformConfig: the local segment's xformConfig.
+        :param list eventHandlers: the local segment's eventHandlers.
+        :param dictionary properties: portfolio properties to set.
+        :param int items: number of model items to write, item<i> = i.
+        '''
+        pf = Portfolio(self.root)
+        pf.create()
+        if properties:
+            pf.properties.update(properties)
+            pf.save()
+        (self.root / "model").mkdir()
+        (self.root / "out").mkdir()
+        for i in range(1, items + 1):
+            self.writeItem(i, i)
+        segdir = self.root / "fashion" / "warehouse" / "local"
+        (segdir / "template" / "list.txt").write_text(template)
+        for name, source in xforms.items():
+            (segdir / "xform" / (name + ".py")).write_text(source)
+        segfile = segdir / "segment.json"
+        seg = json.loads(segfile.read_text())
+        seg["xformConfig"] = xformConfig
+        if eventHandlers is not None:
+            seg["eventHandlers"] = eventHandlers
+        segfile.write_text(json.dumps(seg))
+        pf.db.close()
+
+    def open(self, dbName=None):
+        '''
+        Open the portfolio with the singletons a build sets, as a build would.
+
+        :param string dbName: a database file in the project directory to
+        use instead of the project's own, e.g. a CI machine's new one.
+        :rtype: Portfolio
+        '''
+        pf = Portfolio(self.root, None if dbName is None else self.root / dbName)
+        pf.db.setSingleton('fashion.prime.args',
+                           {"project": self.root.as_posix(), "force": False,
+                            "verbose": False})
+        props = munchify(pf.properties)
+        props.projectPath = pf.projectPath.as_posix()
+        props.mirrorPath = pf.mirrorPath.as_posix()
+        pf.db.setSingleton('fashion.prime.portfolio', props)
+        return pf
+
+
+@pytest.fixture
+def project(tmp_path):
+    '''A Project in tmp_path.'''
+    return Project(tmp_path)
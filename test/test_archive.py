@@ -0,0 +1,136 @@
+import json
+import zipfile
+
+import pytest
+
+from fashion import archive
+from fashion.archive import MANIFEST, exportArchive, importArchive
+from fashion.databaseAccess import DatabaseAccess
+from fashion.util import cd
+from fashion.warehouse import Warehouse
+
+
+class TestArchive(object):
+
+    def makeSegment(self, tmp_path, count=20):
+        segdir = tmp_path / "src" / "seg"
+        (segdir / "template").mkdir(parents=True)
+        (segdir / "__pycache__").mkdir()
+        (segdir / "__pycache__" / "x.pyc").write_bytes(b"junk")
+        (segdir / "segment.json").write_text('{"name": "seg"}')
+        for i in range(count):
+            (segdir / "template" / "t{0}.txt".format(i)).write_text(
+                "template {0} {{{{ x }}}}\n".format(i) * 20)
+        return segdir
+
+    def test_export(self, tmp_path):
+        segdir = self.makeSegment(tmp_path)
+        zipname = tmp_path / "seg_v1.zip"
+        assert exportArchive(zipname, segdir, "seg", workers=4) == 21
+        with zipfile.ZipFile(str(zipname)) as zf:
+            assert zf.testzip() is None
+            names = zf.namelist()
+            assert "seg/template/t3.txt" in names
+            assert "seg/" + MANIFEST in names
+            assert not any("__pycache__" in n for n in names)
+            assert zf.read("seg/template/t3.txt") == \
+                (segdir / "template" / "t3.txt").read_bytes()
+        # Only the changed file is compressed again.
+        (segdir / "template" / "t3.txt").write_text("changed")
+        assert exportArchive(zipname, segdir, "seg") == 1
+        with zipfile.ZipFile(str(zipname)) as zf:
+            assert zf.testzip() is None
+            assert zf.read("seg/template/t3.txt") == b"changed"
+            assert zf.read("seg/template/t4.txt") == \
+                (segdir / "template" / "t4.txt").read_bytes()
+
+    def test_exportFallback(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(archive, "RAW_COPY", False)
+        segdir = self.makeSegment(tmp_path)
+        zipname = tmp_path / "seg_v1.zip"
+        assert exportArchive(zipname, segdir, "seg") == 21
+        (segdir / "template" / "t3.txt").write_text("changed")
+        assert exportArchive(zipname, segdir, "seg") == 21
+        with zipfile.ZipFile(str(zipname)) as zf:
+            assert zf.testzip() is None
+            assert zf.read("seg/template/t3.txt") == b"changed"
+        wh = tmp_path / "wh"
+        wh.mkdir()
+        assert importArchive(zipname, wh) == ("seg", 21)
+
+    def test_import(self, tmp_path):
+        segdir = self.makeSegment(tmp_path)
+        zipname = tmp_path / "seg_v1.zip"
+        exportArchive(zipname, segdir, "seg")
+        wh = tmp_path / "wh"
+        wh.mkdir()
+        assert importArchive(zipname, wh) == ("seg", 21)
+        assert (wh / "seg" / "template" / "t0.txt").read_bytes() == \
+            (segdir / "template" / "t0.txt").read_bytes()
+        assert importArchive(zipname, wh) == ("seg", 0)
+        # Changed and removed files.
+        (segdir / "template" / "t1.txt").write_text("changed")
+        (segdir / "template" / "t2.txt").unlink()
+        exportArchive(zipname, segdir, "seg")
+        assert importArchive(zipname, wh) == ("seg", 1)
+        assert (wh / "seg" / "template" / "t1.txt").read_text() == "changed"
+        assert not (wh / "seg" / "template" / "t2.txt").exists()
+        # A file edited since it was installed is restored.
+        edited = wh / "seg" / "template" / "t3.txt"
+        edited.write_text("local edit")
+        assert importArchive(zipname, wh) == ("seg", 1)
+        assert edited.read_bytes() == (segdir / "template" / "t3.txt").read_bytes()
+        assert importArchive(zipname, wh) == ("seg", 0)
+        # Without an installed manifest, installed files are hashed.
+        (wh / "seg" / MANIFEST).unlink()
+        (wh / "seg" / "template" / "t5.txt").write_text("local edit")
+        assert importArchive(zipname, wh) == ("seg", 1)
+
+    def test_warehouse(self, tmp_path):
+        dba = DatabaseAccess(tmp_path / "db.json")
+        (tmp_path / "src").mkdir()
+        src = Warehouse(tmp_path / "src")
+        src.newSegment("seg", dba)
+        with cd(tmp_path):
+            zipname = src.exportSegment("seg", dba)
+        (tmp_path / "dst").mkdir()
+        dst = Warehouse(tmp_path / "dst")
+        assert dst.loadSegment("seg", dba) is None
+        assert dst.importSegment(tmp_path / zipname) == "seg"
+        assert dst.loadSegment("seg", dba).properties.name == "seg"
+
+    def writeZip(self, zipname, entries):
+        with zipfile.ZipFile(str(zipname), "w") as zf:
+            for name, data in entries:
+                zf.writestr(name, data)
+
+    def test_unsafe(self, tmp_path):
+        wh = tmp_path / "wh"
+        (wh / "seg").mkdir(parents=True)
+        manifest = json.dumps({"version": 1, "files": {
+            "ok.txt": "0" * 64, "../../pwned.txt": "0" * 64}})
+        zipname = tmp_path / "evil.zip"
+        self.writeZip(zipname, [("seg/" + MANIFEST, manifest),
+                                ("seg/ok.txt", "ok"),
+                                ("seg/../../pwned.txt", "pwned")])
+        with pytest.raises(ValueError):
+            importArchive(zipname, wh)
+        assert not (tmp_path / "pwned.txt").exists()
+        assert not (wh / "seg" / "ok.txt").exists()
+        # A manifest can't remove files outside the segment either.
+        (wh / "seg" / MANIFEST).write_text(json.dumps(
+            {"version": 1, "files": {"../../victim.txt": "0" * 64}}))
+        (tmp_path / "victim.txt").write_text("keep")
+        self.writeZip(zipname, [("seg/" + MANIFEST, json.dumps(
+            {"version": 1, "files": {}}))])
+        with pytest.raises(ValueError):
+            importArchive(zipname, wh)
+        assert (tmp_path / "victim.txt").read_text() == "keep"
+        # Without a manifest, nothing is extracted.
+        for names in (["seg/ok.txt", "/etc/pwned"], ["../pwned.txt"],
+                      ["seg/ok.txt", "other/x.txt"]):
+            self.writeZip(zipname, [(n, "x") for n in names])
+            with pytest.raises(ValueError):
+                importArchive(zipname, wh)
+            assert not (wh / "seg" / "ok.txt").exists()
+        assert Warehouse(wh).importSegment(zipname) is None
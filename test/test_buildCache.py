@@ -0,0 +1,120 @@
+from fashion.buildCache import mapIds
+from fashion.signature import RenderSignatures, templateKind
+from fashion.util import cd
+
+GEN_XFORM = '''
+def init(config, codeRegistry, verbose=False, tags=None):
+    codeRegistry.addXformObject(Gen(config))
+
+class Gen(object):
+    def __init__(self, config):
+        self.version = "1.0.0"
+        self.name = config.moduleName
+        self.tags = config.tags
+        self.inputKinds = ["local.item"]
+        self.outputKinds = ["fashion.core.output.file", "local.total"]
+
+    def execute(self, codeRegistry, verbose=False, tags=None):
+        mdb = codeRegistry.getService('fashion.prime.modelAccess')
+        gen = codeRegistry.getService('fashion.core.generate')
+        items = mdb.getByKind("local.item")
+        mdb.insert("local.total", {"value": sum(i.value for i in items)})
+        gen.generate({"items": items}, "list.txt", "out/list.txt")
+'''
+
+LOADER_XFORM = GEN_XFORM.replace(
+    '"out/list.txt")',
+    '"out/list.txt",\n                     FileSystemLoader("tpl"))').replace(
+    "def init(", "from jinja2 import FileSystemLoader\n\ndef init(")
+
+
+class TestBuildCache(object):
+
+    def makeProject(self, project, xform=GEN_XFORM):
+        '''Make a project which loads 3 model files and generates a list.'''
+        project.create({"gen": xform},
+                       "{% for i in items %}{{ i.name }}={{ i.value }}\n{% endfor %}",
+                       [project.loadItems, {"moduleName": "local.gen", "parameters": {}}],
+                       properties={"buildCache": "cache"})
+
+    def build(self, project, dbName):
+        '''Build with a new database, as a CI machine would.'''
+        pf = project.open(dbName)
+        r = pf.getRunway()
+        r.plan()
+        r.execute()
+        r.codeRegistry.shutdownAllServices()
+        return pf.db, r.buildCache
+
+    def test_restore(self, tmp_path, project):
+        with cd(tmp_path):
+            self.makeProject(project)
+            dba, cache = self.build(project, "ci1.json")
+            assert (cache.hits, cache.misses) == (0, 4)
+            dba.close()
+            out = tmp_path / "out" / "list.txt"
+            out.unlink()
+            dba, cache = self.build(project, "ci2.json")
+            assert (cache.hits, cache.misses) == (4, 0)
+            assert out.read_text() == "item1=1\nitem2=2\nitem3=3\n"
+            assert sorted(i["name"] for i in dba.table("local.item").all()) == \
+                ["item1", "item2", "item3"]
+            assert [t["value"] for t in dba.table("local.total").all()] == [6]
+            # The restored file's render signature is restored with it.
+            signatures = RenderSignatures(dba).load()
+            assert list(signatures) == [out.as_posix()]
+            assert len(dba.table(templateKind)) == 1
+            assert len(cache.kindHashes) == 2
+            contexts = {c["name"]: c for c in dba.table("fashion.prime.context").all()}
+            assert set(contexts["local.gen"]["search"]["local.item"]) == \
+                {i.doc_id for i in dba.table("local.item").all()}
+            dba.close()
+
+    def test_changedInput(self, tmp_path, project):
+        with cd(tmp_path):
+            self.makeProject(project)
+            self.build(project, "ci1.json")[0].close()
+            project.writeItem(2, 20)
+            dba, cache = self.build(project, "ci2.json")
+            # The changed file's loader and the generator execute again.
+            assert (cache.hits, cache.misses) == (2, 2)
+            assert (tmp_path / "out" / "list.txt").read_text() == \
+                "item1=1\nitem2=20\nitem3=3\n"
+            dba.close()
+            # A new file in the model directory invalidates its siblings.
+            project.writeItem(4, 4)
+            dba, cache = self.build(project, "ci3.json")
+            assert cache.hits == 0
+            dba.close()
+
+    def test_loaderTemplate(self, tmp_path, project):
+        with cd(tmp_path):
+            self.makeProject(project, LOADER_XFORM)
+            (tmp_path / "tpl").mkdir()
+            (tmp_path / "tpl" / "list.txt").write_text(
+                "{% for i in items %}{{ i.name }}\n{% endfor %}")
+            self.build(project, "ci1.json")[0].close()
+            dba, cache = self.build(project, "ci2.json")
+            assert (cache.hits, cache.misses) == (4, 0)
+            dba.close()
+            # A template outside the xform's template path is still keyed.
+            (tmp_path / "tpl" / "list.txt").write_text(
+                "{% for i in items %}{{ i.value }}\n{% endfor %}")
+            dba, cache = self.build(project, "ci3.json")
+            assert (cache.hits, cache.misses) == (3, 1)
+            assert (tmp_path / "out" / "list.txt").read_text() == "1\n2\n3\n"
+            dba.close()
+
+    def test_mapIds(self):
+        result = {
+            "writes": [
+                ["insert", "k", -1, {"a": 1}, [["i", 5]]],
+                ["insert", "fashion.prime.trace", -2,
+                 {"kind": "k", "id": -1, "inputs": [["i", 5]]}, None]],
+            "reads": {"i": [5, 6]}
+        }
+        mapped = mapIds(result, lambda kind, id: id if id < 0 else str(id))
+        assert mapped["writes"][0][4] == [["i", "5"]]
+        assert mapped["writes"][1][3] == {"kind": "k", "id": -1, "inputs": [["i", "5"]]}
+        assert mapped["reads"] == {"i": ["5", "6"]}
+        assert result["reads"] == {"i": [5, 6]}
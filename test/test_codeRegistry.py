@@ -0,0 +1,64 @@
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from munch import Munch
+
+from fashion.codeRegistry import CodeRegistry
+from fashion.databaseAccess import DatabaseAccess
+from fashion.modelAccess import ModelAccess, activeModelAccess
+from fashion.schema import SchemaRepository
+
+
+class TestCodeRegistry(object):
+
+    def makeRegistry(self, tmp_path):
+        registry = CodeRegistry(DatabaseAccess(tmp_path / "db.json"))
+        for version in ["1.0.0", "1.10.0", "1.2.0", "0.9.0"]:
+            assert registry.addService(Munch(name="svc", version=version))
+        return registry
+
+    def test_getService(self, tmp_path):
+        registry = self.makeRegistry(tmp_path)
+        assert registry.getService("svc").version == "1.10.0"
+        assert registry.getService("svc", ">1.5").version == "1.10.0"
+        assert registry.getService("svc", "<1.5").version == "1.2.0"
+        assert registry.getService("svc", "==1.0.0").version == "1.0.0"
+        assert registry.getService("svc", ">=3") is None
+        assert registry.getService("other") is None
+        assert not registry.addService(Munch(name="svc", version="1.2"))
+
+    def test_invalidate(self, tmp_path):
+        registry = self.makeRegistry(tmp_path)
+        assert registry.getService("svc", ">1.5").version == "1.10.0"
+        assert registry.getService("svc", ">=3") is None
+        assert registry.addService(Munch(name="svc", version="3.0.0"))
+        assert registry.getService("svc", ">=3").version == "3.0.0"
+        assert registry.getService("svc", ">1.5").version == "3.0.0"
+        assert registry.removeService("svc", "3.0.0")
+        assert registry.getService("svc", ">1.5").version == "1.10.0"
+        for version in ["1.0.0", "1.10.0", "1.2.0", "0.9.0"]:
+            assert registry.removeService("svc", version)
+        assert registry.getService("svc") is None
+        assert not registry.removeService("svc", "1.0.0")
+
+    def test_contextService(self, tmp_path):
+        dba = DatabaseAccess(tmp_path / "db.json")
+        registry = CodeRegistry(dba)
+        registry.addContextService(activeModelAccess)
+        name = "fashion.prime.modelAccess"
+        assert registry.getService(name) is None
+        barrier = threading.Barrier(2)
+
+        def run(ctxName):
+            ctx = Munch(name=ctxName, inputKinds=[], outputKinds=[])
+            with ModelAccess(dba, SchemaRepository(), ctx) as mdb:
+                # Both xforms hold their ModelAccess at once.
+                barrier.wait()
+                found = registry.getService(name)
+                barrier.wait()
+            return found is mdb and registry.getService(name) is None
+
+        with ThreadPoolExecutor(2) as pool:
+            assert all(pool.map(run, ["a", "b"]))
+        assert registry.getService(name) is None
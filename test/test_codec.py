@@ -0,0 +1,45 @@
+import math
+
+from munch import munchify
+
+from fashion import codec
+from fashion.codec import CodecStorage
+from fashion.modelView import ModelView
+
+
+class TestCodec(object):
+
+    def test_roundTrip(self):
+        obj = {"name": "m", "list": [1, 2.5, True, None], "child": {"x": "é"}}
+        assert codec.loads(codec.dumps(obj)) == obj
+        assert codec.loads(codec.dumps(obj, indent=4)) == obj
+        assert codec.loads(codec.dumps(munchify(obj), indent=2)) == obj
+
+    def test_options(self):
+        s = codec.dumps({"b": 1, "a": 2}, indent=4, sort_keys=True)
+        assert s.index('"a"') < s.index('"b"')
+        assert '\n    "a"' in s
+        assert codec.loads(codec.dumps({1: "one"})) == {"1": "one"}
+        assert codec.loads(codec.dumps(2 ** 70)) == 2 ** 70
+
+    def test_numbers(self):
+        big = [2 ** 64, -2 ** 63 - 1, 2 ** 70, 12345678901234567890123]
+        decoded = codec.loads(codec.dumps({"n": big}))
+        assert decoded == {"n": big}
+        assert all(isinstance(n, int) for n in decoded["n"])
+        assert codec.loads(b"[18446744073709551616]") == [2 ** 64]
+        decoded = codec.loads(codec.dumps({"x": [float("nan"), float("inf"), None]}))
+        assert math.isnan(decoded["x"][0])
+        assert decoded["x"][1:] == [float("inf"), None]
+        assert codec.loads('[NaN, -Infinity, 1.5]')[1:] == [float("-inf"), 1.5]
+
+    def test_views(self):
+        v = ModelView({"child": {"items": [1, 2]}})
+        assert codec.loads(codec.dumps({"v": v})) == {"v": v.toDict()}
+
+    def test_storage(self, tmp_path):
+        storage = CodecStorage(str(tmp_path / "db.json"))
+        assert storage.read() is None
+        storage.write({"kind": {1: {"n": 1}}})
+        assert storage.read() == {"kind": {"1": {"n": 1}}}
+        storage.close()
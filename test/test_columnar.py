@@ -0,0 +1,119 @@
+from tinydb import Query
+
+from fashion.columnar import ColumnTable, RowView, columnSpec
+from fashion.databaseAccess import DatabaseAccess
+from fashion.modelAccess import ModelAccess
+from fashion.schema import SchemaRepository
+
+registerSchema = {
+    "type": "object",
+    "properties": {
+        "name": {"type": "string"},
+        "address": {"type": "integer"},
+        "scale": {"type": "number"},
+        "readOnly": {"type": "boolean"}
+    }
+}
+
+
+class DummyContext(object):
+
+    def __init__(self):
+        self.name = "dummyContext"
+        self.inputKinds = ["dummy.register"]
+        self.outputKinds = ["dummy.register"]
+
+
+class TestColumnar(object):
+
+    def test_columnSpec(self):
+        spec = columnSpec(registerSchema)
+        assert spec["address"] == "integer"
+        assert spec["name"] == "string"
+        nested = {"type": "object", "properties": {"child": {"type": "object"}}}
+        assert columnSpec(nested) is None
+        assert columnSpec({"type": "array"}) is None
+
+    def test_table(self):
+        t = ColumnTable("dummy.register", columnSpec(registerSchema))
+        ids = t.insert_multiple([
+            {"name": "r{0}".format(i), "address": i * 4, "scale": 0.5,
+             "readOnly": i % 2 == 0} for i in range(10)])
+        odd = t.insert({"name": "odd", "address": "0x10", "extra": [1, 2]})
+        assert len(t) == 11
+        assert t.get(doc_id=ids[3]) == {
+            "name": "r3", "address": 12, "scale": 0.5, "readOnly": False}
+        assert t.get(doc_id=odd) == {
+            "name": "odd", "address": "0x10", "extra": [1, 2]}
+        assert t.select("address", ">=", 32) == ids[8:]
+        assert len(t.search(Query().readOnly == True)) == 5
+        t.remove(doc_ids=ids[:5])
+        assert len(t) == 6
+        assert t.get(doc_id=ids[0]) is None
+        assert t.get(doc_id=ids[5])["name"] == "r5"
+        v = t.view(ids[6])
+        assert isinstance(v, RowView)
+        assert v.name == "r6"
+        assert v.doc_id == ids[6]
+        assert v.toDict()["address"] == 24
+        # Views made before a removal still read their own rows.
+        views = t.views()
+        t.remove(doc_ids=[ids[5], ids[7]])
+        assert [r.name for r in views[1::2]] == ["r6", "r8", "odd"]
+        assert views[0].toDict() == {} and "name" not in views[2].toDict()
+
+    def test_bigNumbers(self):
+        t = ColumnTable("dummy.register", columnSpec(registerSchema))
+        first = t.insert({"name": "a", "address": 1})
+        big = t.insert({"name": "big", "address": 2 ** 64, "scale": 2 ** 60 + 1})
+        assert len(t) == 2
+        assert t.get(doc_id=big) == {"name": "big", "address": 2 ** 64,
+                                     "scale": 2 ** 60 + 1}
+        assert t.select("address", "<", 10) == [first]
+        # Columns are copies, so the table can still change.
+        col = t.column("address")
+        t.insert({"name": "c", "address": 3})
+        t.remove(doc_ids=[first])
+        assert list(col[:1]) == [1]
+        assert len(t.column("name")) == 2
+
+    def test_saveLoad(self, tmp_path):
+        spec = columnSpec(registerSchema)
+        t = ColumnTable("dummy.register", spec)
+        t.insert({"name": "a", "address": 1})
+        t.insert({"name": "b", "address": 2, "scale": 1.5, "other": "x"})
+        t.save(tmp_path)
+        t2 = ColumnTable.load(tmp_path, "dummy.register", spec)
+        assert t2.all() == t.all()
+        assert [d.doc_id for d in t2.all()] == [1, 2]
+        assert t2.insert({"name": "c"}) == 3
+
+    def test_databaseAccess(self, tmp_path):
+        dba = DatabaseAccess(tmp_path / "db.json")
+        dba.table("dummy.register").insert({"name": "old", "address": 0})
+        dba.setColumnar("dummy.register", columnSpec(registerSchema))
+        with ModelAccess(dba, SchemaRepository(), DummyContext()) as mdb:
+            mdb.insertMultiple("dummy.register",
+                               [{"name": "r1", "address": 4}])
+            regs = mdb.getByKind("dummy.register")
+            assert [r.name for r in regs] == ["old", "r1"]
+            assert mdb.getById("dummy.register", regs[1].doc_id).address == 4
+        dba.close()
+        dba = DatabaseAccess(tmp_path / "db.json")
+        dba.setColumnar("dummy.register", columnSpec(registerSchema))
+        assert "dummy.register" in dba.kinds()
+        assert len(dba.table("dummy.register").all()) == 2
+        # Re-entering the context removes the records it inserted.
+        with ModelAccess(dba, SchemaRepository(), DummyContext()) as mdb:
+            assert [r.name for r in mdb.getByKind("dummy.register")] == ["old"]
+        dba.close()
+
+    def test_sync(self, tmp_path):
+        dba = DatabaseAccess(tmp_path / "db.json", journal=True)
+        table = dba.setColumnar("dummy.register", columnSpec(registerSchema))
+        table.insert({"name": "r1", "address": 4})
+        dba.sync()
+        assert not table.modified
+        saved = ColumnTable.load(dba.columnDir, "dummy.register", table.spec)
+        assert saved.all() == table.all()
+        dba.close()
@@ -0,0 +1,134 @@
+import pytest
+from tinydb import Query
+
+from fashion.distribute import Coordinator, parseAddress, serve
+from fashion.events import FILE_GENERATED, XFORM_FINISHED, XFORM_STARTED, bus
+from fashion.renderCache import RenderCache
+from fashion.util import cd
+
+GEN_XFORM = '''
+def init(config, codeRegistry, verbose=False, tags=None):
+    codeRegistry.addXformObject(Gen(config))
+
+class Gen(object):
+    def __init__(self, config):
+        self.version = "1.0.0"
+        self.name = config.moduleName
+        self.tags = config.tags
+        self.inputKinds = ["local.item"]
+        self.outputKinds = ["fashion.core.output.file"]
+
+    def execute(self, codeRegistry, verbose=False, tags=None):
+        mdb = codeRegistry.getService('fashion.prime.modelAccess')
+        gen = codeRegistry.getService('fashion.core.generate')
+        items = sorted(mdb.getByKind("local.item"), key=lambda i: i.value)
+        gen.generate({"items": items}, "list.txt", "out/list.txt")
+'''
+
+FAIL_XFORM = GEN_XFORM.replace(
+    "        mdb = codeRegistry.getService",
+    "        if os.path.exists('fail'):\n"
+    "            raise ValueError('failed')\n"
+    "        mdb = codeRegistry.getService", 1).replace(
+    "def init(", "import os\n\ndef init(")
+
+
+class TestDistribute(object):
+
+    def makeProject(self, project, xform=GEN_XFORM):
+        '''Make a project which loads 3 model files and generates a list.'''
+        project.create({"gen": xform},
+                       "{% for i in items %}{{ i.name }}={{ i.value }}\n{% endfor %}",
+                       [project.loadItems, {"moduleName": "local.gen", "parameters": {}}])
+        return project.open()
+
+    @pytest.mark.parametrize("remote", [False, True])
+    def test_distributed(self, tmp_path, project, remote):
+        seen = []
+
+        def collect(event, *args):
+            seen.append((event, args[0].name) + args[1:])
+        with cd(tmp_path):
+            pf = self.makeProject(project)
+            r = pf.getRunway()
+            r.plan()
+            coordinator = Coordinator(r)
+            try:
+                coordinator.startLocal(2)
+                coordinator.accept(2)
+                assert len(coordinator.workers) == 2
+                if remote:
+                    # Send the snapshots' contents, as to another host.
+                    for conn in coordinator.workers:
+                        coordinator.hosts[conn] = "elsewhere"
+                for event in (XFORM_STARTED, XFORM_FINISHED, FILE_GENERATED):
+                    bus.subscribe(event, collect)
+                coordinator.run()
+            finally:
+                for event in (XFORM_STARTED, XFORM_FINISHED, FILE_GENERATED):
+                    bus.unsubscribe(event, collect)
+                coordinator.close()
+            started = [e[1] for e in seen if e[0] == XFORM_STARTED]
+            assert len(started) == 4 and started[-1] == "local.gen"
+            assert sorted(e[1:] for e in seen if e[0] == XFORM_FINISHED) == \
+                sorted((name, None) for name in started)
+            assert seen[-2:] == [(FILE_GENERATED, "list.txt"),
+                                 (XFORM_FINISHED, "local.gen", None)]
+            assert (tmp_path / "out" / "list.txt").read_text() == \
+                "item1=1\nitem2=2\nitem3=3\n"
+            items = pf.db.table("local.item").all()
+            assert sorted(i["name"] for i in items) == ["item1", "item2", "item3"]
+            assert len(pf.db.table("fashion.core.generate.signature")) == 1
+            # The workers rendered through the project's render cache.
+            assert len(list(RenderCache(RenderCache.path(pf.db)).entries())) == 1
+            r.codeRegistry.shutdownAllServices()
+            pf.db.close()
+
+    def test_noWorkers(self, tmp_path, project):
+        '''Without workers, the coordinator executes the xforms itself.'''
+        with cd(tmp_path):
+            pf = self.makeProject(project)
+            r = pf.getRunway()
+            r.plan()
+            coordinator = Coordinator(r)
+            try:
+                coordinator.run()
+            finally:
+                coordinator.close()
+            assert (tmp_path / "out" / "list.txt").read_text() == \
+                "item1=1\nitem2=2\nitem3=3\n"
+            r.codeRegistry.shutdownAllServices()
+            pf.db.close()
+
+    def test_failure(self, tmp_path, project):
+        '''A failed xform's records are reset, as in a local build.'''
+        with cd(tmp_path):
+            pf = self.makeProject(project, FAIL_XFORM)
+            r = pf.getRunway()
+            r.plan()
+            r.execute()
+            Output = Query()
+            outputs = pf.db.table("fashion.core.output.file")
+            assert outputs.search(Output.contextName == "local.gen")
+            (tmp_path / "fail").write_text("")
+            r.plan()
+            coordinator = Coordinator(r)
+            try:
+                coordinator.startLocal(1)
+                coordinator.accept(1)
+                coordinator.run()
+            finally:
+                coordinator.close()
+            assert not outputs.search(Output.contextName == "local.gen")
+            r.codeRegistry.shutdownAllServices()
+            pf.db.close()
+
+    def test_parseAddress(self):
+        assert parseAddress("example.com:9000") == ("example.com", 9000)
+        assert parseAddress(":9000") == ("localhost", 9000)
+        assert parseAddress("9000") == ("localhost", 9000)
+
+    def test_noKey(self, monkeypatch):
+        monkeypatch.delenv("FASHION_AUTHKEY", raising=False)
+        # Returns at once, rather than failing to authenticate.
+        assert serve(("localhost", 1)) is None
@@ -0,0 +1,98 @@
+from fashion.events import (EVENTS, FILE_GENERATED, MODEL_INSERTED, XFORM_FINISHED,
+                            EventBus, bus)
+from fashion.util import cd
+
+GEN_XFORM = '''
+def init(config, codeRegistry, verbose=False, tags=None):
+    codeRegistry.addXformObject(Gen(config))
+
+class Gen(object):
+    def __init__(self, config):
+        self.version = "1.0.0"
+        self.name = config.moduleName
+        self.tags = config.tags
+        self.inputKinds = []
+        self.outputKinds = ["fashion.core.output.file", "local.item"]
+
+    def execute(self, codeRegistry, verbose=False, tags=None):
+        mdb = codeRegistry.getService('fashion.prime.modelAccess')
+        gen = codeRegistry.getService('fashion.core.generate')
+        mdb.insertMultiple("local.item", [{"name": "a"}, {"name": "b"}])
+        gen.generate({"items": mdb.getByKind("local.item")}, "list.txt", "out/list.txt")
+'''
+
+MONITOR = '''
+def onXformFinished(event, record, error):
+    with open("events.log", "a") as fd:
+        fd.write("{0} {1} {2}\\n".format(event, record.name, error))
+'''
+
+
+class TestEvents(object):
+
+    def test_subscribe(self):
+        events = EventBus()
+        seen = []
+
+        def handler(event, *args):
+            seen.append((event,) + args)
+        assert events.subscribe(XFORM_FINISHED, handler)
+        assert not events.subscribe("no.such.event", handler)
+        events.emit(XFORM_FINISHED, "x", None)
+        events.emit(FILE_GENERATED, "f")
+        assert seen == [(XFORM_FINISHED, "x", None)]
+        events.unsubscribe(XFORM_FINISHED, handler)
+        events.emit(XFORM_FINISHED, "y", None)
+        assert len(seen) == 1
+        assert all(events.handlers[e] == () for e in EVENTS)
+
+    def test_keyed(self):
+        events = EventBus()
+        seen = []
+
+        def failing(event, *args):
+            raise ValueError("broken handler")
+        events.subscribe(FILE_GENERATED, lambda e, f: seen.append(1), "key")
+        events.subscribe(FILE_GENERATED, lambda e, f: seen.append(2), "key")
+        events.subscribe(FILE_GENERATED, failing)
+        events.emit(FILE_GENERATED, "f")
+        assert seen == [2]
+        # Shutdown only removes the keyed handlers.
+        events.shutdown()
+        assert events.handlers[FILE_GENERATED] == (failing,)
+
+    def makeProject(self, project):
+        project.create({"gen": GEN_XFORM, "monitor": MONITOR},
+                       "{% for i in items %}{{ i.name }}\n{% endfor %}",
+                       [{"moduleName": "local.gen", "parameters": {}}],
+                       eventHandlers=[{"event": XFORM_FINISHED, "moduleName": "local.monitor",
+                                       "function": "onXformFinished"}],
+                       items=0)
+        return project.open()
+
+    def test_build(self, tmp_path, project):
+        seen = []
+
+        def collect(event, *args):
+            seen.append(event)
+        for event in EVENTS:
+            bus.subscribe(event, collect)
+        try:
+            with cd(tmp_path):
+                pf = self.makeProject(project)
+                r = pf.getRunway()
+                assert r.codeRegistry.getService('fashion.prime.events') is bus
+                r.plan()
+                r.execute()
+                r.codeRegistry.shutdownAllServices()
+                pf.db.close()
+        finally:
+            for event in EVENTS:
+                bus.unsubscribe(event, collect)
+        assert set(seen) == set(EVENTS)
+        assert seen.count(MODEL_INSERTED) >= 2
+        assert seen.index("plan.ready") < seen.index("xform.started")
+        assert (tmp_path / "events.log").read_text() == "xform.finished local.gen None\n"
+        # The segment's handler was removed when the services shut down.
+        assert all(h is not collect for h in bus.handlers[XFORM_FINISHED])
+        assert bus.keyed == {}
@@ -0,0 +1,73 @@
+import json
+import os
+
+from tinydb import Query
+
+from fashion.databaseAccess import DatabaseAccess
+from fashion.journal import JournalStorage, openJournaled
+
+
+def openDb(path, **kwargs):
+    return openJournaled(str(path), **kwargs)[0]
+
+
+class TestJournal(object):
+
+    def test_replay(self, tmp_path):
+        dbPath = tmp_path / "db.json"
+        db = openDb(dbPath)
+        t = db.table("kind1")
+        ids = t.insert_multiple([{"n": i} for i in range(5)])
+        t.remove(doc_ids=ids[:2])
+        t.update({"x": True}, Query().n == 4)
+        db.table("kind2").insert({"n": 10})
+        db.table("kind3")
+        db.purge_table("kind2")
+        db.close()
+        # Nothing but the empty snapshot and the journal was written.
+        assert os.path.getsize(str(dbPath)) == 0
+        db = openDb(dbPath)
+        assert sorted(d["n"] for d in db.table("kind1").all()) == [2, 3, 4]
+        assert db.table("kind1").get(Query().n == 4)["x"] == True
+        assert "kind2" not in db.tables()
+        assert "kind3" in db.tables()
+        # doc_ids continue after the replayed ones
+        assert db.table("kind1").insert({"n": 5}) == 6
+        db.close()
+
+    def test_compact(self, tmp_path):
+        dbPath = tmp_path / "db.json"
+        db, storage = openJournaled(str(dbPath), threshold=100)
+        assert isinstance(storage, JournalStorage)
+        db.table("kind1").insert_multiple([{"n": i} for i in range(20)])
+        db.close()
+        assert os.path.getsize(str(dbPath) + ".journal") == 0
+        assert not os.path.exists(str(dbPath) + ".compacting")
+        with dbPath.open() as fd:
+            assert len(json.load(fd)["kind1"]) == 20
+        db = openDb(dbPath)
+        assert len(db.table("kind1")) == 20
+        db.close()
+
+    def test_partialEntry(self, tmp_path):
+        dbPath = tmp_path / "db.json"
+        db = openDb(dbPath)
+        db.table("kind1").insert({"n": 1})
+        db.close()
+        with open(str(dbPath) + ".journal", mode="a") as fd:
+            fd.write('["put", "kind1", 2, {"n"')
+        db = openDb(dbPath)
+        assert len(db.table("kind1")) == 1
+        db.close()
+
+    def test_databaseAccess(self, tmp_path):
+        dba = DatabaseAccess(tmp_path / "db.json", journal=True)
+        dba.setSingleton("kind1", {"n": 1})
+        dba.sync()
+        dba.setSingleton("kind1", {"n": 2})
+        dba.compact()
+        dba.close()
+        dba = DatabaseAccess(tmp_path / "db.json", journal=True)
+        assert dba.getSingleton("kind1")["n"] == 2
+        assert "kind1" in dba.kinds()
+        dba.close()
@@ -93,4 +93,22 @@ class TestModelAccess(object):
             assert m is not None
             assert len(m) == 1
             assert m[0]["name"] == "dummy model"
+            assert m[0].name == "dummy model"
+            assert m[0].doc_id == id
+        dba.close()
+
+    def test_insertMultiple(self, tmp_path):
+        '''Test inserting models in bulk.'''
+        dba = DatabaseAccess(tmp_path / "db.json")
+        d = DummyContextOut()
+        schemaRepo = SchemaRepository()
+        with ModelAccess(dba, schemaRepo, d) as mdb:
+            ids = mdb.insertMultiple("dummy.output",
+                                     [{"name": "one"}, {"name": "two"}])
+            assert len(ids) == 2
+            ids = mdb.insertMultiple("dummy.input", [{"name": "three"}])
+            assert ids == []
+        ctxs = dba.table('fashion.prime.context').all()
+        assert len(ctxs[0]["insert"]['dummy.output']) == 2
+        assert len(dba.table('dummy.output').all()) == 2
         dba.close()
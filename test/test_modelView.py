@@ -0,0 +1,53 @@
+import json
+
+import pytest
+
+from fashion.modelView import ListView, ModelView, plain
+
+
+class TestModelView(object):
+
+    def test_access(self):
+        data = {"name": "m", "child": {"items": [1, {"x": 2}]}}
+        v = ModelView(data, 3, "dummy.kind")
+        assert v.doc_id == 3
+        assert v.kind == "dummy.kind"
+        assert v.name == "m"
+        assert v["name"] == "m"
+        assert isinstance(v.child, ModelView)
+        assert isinstance(v.child["items"], ListView)
+        assert v.child["items"][1].x == 2
+        assert v == data
+        assert dict(v)["name"] == "m"
+        with pytest.raises(AttributeError):
+            v.missing
+
+    def test_fieldNames(self):
+        # Model fields named like the record's metadata aren't shadowed.
+        v = ModelView({"kind": "cat", "doc_id": "d7"}, 3, "dummy.kind")
+        assert (v.kind, v.doc_id) == ("cat", "d7")
+        assert (v._kind, v._doc_id) == ("dummy.kind", 3)
+
+    def test_readOnly(self):
+        v = ModelView({"name": "m"})
+        with pytest.raises(TypeError):
+            v.name = "changed"
+        with pytest.raises(TypeError):
+            v["name"] = "changed"
+
+    def test_noCopy(self):
+        data = {"child": {"name": "m"}}
+        v = ModelView(data)
+        data["child"]["name"] = "changed"
+        assert v.child.name == "changed"
+
+    def test_plain(self):
+        data = {"child": {"name": "m"}}
+        v = ModelView(data)
+        d = v.toDict()
+        d["child"]["name"] = "changed"
+        assert data["child"]["name"] == "m"
+        p = plain({"view": v, "list": [ModelView({"a": 1})]})
+        assert json.loads(json.dumps(p)) == {"view": data, "list": [{"a": 1}]}
+        unchanged = {"a": [1, 2]}
+        assert plain(unchanged) is unchanged
@@ -0,0 +1,89 @@
+from fashion import provenance
+from fashion.databaseAccess import DatabaseAccess
+from fashion.modelAccess import ModelAccess
+from fashion.provenance import (ProvenanceGraph, fileNode, indexProvenance,
+                                loadProvenance, modelNode)
+from fashion.schema import SchemaRepository
+
+
+class DummyContext(object):
+
+    def __init__(self, name, inputKinds, outputKinds):
+        self.name = name
+        self.inputKinds = inputKinds
+        self.outputKinds = outputKinds
+
+
+class TestProvenance(object):
+
+    def makeDb(self, tmp_path):
+        '''load::a.json and load::b.json read a.json and b.json, xlate traces, gen writes out.txt.'''
+        dba = DatabaseAccess(tmp_path / "db.json")
+        repo = SchemaRepository()
+        for fn in ["a.json", "b.json"]:
+            load = DummyContext("load::" + fn, [],
+                                ["fashion.core.input.file", "k1"])
+            with ModelAccess(dba, repo, load) as mdb:
+                mdb.inputFile(tmp_path / fn)
+                mdb.insert("k1", {"fn": fn})
+        xlate = DummyContext("xlate", ["k1"], ["k2", "fashion.prime.trace"])
+        with ModelAccess(dba, repo, xlate) as mdb:
+            for m in mdb.getByKind("k1"):
+                mdb.insert("k2", {"fn": m.fn}, [["k1", m.doc_id]])
+        gen = DummyContext("gen", ["k2"], ["fashion.core.output.file"])
+        with ModelAccess(dba, repo, gen) as mdb:
+            mdb.getById("k2", 1)
+            mdb.outputFile(tmp_path / "out.txt")
+        return dba
+
+    def test_why(self, tmp_path):
+        dba = self.makeDb(tmp_path)
+        graph = indexProvenance(dba)
+        r = graph.why(fileNode(tmp_path / "out.txt"))
+        # xlate read both k1 models to make k2:1.
+        assert r.xforms == ["gen", "load::a.json", "load::b.json", "xlate"]
+        assert r.models == ["k1:1", "k1:2", "k2:1"]
+        assert r.files == [(tmp_path / "a.json").as_posix(),
+                           (tmp_path / "b.json").as_posix()]
+        # Traced models come from their xform and their trace inputs.
+        k2 = graph.find(modelNode("k2", 2))
+        start, edges = graph.rev
+        assert sorted(graph.nodes[i] for i in edges[start[k2]:start[k2 + 1]]) == \
+            [modelNode("k1", 2), "x xlate"]
+        assert graph.why(fileNode(tmp_path / "nope.txt")) is None
+        dba.close()
+
+    def test_impact(self, tmp_path):
+        dba = self.makeDb(tmp_path)
+        indexProvenance(dba)
+        graph = ProvenanceGraph.load(ProvenanceGraph.path(dba))
+        r = graph.impact(fileNode(tmp_path / "a.json"))
+        assert r.files == [(tmp_path / "out.txt").as_posix()]
+        assert r.xforms == ["gen", "load::a.json", "xlate"]
+        r = graph.impact(fileNode(tmp_path / "b.json"))
+        assert r.files == [(tmp_path / "out.txt").as_posix()]
+        assert r.models == ["k1:2", "k2:1", "k2:2"]
+        dba.close()
+
+    def test_unchanged(self, tmp_path, monkeypatch):
+        dba = self.makeDb(tmp_path)
+        assert indexProvenance(dba) is not None
+        # Nothing changed, so the saved graph is kept.
+        assert indexProvenance(dba) is None
+        ctx = DummyContext("load::c.json", [], ["fashion.core.input.file", "k1"])
+        with ModelAccess(dba, SchemaRepository(), ctx) as mdb:
+            mdb.inputFile(tmp_path / "c.json")
+        graph = indexProvenance(dba)
+        assert graph.find(fileNode(tmp_path / "c.json")) is not None
+        # Queries compare the stamp, without reading the provenance records.
+        monkeypatch.setattr(provenance, "provenanceDigest", None)
+        assert loadProvenance(dba).find(fileNode(tmp_path / "c.json")) is not None
+        dba.close()
+
+    def test_loadBuilds(self, tmp_path):
+        dba = self.makeDb(tmp_path)
+        assert not ProvenanceGraph.path(dba).exists()
+        graph = loadProvenance(dba)
+        assert ProvenanceGraph.path(dba).exists()
+        assert graph.find(modelNode("k1", 1)) is not None
+        dba.close()
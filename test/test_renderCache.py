@@ -0,0 +1,47 @@
+import os
+
+from fashion.renderCache import RenderCache
+
+
+class TestRenderCache(object):
+
+    def test_getPut(self, tmp_path):
+        cache = RenderCache(tmp_path / "cache")
+        target = tmp_path / "out.txt"
+        assert cache.get("ab12") is None
+        target.write_text("rendered")
+        cache.put("ab12", target)
+        cached = cache.get("ab12")
+        assert cached.read_text() == "rendered"
+        assert not cache.restore(cached, target)
+        target.write_text("edited")
+        assert cache.restore(cached, target)
+        assert target.read_text() == "rendered"
+        target.unlink()
+        assert cache.restore(cached, target)
+        assert (cache.hits, cache.misses) == (1, 1)
+        assert cache.stats() == "render cache: 1 hits, 1 misses"
+
+    def test_evict(self, tmp_path):
+        cache = RenderCache(tmp_path / "cache", maxBytes=250)
+        src = tmp_path / "src.txt"
+        src.write_text("x" * 100)
+        for i, key in enumerate(["aa01", "bb02"]):
+            cache.put(key, src)
+            os.utime(str(cache.entry(key)), ns=(i * 10**9, i * 10**9))
+        # Using the oldest entry makes the other the least recently used.
+        assert cache.get("aa01") is not None
+        cache.put("cc03", src)
+        assert cache.get("bb02") is None
+        assert cache.get("aa01") is not None
+        assert cache.get("cc03") is not None
+        assert cache.size == 200
+        # A new cache finds the size of the existing entries.
+        cache = RenderCache(tmp_path / "cache", maxBytes=250)
+        cache.put("dd04", src)
+        assert len(cache.entries()) == 2
+        # A file too big for the cache isn't copied, nor evicts anything.
+        src.write_text("x" * 300)
+        cache.put("ee05", src)
+        assert not cache.entry("ee05").exists()
+        assert len(cache.entries()) == 2
@@ -1,3 +1,5 @@
+from pathlib import Path
+
 from fashion.databaseAccess import DatabaseAccess
 from fashion.modelAccess import ModelAccess
 from fashion.portfolio import FASHION_WAREHOUSE_PATH
@@ -17,6 +19,14 @@ class DummyXform(object):
     def execute(self, mdb, codeRegistry, tags=None):
         self.executed = True
 
+class ItemContext(object):
+
+    def __init__(self):
+        self.name = "items"
+        self.inputKinds = []
+        self.outputKinds = ["local.item"]
+
+
 class TestRunway(object):
 
     def test_create(self, tmp_path):
@@ -34,6 +44,40 @@ class TestRunway(object):
         wh.loadSegments(dba)
         r = Runway(dba, wh)
         r.loadSchemas()
+        kind = "fashion.core.generate.jinja2.spec"
+        assert r.schemaRepo.exists(kind)
+        # Schemas are only read when first used.
+        assert r.schemaRepo.schemaByKind[kind]._jsonschema is None
+        r.schemaRepo.validate(kind, {})
+        assert r.schemaRepo.schemaByKind[kind]._jsonschema is not None
+        assert len(list((tmp_path / "db.schemas").iterdir())) == 1
+
+    def test_validation(self, tmp_path):
+        dba = DatabaseAccess(tmp_path / "db.json")
+        wh = Warehouse(tmp_path)
+        wh.newSegment("local", dba)
+        seg = wh.loadSegment("local", dba)
+        seg.createSchema("local.item", {"type": "object", "required": ["name"]})
+        seg.createSchema("local.reg", {"type": "object", "properties": {
+            "address": {"type": "integer"}}})
+        seg.findSchema("local.reg")["storage"] = "columnar"
+        seg.save()
+        wh.loadSegments(dba)
+        r = Runway(dba, wh)
+        # Builds don't validate models, as Portfolio.getRunway only loads
+        # the storage settings of schemas.
+        r.loadStorage()
+        assert dba.isColumnar("local.reg")
+        assert r.schemaRepo.schemaByKind == {}
+        with ModelAccess(dba, r.schemaRepo, ItemContext()) as mdb:
+            assert mdb.insert("local.item", {}) is not None
+        # With schemas loaded, an invalid model is logged and not inserted.
+        r.loadSchemas()
+        with ModelAccess(dba, r.schemaRepo, ItemContext()) as mdb:
+            assert mdb.insert("local.item", {}) is None
+            assert mdb.insert("local.item", {"name": "a"}) is not None
+        assert [i["name"] for i in dba.table("local.item").all()] == ["a"]
+        dba.close()
 
     def test_loadModules(self, tmp_path):
         dba = DatabaseAccess(tmp_path / "db.json")
@@ -57,6 +101,52 @@ class TestRunway(object):
         r.initModules()
         r.plan()
         r.execute()
+        assert set(r.records) == set(r.execList)
+        for record in r.records.values():
+            assert record.loader is not None
+            assert all(Path(p).is_absolute() for p in record.templatePath)
+
+    def makeChain(self, tmp_path):
+        '''Make a Runway with a chain of dummy xforms: load -> xlate -> gen.'''
+        dba = DatabaseAccess(tmp_path / "db.json")
+        r = Runway(dba, Warehouse(tmp_path))
+        for name, inKinds, outKinds in [
+                ("load", [], ["kind1"]),
+                ("other", [], ["kind3"]),
+                ("xlate", ["kind1"], ["kind2"]),
+                ("gen", ["kind2"], ["fashion.core.output.file"])]:
+            xf = DummyXform(None, r.codeRegistry)
+            xf.name = name
+            xf.inputKinds = inKinds
+            xf.outputKinds = outKinds
+            r.codeRegistry.xformObjectsByName[name] = xf
+        return r
+
+    def test_planTargetKind(self, tmp_path):
+        r = self.makeChain(tmp_path)
+        r.plan(["kind2"])
+        assert r.execList == ["load", "xlate"]
+        assert r.waves == [{"load"}, {"xlate"}]
+        assert "kind1" in r.waveInputKinds(1)
+
+    def test_planTargetFile(self, tmp_path):
+        r = self.makeChain(tmp_path)
+        target = tmp_path / "out.txt"
+        r.dba.table('fashion.core.output.file').insert(
+            {"contextName": "gen", "filename": target.as_posix()})
+        assert r.plan([target.as_posix()])
+        assert r.execList == ["load", "xlate", "gen"]
+        # Relative filenames are relative to the given directory.
+        assert r.plan(["out.txt"], tmp_path)
+        assert r.execList == ["load", "xlate", "gen"]
+        assert not r.plan(["out.txt"], tmp_path / "elsewhere")
+
+    def test_planTargetUnknown(self, tmp_path):
+        r = self.makeChain(tmp_path)
+        r.plan()
+        assert len(r.execList) == 4
+        assert r.focus(["no.such.kind"]) == False
+        assert r.execList == []
 
     # def test_noPlan(self, tmp_path):
     #     s = Schedule()
@@ -100,3 +190,26 @@ class TestRunway(object):
     #     s.execute(dba, schemaRepo)
     #     assert x1.executed == True
     #     assert x2.executed == True
+
+    def test_collectGarbage(self, tmp_path):
+        r = self.makeChain(tmp_path)
+        dba = r.dba
+        kind1 = dba.table("kind1")
+        liveId = kind1.insert({"name": "live"})
+        deadId = kind1.insert({"name": "dead"})
+        orphanId = kind1.insert({"name": "orphan"})
+        ctxs = dba.table("fashion.prime.context")
+        ctxs.insert({"name": "load", "insert": {"kind1": [liveId]}})
+        ctxs.insert({"name": "gone", "insert": {"kind1": [deadId]}})
+        dba.setSingleton("fashion.prime.args", {"verbose": False})
+        r.plan()
+        report = r.collectGarbage(dryRun=True)
+        assert report.contexts == ["gone"]
+        assert report.records == {"kind1": 2}
+        assert len(kind1.all()) == 3
+        report = r.collectGarbage()
+        assert [m["name"] for m in kind1.all()] == ["live"]
+        assert [c["name"] for c in ctxs.all()] == ["load"]
+        assert dba.getSingleton("fashion.prime.args") is not None
+        assert report.sizeAfter is not None
+        dba.close()
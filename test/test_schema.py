@@ -0,0 +1,154 @@
+import pytest
+
+from jsonschema import Draft4Validator, SchemaError, ValidationError
+from munch import Munch
+
+from fashion import codec
+from fashion.schema import SchemaRepository, compileSchema
+
+# Schemas and instances for checking compiled validators agree with jsonschema.
+conformance = [
+    ({"type": "object"},
+     [{}, {"a": 1}, [], "x", 1, None, True]),
+    ({"type": ["string", "null"]},
+     ["", "x", None, 1, False, {}]),
+    ({"type": "integer", "minimum": 1, "maximum": 10},
+     [0, 1, 10, 11, 1.5, 5.0, True, "5"]),
+    ({"type": "number", "minimum": 0, "exclusiveMinimum": True,
+      "maximum": 1, "exclusiveMaximum": True},
+     [0, 0.0, 0.5, 1, 1.0, -1, False]),
+    ({"maximum": 3},
+     [2, 4, "abcdef", None]),
+    ({"type": "boolean"},
+     [True, False, 0, 1, None]),
+    ({"enum": ["a", 1, None, [1, 2]]},
+     ["a", "b", 1, True, 1.0, None, [1, 2], [2, 1], {}]),
+    ({"type": "string", "minLength": 2, "maxLength": 4, "pattern": "^[a-z]+$"},
+     ["a", "ab", "abcd", "abcde", "AB", "ab1", 12]),
+    ({"pattern": "x"},
+     ["axb", "ab", 5]),
+    ({"type": "array", "minItems": 1, "maxItems": 2,
+      "items": {"type": "integer"}},
+     [[], [1], [1, 2], [1, 2, 3], [1, "2"], [True], {}]),
+    ({"items": {"type": "string"}},
+     [["a"], [1], "abc", {"a": 1}]),
+    ({"type": "object", "required": ["name"],
+      "properties": {"name": {"type": "string"},
+                     "size": {"type": "integer", "minimum": 0}},
+      "additionalProperties": False},
+     [{"name": "a"}, {}, {"name": 1}, {"name": "a", "size": -1},
+      {"name": "a", "size": 3}, {"name": "a", "other": 1}, []]),
+    ({"type": "object", "minProperties": 1, "maxProperties": 2,
+      "additionalProperties": {"type": "number"}},
+     [{}, {"a": 1}, {"a": 1, "b": 2}, {"a": 1, "b": 2, "c": 3}, {"a": "x"}]),
+    ({"required": ["a"], "properties": {"a": {"properties": {
+        "b": {"type": "array", "items": {"enum": [1, 2]}}}}}},
+     [{"a": {}}, {}, {"a": {"b": [1, 2]}}, {"a": {"b": [3]}}, 7]),
+    ({"title": "annotations", "description": "x", "default": {},
+      "$schema": "http://json-schema.org/draft-04/schema#",
+      "type": "object"},
+     [{}, []]),
+]
+
+
+class TestSchema(object):
+
+    @pytest.mark.parametrize("schema,instances", conformance)
+    def test_conformance(self, schema, instances):
+        validator = compileSchema(schema)
+        assert validator is not None
+        reference = Draft4Validator(schema)
+        for instance in instances:
+            try:
+                validator(instance)
+                valid = True
+            except ValidationError:
+                valid = False
+            assert valid == reference.is_valid(instance), codec.dumps(
+                [schema, instance])
+
+    def test_requiredMessage(self):
+        schema = {"type": "object", "required": ["name", "it's"]}
+        validator = compileSchema(schema)
+        for instance in [{}, {"name": "a"}]:
+            with pytest.raises(ValidationError) as e:
+                validator(instance)
+            expected = next(Draft4Validator(schema).iter_errors(instance)).message
+            assert e.value.message == expected
+
+    def test_draft3(self, tmp_path):
+        schema = {"$schema": "http://json-schema.org/draft-03/schema#",
+                  "properties": {"a": {"required": True}}}
+        repo = self.makeRepo(tmp_path, schema, False)
+        # Validated with the draft 3 validator, where required is a boolean.
+        repo.validate("dummy.kind", {"a": 1})
+        with pytest.raises(ValidationError):
+            repo.validate("dummy.kind", {})
+
+    def test_unsupported(self):
+        assert compileSchema({"anyOf": [{"type": "string"}]}) is None
+        assert compileSchema({"properties": {"a": {"$ref": "#/x"}}}) is None
+        assert compileSchema({"items": [{"type": "string"}]}) is None
+        assert compileSchema({"type": "any"}) is None
+        assert compileSchema(
+            {"$schema": "http://json-schema.org/draft-03/schema#"}) is None
+
+    def makeRepo(self, tmp_path, schema, compile):
+        fn = tmp_path / "schema.json"
+        fn.write_text(codec.dumps(schema))
+        repo = SchemaRepository()
+        repo.addFromDescription(
+            Munch(kind="dummy.kind", filename=fn.as_posix(), compile=compile))
+        return repo
+
+    @pytest.mark.parametrize("compile", [True, False])
+    def test_repository(self, tmp_path, compile):
+        repo = self.makeRepo(tmp_path, {"type": "object", "required": ["a"]},
+                             compile)
+        repo.validate("dummy.kind", {"a": 1})
+        with pytest.raises(ValidationError):
+            repo.validate("dummy.kind", {"b": 1})
+        validator = repo.schemaByKind["dummy.kind"].getValidator()
+        assert hasattr(validator, "source") == compile
+        repo.validate("other.kind", {})
+
+    def test_badSchema(self, tmp_path):
+        repo = self.makeRepo(tmp_path, {"type": 5}, True)
+        with pytest.raises(SchemaError):
+            repo.schemaByKind["dummy.kind"].validate({})
+        repo.validate("dummy.kind", {})
+        assert not repo.exists("dummy.kind")
+
+    def test_lazy(self, tmp_path):
+        repo = self.makeRepo(tmp_path, {"type": "object"}, False)
+        schema = repo.schemaByKind["dummy.kind"]
+        assert schema._jsonschema is None
+        repo.validate("dummy.kind", {})
+        assert schema._jsonschema == {"type": "object"}
+        repo.addFromDescription(
+            Munch(kind="missing.kind", filename=(tmp_path / "no.json").as_posix()))
+        assert not repo.exists("missing.kind")
+
+    def test_cache(self, tmp_path):
+        fn = tmp_path / "schema.json"
+        fn.write_text(codec.dumps({"type": "object", "required": ["a"]}))
+        cfg = Munch(kind="dummy.kind", filename=fn.as_posix(), compile=True)
+        cacheDir = tmp_path / "cache"
+        repo = SchemaRepository(cacheDir)
+        repo.addFromDescription(cfg)
+        repo.validate("dummy.kind", {"a": 1})
+        assert len(list(cacheDir.iterdir())) == 1
+        # A later run uses the cached, compiled schema.
+        repo = SchemaRepository(cacheDir)
+        repo.addFromDescription(cfg)
+        schema = repo.schemaByKind["dummy.kind"]
+        assert schema.jsonschema == {"type": "object", "required": ["a"]}
+        assert schema.cached["source"] is not None
+        with pytest.raises(ValidationError):
+            repo.validate("dummy.kind", {})
+        # A changed schema file gets a new cache entry.
+        fn.write_text(codec.dumps({"type": "object"}))
+        repo = SchemaRepository(cacheDir)
+        repo.addFromDescription(cfg)
+        repo.validate("dummy.kind", {})
+        assert len(list(cacheDir.iterdir())) == 2
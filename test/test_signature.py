@@ -0,0 +1,121 @@
+from jinja2 import Environment, FileSystemLoader
+
+from fashion.databaseAccess import DatabaseAccess
+from fashion.signature import RenderSignatures
+
+
+class TestSignature(object):
+
+    def makeDb(self, tmp_path):
+        dba = DatabaseAccess(tmp_path / "db.json")
+        dba.table("dummy.item").insert_multiple(
+            [{"name": "i{0}".format(i)} for i in range(3)])
+        return dba
+
+    def test_signature(self, tmp_path):
+        dba = self.makeDb(tmp_path)
+        sigs = RenderSignatures(dba)
+        items = dba.views("dummy.item")
+        sig, inputs = sigs.signature({"items": items, "title": "x"}, "tpl")
+        assert len(inputs) == 3
+        assert all(kind == "dummy.item" for kind, _ in inputs)
+        assert sigs.signature({"items": items, "title": "x"}, "tpl")[0] == sig
+        assert sigs.signature({"items": items, "title": "y"}, "tpl")[0] != sig
+        assert sigs.signature({"items": items, "title": "x"}, "tpl2")[0] != sig
+        # One record hash per record, however many outputs use it.
+        assert len(sigs.recordHashes) == 3
+        assert sigs.signature({"bad": object()}, "tpl") == (None, [])
+        dba.close()
+
+    def test_changedRecord(self, tmp_path):
+        dba = self.makeDb(tmp_path)
+        target = tmp_path / "out.txt"
+        sigs = RenderSignatures(dba)
+        sig, inputs = sigs.signature(dba.views("dummy.item"), "tpl")
+        assert not sigs.isCurrent(target, sig)
+        target.write_text("rendered")
+        sigs.store(target, sig, inputs)
+        assert sigs.isCurrent(target, sig)
+        # A later build, where one record changed.
+        dba.table("dummy.item").update({"name": "changed"}, doc_ids=[2])
+        sigs = RenderSignatures(dba)
+        assert sigs.isCurrent(target, sig)
+        newSig, inputs = sigs.signature(dba.views("dummy.item"), "tpl")
+        assert not sigs.isCurrent(target, newSig)
+        sigs.store(target, newSig, inputs)
+        assert len(dba.table("fashion.core.generate.signature")) == 1
+        target.unlink()
+        assert not sigs.isCurrent(target, newSig)
+        dba.close()
+
+    def test_contentHash(self, tmp_path):
+        dba = self.makeDb(tmp_path)
+        target = tmp_path / "out.txt"
+        sigs = RenderSignatures(dba)
+        sig, inputs = sigs.signature(dba.views("dummy.item"), "tpl")
+        assert sigs.contentHash(target) is None
+        sigs.store(target, sig, inputs, contentHash="abc")
+        assert RenderSignatures(dba).contentHash(target) == "abc"
+        sigs.store(target, sig, inputs)
+        assert sigs.contentHash(target) is None
+        dba.close()
+
+    def makeTemplates(self, tmp_path):
+        tdir = tmp_path / "template"
+        tdir.mkdir()
+        (tdir / "macros.j2").write_text("{% macro m(x) %}[{{ x }}]{% endmacro %}")
+        (tdir / "base.j2").write_text("{% block body %}{% endblock %}")
+        (tdir / "uses.j2").write_text(
+            "{% extends 'base.j2' %}{% import 'macros.j2' as mc %}"
+            "{% block body %}{{ mc.m(1) }}{% include 'part.j2' %}{% endblock %}")
+        (tdir / "part.j2").write_text("part")
+        (tdir / "plain.j2").write_text("plain")
+        (tdir / "unused.j2").write_text("unused")
+        (tdir / "dynamic.j2").write_text("{% include name %}")
+        return tdir
+
+    def test_templateSet(self, tmp_path):
+        dba = self.makeDb(tmp_path)
+        tdir = self.makeTemplates(tmp_path)
+
+        def keys():
+            env = Environment(loader=FileSystemLoader(str(tdir)))
+            sigs = RenderSignatures(dba)
+            return {n: sigs.templateSet(env, n) for n in ["uses.j2", "plain.j2"]}
+        before = keys()
+        key, templates = before["uses.j2"]
+        assert [t[0] for t in templates] == ["base.j2", "macros.j2", "part.j2", "uses.j2"]
+        assert templates[0][1] == (tdir / "base.j2").as_posix()
+        # Editing an unused template changes nothing, editing a macro file
+        # changes only the templates which import it.
+        (tdir / "unused.j2").write_text("changed")
+        assert keys() == before
+        (tdir / "macros.j2").write_text("{% macro m(x) %}({{ x }}){% endmacro %}")
+        after = keys()
+        assert after["uses.j2"][0] != key
+        assert after["plain.j2"] == before["plain.j2"]
+        env = Environment(loader=FileSystemLoader(str(tdir)))
+        assert RenderSignatures(dba).templateSet(env, "dynamic.j2") == (None, None)
+        assert RenderSignatures(dba).signature({}, None) == (None, [])
+        dba.close()
+
+    def test_storeTemplates(self, tmp_path):
+        dba = self.makeDb(tmp_path)
+        tdir = self.makeTemplates(tmp_path)
+        env = Environment(loader=FileSystemLoader(str(tdir)))
+        sigs = RenderSignatures(dba)
+        outputs = [tmp_path / "a.txt", tmp_path / "b.txt"]
+        for target, name in zip(outputs, ["uses.j2", "plain.j2"]):
+            key, templates = sigs.templateSet(env, name)
+            sig, inputs = sigs.signature({}, key)
+            sigs.store(target, sig, inputs, templates)
+        assert len(dba.table("fashion.core.generate.template")) == 5
+        sigs = RenderSignatures(dba)
+        assert sigs.dependents(tdir / "macros.j2") == [outputs[0].as_posix()]
+        assert sigs.dependents(tdir / "unused.j2") == []
+        # Storing again replaces the output's template records.
+        key, templates = sigs.templateSet(env, "plain.j2")
+        sigs.store(outputs[0], sigs.signature({}, key)[0], [], templates)
+        assert len(dba.table("fashion.core.generate.template")) == 2
+        assert sigs.dependents(tdir / "macros.j2") == []
+        dba.close()
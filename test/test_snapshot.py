@@ -0,0 +1,75 @@
+from concurrent.futures import ProcessPoolExecutor
+
+from tinydb import Query
+
+from fashion.databaseAccess import DatabaseAccess
+from fashion.modelAccess import ModelAccess
+from fashion.schema import SchemaRepository
+from fashion.snapshot import Snapshot, SnapshotModelAccess, applyResult
+
+
+class DummyContext(object):
+
+    def __init__(self):
+        self.name = "dummyContext"
+        self.inputKinds = ["dummy.in"]
+        self.outputKinds = ["dummy.out", "fashion.prime.trace"]
+
+
+def work(path):
+    '''Run an xform-like function in a worker process.'''
+    snap = Snapshot(path)
+    with SnapshotModelAccess(snap, DummyContext()) as mdb:
+        for m in mdb.search("dummy.in", Query().n > 2):
+            mdb.insert("dummy.out", {"n": m.n * 10},
+                       traceInputs=[["dummy.in", m.doc_id]])
+        assert mdb.getByKind("dummy.other") == []
+        assert mdb.insert("dummy.in", {"n": 0}) is None
+        result = mdb.result()
+    snap.close()
+    return result
+
+
+class TestSnapshot(object):
+
+    def makeDb(self, tmp_path):
+        dba = DatabaseAccess(tmp_path / "db.json")
+        dba.table("dummy.in").insert_multiple([{"n": i} for i in range(5)])
+        dba.table("dummy.other").insert({"secret": True})
+        return dba
+
+    def test_read(self, tmp_path):
+        dba = self.makeDb(tmp_path)
+        path = tmp_path / "wave.snap"
+        dba.publishSnapshot(path, ["dummy.in", "dummy.missing"])
+        snap = Snapshot(path)
+        assert snap.kinds() == {"dummy.in"}
+        views = snap.views("dummy.in")
+        assert [v.n for v in views] == [0, 1, 2, 3, 4]
+        assert views[2].doc_id == 3
+        assert snap.view("dummy.in", 4).n == 3
+        assert snap.view("dummy.in", 99) is None
+        assert snap.view("dummy.other", 1) is None
+        assert len(snap.views("dummy.in", Query().n >= 3)) == 2
+        snap.close()
+        dba.close()
+
+    def test_worker(self, tmp_path):
+        dba = self.makeDb(tmp_path)
+        path = str(tmp_path / "wave.snap")
+        dba.publishSnapshot(path, ["dummy.in"])
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            result = pool.submit(work, path).result()
+        with ModelAccess(dba, SchemaRepository(), DummyContext()) as mdb:
+            ids = applyResult(mdb, result)
+        outs = dba.views("dummy.out")
+        assert sorted(o.n for o in outs) == [30, 40]
+        traces = dba.views("fashion.prime.trace")
+        assert len(traces) == 2
+        assert {t.id for t in traces} == {o.doc_id for o in outs}
+        assert {t.inputs[0][1] for t in traces} == {4, 5}
+        assert all(id > 0 for id in ids.values())
+        ctx = dba.table("fashion.prime.context").all()[0]
+        assert sorted(ctx["search"]["dummy.in"]) == [4, 5]
+        assert len(ctx["insert"]["dummy.out"]) == 2
+        dba.close()
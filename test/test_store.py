@@ -0,0 +1,97 @@
+import json
+import os
+import zipfile
+
+import pytest
+
+from fashion.archive import MANIFEST, exportArchive
+from fashion.store import SegmentStore, linkFile
+
+
+class TestStore(object):
+
+    def makeZip(self, tmp_path, count=5):
+        segdir = tmp_path / "src" / "seg"
+        (segdir / "template").mkdir(parents=True)
+        (segdir / "segment.json").write_text('{"name": "seg"}')
+        for i in range(count):
+            (segdir / "template" / "t{0}.txt".format(i)).write_text(
+                "template {0}\n".format(i))
+        # Two files with the same contents share an object.
+        (segdir / "template" / "copy.txt").write_text("template 0\n")
+        zipname = tmp_path / "seg_v1.zip"
+        exportArchive(zipname, segdir, "seg")
+        return segdir, zipname
+
+    def test_add(self, tmp_path):
+        segdir, zipname = self.makeZip(tmp_path)
+        store = SegmentStore(tmp_path / "store")
+        assert not store.dir.exists()
+        assert store.add(zipname) == ("seg", 6)
+        assert store.add(zipname) == ("seg", 0)
+        stored = store.warehouseDir / "seg"
+        assert (stored / "template" / "t3.txt").read_text() == "template 3\n"
+        assert (stored / MANIFEST).exists()
+        # A new version only stores the changed file.
+        (segdir / "template" / "t3.txt").write_text("changed")
+        exportArchive(zipname, segdir, "seg")
+        assert store.add(zipname) == ("seg", 1)
+        assert (stored / "template" / "t3.txt").read_text() == "changed"
+
+    def test_install(self, tmp_path):
+        segdir, zipname = self.makeZip(tmp_path)
+        store = SegmentStore(tmp_path / "store")
+        store.add(zipname)
+        wh1 = tmp_path / "wh1"
+        wh2 = tmp_path / "wh2"
+        assert store.install("seg", wh1) == 7
+        assert store.install("seg", wh2) == 7
+        assert store.install("seg", wh2) == 0
+        assert store.install("other", wh2) is None
+        f1 = wh1 / "seg" / "template" / "t1.txt"
+        f2 = wh2 / "seg" / "template" / "t1.txt"
+        assert f1.read_text() == "template 1\n"
+        assert os.stat(str(f1)).st_ino == os.stat(str(f2)).st_ino
+        # Removed files are removed from installs.
+        (segdir / "template" / "t4.txt").unlink()
+        exportArchive(zipname, segdir, "seg")
+        store.add(zipname)
+        assert store.install("seg", wh1) == 0
+        assert not (wh1 / "seg" / "template" / "t4.txt").exists()
+
+    def test_linkFile(self, tmp_path):
+        src = tmp_path / "src.txt"
+        src.write_text("x")
+        dst = tmp_path / "dst.txt"
+        dst.write_text("old")
+        assert linkFile(src, dst) == "link"
+        assert dst.read_text() == "x"
+
+    def test_unsafe(self, tmp_path):
+        store = SegmentStore(tmp_path / "store")
+        zipname = tmp_path / "evil.zip"
+        with zipfile.ZipFile(str(zipname), "w") as zf:
+            zf.writestr("seg/ok.txt", "ok")
+            zf.writestr("seg/../../pwned.txt", "pwned")
+        with pytest.raises(ValueError):
+            store.add(zipname)
+        assert not (tmp_path / "pwned.txt").exists()
+        assert not store.dir.exists()
+        # A manifest naming a stored object doesn't stand in for the data.
+        segdir, goodZip = self.makeZip(tmp_path)
+        store.add(goodZip)
+        with zipfile.ZipFile(str(goodZip)) as zf:
+            manifest = zf.read("seg/" + MANIFEST)
+        h = json.loads(manifest)["files"]["template/t1.txt"]
+        with zipfile.ZipFile(str(zipname), "w") as zf:
+            zf.writestr("seg/" + MANIFEST, manifest)
+            zf.writestr("seg/template/t1.txt", "tampered")
+        assert store.add(zipname) == ("seg", 1)
+        assert store.segmentHashes("seg")["template/t1.txt"] != h
+        # Stored manifests are checked before installing.
+        (store.warehouseDir / "seg" / MANIFEST).write_text(json.dumps(
+            {"version": 1, "files": {"x.txt": "../../../pwned"}}))
+        with pytest.raises(ValueError):
+            store.install("seg", tmp_path / "wh")
+        with pytest.raises(ValueError):
+            store.install("..", tmp_path / "wh")
@@ -0,0 +1,74 @@
+import hashlib
+import os
+import random
+import tracemalloc
+
+import pytest
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from fashion.util import chunks, hashFile, poolSize, readAhead, reservoir, writeStream
+
+
+class TestUtil(object):
+
+    def test_readAhead(self):
+        '''Test results come back in order, with a small window.'''
+        items = list(range(20))
+        results = list(readAhead(lambda x: x * x, items, workers=3, window=2))
+        assert results == [(x, x * x) for x in items]
+
+    def test_readAheadEmpty(self):
+        assert list(readAhead(lambda x: x, [])) == []
+
+    def test_poolSize(self):
+        assert 5 <= poolSize(ThreadPoolExecutor) <= 32
+        assert poolSize(ProcessPoolExecutor) == (os.cpu_count() or 1)
+
+    def test_chunks(self):
+        assert list(chunks(range(7), 3)) == [[0, 1, 2], [3, 4, 5], [6]]
+        assert list(chunks([], 3)) == []
+
+    def test_reservoir(self):
+        assert reservoir(range(3), 5) == [0, 1, 2]
+        sample = reservoir(iter(range(1000)), 10, random.Random(1))
+        assert len(sample) == 10
+        assert len(set(sample)) == 10
+        assert max(sample) >= 100
+
+    def test_writeStream(self, tmp_path):
+        target = tmp_path / "out.txt"
+        digest, written = writeStream(["a", "b\n", "c"], target)
+        assert written and target.read_text() == "ab\nc"
+        assert digest == hashFile(target)
+        stat = target.stat()
+        # Unchanged contents leave the target alone.
+        assert writeStream(["ab\n", "c"], target) == (digest, False)
+        assert target.stat().st_ino == stat.st_ino
+        # A known digest of the target is trusted instead of hashing it.
+        assert writeStream(["ab\n", "c"], target, currentDigest=digest) == (digest, False)
+        assert writeStream(["ab\n", "c"], target, currentDigest="stale") == (digest, True)
+        assert target.read_text() == "ab\nc"
+        stat = target.stat()
+        assert not (tmp_path / "out.txt.tmp").exists()
+
+        def failing():
+            yield "partial"
+            raise ValueError("render error")
+        with pytest.raises(ValueError):
+            writeStream(failing(), target)
+        assert target.read_text() == "ab\nc"
+        assert not (tmp_path / "out.txt.tmp").exists()
+
+    def test_writeStreamMemory(self, tmp_path):
+        line = "x" * 99 + "\n"
+        count = 100000
+        tracemalloc.start()
+        try:
+            digest, _ = writeStream((line for _ in range(count)), tmp_path / "big.txt")
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        assert (tmp_path / "big.txt").stat().st_size == len(line) * count
+        assert digest == hashlib.sha256(line.encode() * count).hexdigest()
+        assert peak < len(line) * count // 10
@@ -1,3 +1,6 @@
+import shutil
+
+from fashion import codec
 from fashion.databaseAccess import DatabaseAccess
 from fashion.portfolio import FASHION_WAREHOUSE_PATH
 from fashion.warehouse import Warehouse
@@ -48,3 +51,91 @@ class TestWarehouse(object):
         segs = wh.loadSegments(dba)
         assert len(segs) == 1
         assert segs[0].properties.name == newSegName
+
+    def makeGuess(self, tmp_path, count):
+        dba = DatabaseAccess(tmp_path / "db.json")
+        wh = Warehouse(tmp_path)
+        wh.newSegment("local", dba)
+        dba.table("dummy.kind").insert_multiple(
+            [{"name": "m{0}".format(i), "size": i} for i in range(count)])
+        return dba, wh
+
+    def readGuess(self, wh, dba):
+        seg = wh.loadSegment("local", dba)
+        descr = seg.findSchema("dummy.kind")
+        schema = codec.loads((seg.absDirname / descr.filename).read_text())
+        return descr, schema
+
+    def test_guessSchema(self, tmp_path):
+        '''Test guessing a schema serially, in parallel and from a sample.'''
+        dba, wh = self.makeGuess(tmp_path, 50)
+        assert wh.guessSchema(dba, "dummy.kind")
+        descr, serial = self.readGuess(wh, dba)
+        assert serial["properties"]["size"]["type"] == "integer"
+        assert descr.examples["count"] == 50
+        assert wh.guessSchema(dba, "dummy.kind", workers=2)
+        wh.segmentCache = {}
+        assert self.readGuess(wh, dba)[1] == serial
+        assert wh.guessSchema(dba, "dummy.kind", sample=5)
+        wh.segmentCache = {}
+        assert self.readGuess(wh, dba)[1] == serial
+        assert len(wh.loadSegment("local", dba).properties.schema) == 1
+        assert not wh.guessSchema(dba, "no.kind")
+
+    def test_guessSchemaRefine(self, tmp_path):
+        '''Test refining a guessed schema from the examples added since.'''
+        dba, wh = self.makeGuess(tmp_path, 5)
+        assert wh.guessSchema(dba, "dummy.kind")
+        wh.segmentCache = {}
+        descr, schema = self.readGuess(wh, dba)
+        assert descr.examples["lastId"] == 5
+        assert descr.examples["count"] == 5
+        # Only examples after the high-water doc_id are added to the schema
+        # on file, so an edit to it is kept.
+        schema["properties"]["manual"] = {"type": "string"}
+        (wh.loadSegment("local", dba).absDirname / descr.filename).write_text(
+            codec.dumps(schema))
+        assert wh.guessSchema(dba, "dummy.kind", refine=True)
+        dba.table("dummy.kind").insert({"name": "new", "size": 1.5, "extra": True})
+        assert wh.guessSchema(dba, "dummy.kind", refine=True)
+        wh.segmentCache = {}
+        descr, schema = self.readGuess(wh, dba)
+        assert (descr.examples["lastId"], descr.examples["count"]) == (6, 6)
+        assert "manual" in schema["properties"]
+        assert "extra" in schema["properties"]
+        assert schema["properties"]["size"]["type"] == "number"
+        # Rebuilding the table renumbers it, so the schema is guessed afresh,
+        # dropping fields no example has.
+        docs = [d.toDict() for d in dba.views("dummy.kind") if d.name != "new"]
+        dba.table("dummy.kind").purge()
+        dba.table("dummy.kind").insert_multiple(reversed(docs))
+        assert wh.guessSchema(dba, "dummy.kind", refine=True)
+        wh.segmentCache = {}
+        descr, schema = self.readGuess(wh, dba)
+        assert (descr.examples["lastId"], descr.examples["count"]) == (5, 5)
+        assert set(schema["properties"]) == {"name", "size"}
+        assert schema["properties"]["size"]["type"] == "integer"
+
+    def test_segmentIndex(self, tmp_path):
+        '''Test resolving segments through the merged index.'''
+        dba = DatabaseAccess(tmp_path / "db.json")
+        (tmp_path / "fw").mkdir()
+        (tmp_path / "lw").mkdir()
+        fw = Warehouse(tmp_path / "fw")
+        fw.newSegment("shared", dba)
+        fw.newSegment("base", dba)
+        lw = Warehouse(tmp_path / "lw", fw)
+        lw.newSegment("shared", dba)
+        assert lw.listSegments() == ["shared"]
+        assert lw.listAllSegments() == ["shared", "base"]
+        assert lw.loadSegment("shared", dba).absDirname == tmp_path / "lw" / "shared"
+        assert [s.properties.name for s in lw.loadSegments(dba)] == ["shared", "base"]
+        assert len(dba.table('fashion.prime.segment')) == 2
+        stamp = lw.index.stamp
+        assert lw.loadSegment("base", dba) is lw.loadSegment("base", dba)
+        assert lw.index.stamp is stamp
+        # Removing the local segment behind the index's back uncovers the
+        # fallback segment, once the directory's mtime changes.
+        shutil.rmtree(str(tmp_path / "lw" / "shared"))
+        assert lw.loadSegment("shared", dba).absDirname == tmp_path / "fw" / "shared"
+        assert lw.loadSegment("missing", dba) is None
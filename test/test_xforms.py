@@ -0,0 +1,47 @@
+import json
+
+from munch import munchify
+
+from fashion.codeRegistry import CodeRegistry
+from fashion.databaseAccess import DatabaseAccess
+from fashion.modelAccess import ModelAccess
+from fashion.portfolio import FASHION_WAREHOUSE_PATH
+from fashion.schema import SchemaRepository
+from fashion.util import cd
+from fashion.xforms import XformModule
+
+
+class TestXforms(object):
+
+    def test_loadJSONBatch(self, tmp_path):
+        '''Test one batched loadJSON object loads a whole glob.'''
+        for i in range(10):
+            with (tmp_path / "m{0}.json".format(i)).open(mode="w") as fd:
+                fd.write(json.dumps({"index": i}))
+        dba = DatabaseAccess(tmp_path / "db.json")
+        segDir = FASHION_WAREHOUSE_PATH / "fashion.core"
+        mod = XformModule(munchify({
+            "moduleName": "fashion.core.loadJSON",
+            "filename": (segDir / "xform" / "loadJSON.py").as_posix()}))
+        assert mod.loadModuleCode()
+        cfg = munchify({
+            "moduleName": "fashion.core.loadJSON",
+            "tags": [],
+            "parameters": {
+                "filename": "m*.json",
+                "kind": "test.model",
+                "isList": False,
+                "batch": True}})
+        codeRegistry = CodeRegistry(dba)
+        codeRegistry.setObjectConfig(cfg)
+        with cd(tmp_path):
+            mod.init(cfg, codeRegistry)
+        assert len(codeRegistry.xformObjectsByName) == 1
+        xfo = list(codeRegistry.xformObjectsByName.values())[0]
+        with ModelAccess(dba, SchemaRepository(), xfo) as mdb:
+            codeRegistry.addService(mdb)
+            xfo.execute(codeRegistry)
+        models = dba.table("test.model").all()
+        assert sorted(m["index"] for m in models) == list(range(10))
+        assert len(dba.table("fashion.core.input.file").all()) == 10
+        dba.close()